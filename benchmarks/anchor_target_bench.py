@@ -0,0 +1,192 @@
+# --------------------------------------------------------
+# Step time of the RPN anchor target layer against the batch size
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+    python benchmarks/anchor_target_bench.py --cuda --bs 1 2 4 8 16
+    python benchmarks/anchor_target_bench.py --check --bs 1 2 4
+"""
+
+import _init_paths
+import argparse
+import time
+import numpy as np
+import torch
+
+from model.utils.config import cfg
+from model.rpn.anchor_target_layer import _AnchorTargetLayer, _unmap
+from model.rpn.bbox_transform import bbox_overlaps_batch, bbox_transform_batch
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the RPN anchor target layer')
+    parser.add_argument('--bs', dest='batch_sizes',
+                        help='batch sizes to time',
+                        default=[1, 2, 4, 8, 16], type=int, nargs='+')
+    parser.add_argument('--size', dest='size',
+                        help='image size, height width',
+                        default=[600, 1000], type=int, nargs=2)
+    parser.add_argument('--num_boxes', dest='num_boxes',
+                        help='gt boxes per image',
+                        default=20, type=int)
+    parser.add_argument('--iters', dest='iters',
+                        help='timed iterations per batch size',
+                        default=20, type=int)
+    parser.add_argument('--cuda', dest='cuda',
+                        help='whether use CUDA',
+                        action='store_true')
+    parser.add_argument('--check', dest='check',
+                        help='compare the outputs with the per-image loop, with nothing subsampled',
+                        action='store_true')
+
+    args = parser.parse_args()
+    return args
+
+
+def random_inputs(batch_size, height, width, num_boxes, device):
+    """
+    :return: (rpn_cls_score, gt_boxes, im_info, num_boxes) as _RPN feeds them to the layer
+    """
+    feat_stride = cfg.FEAT_STRIDE[0]
+    rpn_cls_score = torch.rand(batch_size, 18, height // feat_stride, width // feat_stride, device=device)
+    xy = torch.rand(batch_size, num_boxes, 2, device=device) * torch.tensor([width, height], device=device).float()
+    wh = torch.rand(batch_size, num_boxes, 2, device=device) * 200 + 16
+    x2y2 = torch.min(xy + wh, torch.tensor([width - 1, height - 1], device=device).float())
+    gt_boxes = torch.cat([xy, x2y2, torch.ones(batch_size, num_boxes, 1, device=device)], 2)
+    im_info = torch.tensor([[height, width, 1.]] * batch_size, device=device)
+    return rpn_cls_score, gt_boxes, im_info, torch.full((batch_size,), num_boxes, device=device)
+
+
+def loop_targets(layer, inputs):
+    """
+    the anchor targets of the per-image loop the layer had before it was batched, run on one image at a time:
+    the loop normalised the outside weights of all images by the anchors of the last one, the batched layer by
+    the anchors of each image, which is the same thing for a single image
+    :return: labels, bbox_targets, bbox_inside_weights, bbox_outside_weights of the batch
+    """
+    rpn_cls_score, gt_boxes, im_info, num_boxes = inputs
+    outputs = [loop_targets_single(layer, (rpn_cls_score[b:b + 1], gt_boxes[b:b + 1], im_info[b:b + 1],
+                                           num_boxes[b:b + 1]))
+               for b in range(gt_boxes.size(0))]
+    return [torch.cat(output, 0) for output in zip(*outputs)]
+
+
+def loop_targets_single(layer, inputs):
+    """ the forward of the per-image loop, subsampling included, for a batch of one image """
+    rpn_cls_score, gt_boxes, im_info, _ = inputs
+    height, width = rpn_cls_score.size(2), rpn_cls_score.size(3)
+    A = layer._num_anchors
+    all_anchors = layer._anchor_generator(height, width, layer._feat_stride, gt_boxes.device, gt_boxes.dtype)
+
+    keep = ((all_anchors[:, 0] >= -layer._allowed_border) &
+            (all_anchors[:, 1] >= -layer._allowed_border) &
+            (all_anchors[:, 2] < int(im_info[0][1]) + layer._allowed_border) &
+            (all_anchors[:, 3] < int(im_info[0][0]) + layer._allowed_border))
+    inds_inside = torch.nonzero(keep).view(-1)
+    anchors = all_anchors[inds_inside, :]
+
+    labels = gt_boxes.new_full((1, inds_inside.size(0)), -1)
+    bbox_inside_weights = gt_boxes.new_zeros((1, inds_inside.size(0)))
+    bbox_outside_weights = gt_boxes.new_zeros((1, inds_inside.size(0)))
+
+    overlaps = bbox_overlaps_batch(anchors, gt_boxes)
+    max_overlaps, argmax_overlaps = torch.max(overlaps, 2)
+    gt_max_overlaps, _ = torch.max(overlaps, 1)
+
+    if not cfg.TRAIN.RPN_CLOBBER_POSITIVES:
+        labels[max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP] = 0
+    gt_max_overlaps[gt_max_overlaps == 0] = 1e-5
+    keep = torch.sum(overlaps.eq(gt_max_overlaps.view(1, 1, -1).expand_as(overlaps)), 2)
+    if torch.sum(keep) > 0:
+        labels[keep > 0] = 1
+    labels[max_overlaps >= cfg.TRAIN.RPN_POSITIVE_OVERLAP] = 1
+    if cfg.TRAIN.RPN_CLOBBER_POSITIVES:
+        labels[max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP] = 0
+
+    num_fg = int(cfg.TRAIN.RPN_FG_FRACTION * cfg.TRAIN.RPN_BATCHSIZE)
+    fg_inds = torch.nonzero(labels[0] == 1).view(-1)
+    if fg_inds.size(0) > num_fg:
+        rand_num = torch.from_numpy(np.random.permutation(fg_inds.size(0))).to(fg_inds)
+        labels[0][fg_inds[rand_num[:fg_inds.size(0) - num_fg]]] = -1
+    num_bg = cfg.TRAIN.RPN_BATCHSIZE - torch.sum((labels == 1).int()).item()
+    bg_inds = torch.nonzero(labels[0] == 0).view(-1)
+    if bg_inds.size(0) > num_bg:
+        rand_num = torch.from_numpy(np.random.permutation(bg_inds.size(0))).to(bg_inds)
+        labels[0][bg_inds[rand_num[:bg_inds.size(0) - num_bg]]] = -1
+
+    bbox_targets = bbox_transform_batch(anchors, gt_boxes[0][argmax_overlaps.view(-1), :4].view(1, -1, 4))
+    bbox_inside_weights[labels == 1] = cfg.TRAIN.RPN_BBOX_INSIDE_WEIGHTS[0]
+
+    assert cfg.TRAIN.RPN_POSITIVE_WEIGHT < 0, 'the loop only supported RPN_POSITIVE_WEIGHT < 0'
+    num_examples = torch.sum(labels[0] >= 0).item()
+    bbox_outside_weights[labels == 1] = 1.0 / num_examples
+    bbox_outside_weights[labels == 0] = 1.0 / num_examples
+
+    total_anchors = all_anchors.size(0)
+    labels = _unmap(labels, total_anchors, inds_inside, 1, fill=-1)
+    bbox_targets = _unmap(bbox_targets, total_anchors, inds_inside, 1, fill=0)
+    bbox_inside_weights = _unmap(bbox_inside_weights, total_anchors, inds_inside, 1, fill=0)
+    bbox_outside_weights = _unmap(bbox_outside_weights, total_anchors, inds_inside, 1, fill=0)
+
+    labels = labels.view(1, height, width, A).permute(0, 3, 1, 2).contiguous().view(1, 1, A * height, width)
+    bbox_targets = bbox_targets.view(1, height, width, A * 4).permute(0, 3, 1, 2).contiguous()
+    bbox_inside_weights = bbox_inside_weights.view(1, height, width, A, 1).expand(1, height, width, A, 4)\
+        .contiguous().view(1, height, width, 4 * A).permute(0, 3, 1, 2).contiguous()
+    bbox_outside_weights = bbox_outside_weights.view(1, height, width, A, 1).expand(1, height, width, A, 4)\
+        .contiguous().view(1, height, width, 4 * A).permute(0, 3, 1, 2).contiguous()
+    return labels, bbox_targets, bbox_inside_weights, bbox_outside_weights
+
+
+def check(layer, inputs):
+    """
+    compare the layer with the per-image loop, with a RPN_BATCHSIZE above the number of anchors and a
+    RPN_FG_FRACTION of 1 nothing is subsampled and both are deterministic
+    """
+    batchsize, fg_fraction = cfg.TRAIN.RPN_BATCHSIZE, cfg.TRAIN.RPN_FG_FRACTION
+    cfg.TRAIN.RPN_BATCHSIZE, cfg.TRAIN.RPN_FG_FRACTION = 10 ** 9, 1.0
+    try:
+        outputs = layer(inputs)
+        reference = loop_targets(layer, inputs)
+    finally:
+        cfg.TRAIN.RPN_BATCHSIZE, cfg.TRAIN.RPN_FG_FRACTION = batchsize, fg_fraction
+
+    for name, output, ref in zip(['labels', 'bbox_targets', 'bbox_inside_weights', 'bbox_outside_weights'],
+                                 outputs, reference):
+        assert output.size() == ref.size(), '{}: size {} differs from {}'.format(name, output.size(), ref.size())
+        assert torch.allclose(output, ref, rtol=1e-6, atol=1e-6), \
+            '{}: differs by {:.2e}'.format(name, (output - ref).abs().max().item())
+    return (outputs[0] == 1).sum().item(), (outputs[0] == 0).sum().item()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    device = torch.device('cuda' if args.cuda else 'cpu')
+    layer = _AnchorTargetLayer(cfg.FEAT_STRIDE[0], cfg.ANCHOR_SCALES, cfg.ANCHOR_RATIOS).to(device)
+
+    def sync():
+        if args.cuda:
+            torch.cuda.synchronize()
+
+    print('{:>6s} {:>12s} {:>16s}'.format('batch', 'ms / step', 'ms / image'))
+    for batch_size in args.batch_sizes:
+        inputs = random_inputs(batch_size, args.size[0], args.size[1], args.num_boxes, device)
+        if args.check:
+            num_fg, num_bg = check(layer, inputs)
+            print('{:>6d} same labels, targets and weights as the loop ({:d} fg, {:d} bg)'.format(
+                batch_size, num_fg, num_bg))
+        for _ in range(3):
+            layer(inputs)
+        sync()
+
+        times = []
+        for _ in range(args.iters):
+            tic = time.time()
+            layer(inputs)
+            sync()
+            times.append(time.time() - tic)
+        step = np.median(times) * 1000
+        print('{:>6d} {:>12.2f} {:>16.2f}'.format(batch_size, step, step / batch_size))
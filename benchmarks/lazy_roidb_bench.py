@@ -0,0 +1,67 @@
+# --------------------------------------------------------
+# Lazy vs eager training roidb
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+    python benchmarks/lazy_roidb_bench.py --imdb voc_2007_trainval
+"""
+
+import _init_paths
+import argparse
+import time
+import numpy as np
+import scipy.sparse
+
+from model.utils.config import cfg
+from roi_data_layer.roidb import combined_roidb
+from roi_data_layer.lazy_roidb import LazyRoidb
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Check the lazy training roidb against the eager one and time both')
+    parser.add_argument('--imdb', dest='imdb_name',
+                        help='training image set',
+                        default='voc_2007_trainval', type=str)
+
+    args = parser.parse_args()
+    return args
+
+
+def build(imdb_name, lazy, flipped):
+    """
+    :return: (seconds, roidb, ratio_list, ratio_index) of combined_roidb()
+    """
+    cfg.TRAIN.LAZY_ROIDB = lazy
+    cfg.TRAIN.USE_FLIPPED = flipped
+    tic = time.time()
+    _, roidb, ratio_list, ratio_index = combined_roidb(imdb_name)
+    return time.time() - tic, roidb, ratio_list, ratio_index
+
+
+def assert_same_entry(eager, lazy, i):
+    """ every field of the eager entry is in the lazy entry, with the same values and dtype """
+    for key, value in eager.items():
+        assert key in lazy, 'entry {:d}: lazy entry has no {}'.format(i, key)
+        a = value.toarray() if scipy.sparse.issparse(value) else np.asarray(value)
+        b = lazy[key].toarray() if scipy.sparse.issparse(lazy[key]) else np.asarray(lazy[key])
+        assert a.dtype == b.dtype and np.array_equal(a, b), 'entry {:d}: {} differs: {} vs {}'.format(i, key, a, b)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    print('{:>8s} {:>10s} {:>10s} {:>10s}'.format('flipped', 'entries', 'eager s', 'lazy s'))
+    for flipped in [False, True]:
+        eager_time, eager, eager_ratio, eager_index = build(args.imdb_name, False, flipped)
+        lazy_time, lazy, lazy_ratio, lazy_index = build(args.imdb_name, True, flipped)
+        assert isinstance(lazy, LazyRoidb), 'the image set has no annotation store, there is no lazy roidb'
+        assert len(eager) == len(lazy), 'eager roidb has {:d} entries, lazy roidb {:d}'.format(len(eager), len(lazy))
+        assert np.array_equal(eager_ratio, lazy_ratio) and np.array_equal(eager_index, lazy_index), 'ratios differ'
+        for i in range(len(eager)):
+            assert_same_entry(eager[i], lazy[i], i)
+
+        print('{:>8s} {:>10d} {:>10.2f} {:>10.2f}'.format(str(flipped), len(eager), eager_time, lazy_time))
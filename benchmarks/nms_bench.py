@@ -0,0 +1,91 @@
+# --------------------------------------------------------
+# CPU NMS kernels on RPN-like proposals
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+    python benchmarks/nms_bench.py --num_boxes 1000 6000 12000 --max_keep 300
+"""
+
+import _init_paths
+import argparse
+import time
+import numpy as np
+import torch
+
+from model import _C
+from model.nms.nms_cpu import nms_cpu
+from model.roi_layers import nms_torch
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the CPU NMS kernels')
+    parser.add_argument('--num_boxes', dest='num_boxes',
+                        help='numbers of boxes to time',
+                        default=[1000, 6000, 12000], type=int, nargs='+')
+    parser.add_argument('--thresh', dest='thresh',
+                        help='IoU threshold',
+                        default=0.7, type=float)
+    parser.add_argument('--max_keep', dest='max_keep',
+                        help='also time the early termination after max_keep boxes, e.g. RPN_POST_NMS_TOP_N',
+                        default=300, type=int)
+    parser.add_argument('--iters', dest='iters',
+                        help='timed iterations per kernel',
+                        default=10, type=int)
+    parser.add_argument('--threads', dest='threads',
+                        help='number of threads of the kernels, default is torch.get_num_threads()',
+                        default=0, type=int)
+
+    args = parser.parse_args()
+    return args
+
+
+def random_proposals(num_boxes, width=1000, height=600):
+    """
+    boxes clustered around a few objects, as the RPN proposals are
+    :return: 2D tensor (num_boxes, 4), each row is [x1, y1, x2, y2], and 1D tensor (num_boxes) of scores
+    """
+    centers = torch.rand(max(num_boxes // 100, 1), 2) * torch.tensor([width, height]).float()
+    ctr = centers[torch.randint(0, centers.size(0), (num_boxes,))] + torch.randn(num_boxes, 2) * 30
+    wh = torch.rand(num_boxes, 2) * 200 + 16
+    boxes = torch.cat([ctr - wh / 2, ctr + wh / 2], 1)
+    boxes[:, 0::2] = boxes[:, 0::2].clamp(0, width - 1)
+    boxes[:, 1::2] = boxes[:, 1::2].clamp(0, height - 1)
+    return boxes.contiguous(), torch.rand(num_boxes)
+
+
+def timeit(fn, iters):
+    fn()
+    times = []
+    for _ in range(iters):
+        tic = time.time()
+        fn()
+        times.append(time.time() - tic)
+    return np.median(times) * 1000
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    print('threads: {:d}'.format(torch.get_num_threads()))
+
+    kernels = [('scalar (previous)', lambda b, s: _C.nms_cpu_scalar(b, s, args.thresh)),
+               ('blocked', lambda b, s: _C.nms(b, s, args.thresh)),
+               ('blocked, max_keep={:d}'.format(args.max_keep), lambda b, s: _C.nms(b, s, args.thresh, args.max_keep)),
+               ('pure torch', lambda b, s: nms_torch(b, s, args.thresh)),
+               ('numpy nms_cpu.py', lambda b, s: nms_cpu(torch.cat([b, s.unsqueeze(1)], 1), args.thresh))]
+
+    print('{:>8s} {:>26s} {:>10s} {:>8s}'.format('boxes', 'kernel', 'ms', 'kept'))
+    for num_boxes in args.num_boxes:
+        boxes, scores = random_proposals(num_boxes)
+        reference = _C.nms_cpu_scalar(boxes, scores, args.thresh)
+        assert torch.equal(_C.nms(boxes, scores, args.thresh), reference), 'blocked kernel differs from the scalar one'
+        assert torch.equal(nms_torch(boxes, scores, args.thresh), reference), 'pure torch nms differs from the scalar one'
+
+        for name, kernel in kernels:
+            ms = timeit(lambda: kernel(boxes, scores), args.iters)
+            print('{:>8d} {:>26s} {:>10.2f} {:>8d}'.format(num_boxes, name, ms, len(kernel(boxes, scores))))
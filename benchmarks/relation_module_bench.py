@@ -0,0 +1,131 @@
+# --------------------------------------------------------
+# Stacked RelationModule vs the loop over RelationUnit
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+    python benchmarks/relation_module_bench.py --num_rois 128 --batch_size 1
+"""
+
+import _init_paths
+import argparse
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+from model.relation_module.relation_module import RelationModule
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Check the stacked RelationModule against the old RelationUnit loop')
+    parser.add_argument('--num_rois', dest='num_rois',
+                        help='number of proposals of each image',
+                        default=128, type=int)
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='number of images',
+                        default=2, type=int)
+    parser.add_argument('--iters', dest='iters',
+                        help='timed iterations',
+                        default=10, type=int)
+
+    args = parser.parse_args()
+    return args
+
+
+class RelationUnit(nn.Module):
+    """ one head of the relation module before the heads were stacked, as the old checkpoints hold them """
+
+    def __init__(self, appearance_feature_dim=2048, key_feature_dim=128, geo_feature_dim=128):
+        super(RelationUnit, self).__init__()
+        self.dim_k = key_feature_dim
+        self.WG = nn.Linear(geo_feature_dim, 1, bias=True)
+        self.WK = nn.Linear(appearance_feature_dim, key_feature_dim, bias=True)
+        self.WQ = nn.Linear(appearance_feature_dim, key_feature_dim, bias=True)
+        self.WV = nn.Linear(appearance_feature_dim, key_feature_dim, bias=True)
+        self.relu = nn.ReLU(inplace=True)
+        self.layer_norm = nn.LayerNorm(key_feature_dim, eps=1e-6)
+        self.W1 = nn.Linear(key_feature_dim, key_feature_dim)
+        self.W2 = nn.Linear(key_feature_dim, key_feature_dim)
+
+    def forward(self, app_feature, position_embedding):
+        N, _ = app_feature.size()
+        scaled_dot = torch.mm(self.WQ(app_feature), self.WK(app_feature).transpose(0, 1)) / np.sqrt(self.dim_k)
+        w_g = self.relu(self.WG(position_embedding)).view(N, N)
+        w_mn = torch.nn.Softmax(dim=1)(scaled_dot.view(N, N) + w_g)
+        attention = torch.mm(w_mn, self.WV(app_feature))
+        return self.W2(nn.functional.relu(self.W1(self.layer_norm(attention))))
+
+
+class RelationUnits(nn.Module):
+    """ the old RelationModule: 16 RelationUnit run one after the other, for one image at a time """
+
+    def __init__(self, n_relations=16):
+        super(RelationUnits, self).__init__()
+        self.relation = nn.ModuleList([RelationUnit() for _ in range(n_relations)])
+
+    def forward(self, app_feature, position_embedding):
+        return torch.cat([unit(app_feature, position_embedding) for unit in self.relation], -1)
+
+
+def random_rois(batch_size, num_rois, width=1000, height=600):
+    """ :return: 3D tensor (batch, num_rois, 5), each row is [batch_index, x1, y1, x2, y2] """
+    xy = torch.rand(batch_size, num_rois, 2) * torch.tensor([width, height]).float()
+    wh = torch.rand(batch_size, num_rois, 2) * 300 + 1
+    index = torch.arange(batch_size).float().view(-1, 1, 1).expand(batch_size, num_rois, 1)
+    return torch.cat([index, xy, xy + wh], 2)
+
+
+def old_forward(units, fused, app_feature, rois):
+    """ the loop over the units, image by image, on the position embedding of the stacked module """
+    position_embedding = fused.PositionalEmbedding(rois)
+    num_rois = rois.size(1)
+    return torch.cat([units(app_feature[b * num_rois:(b + 1) * num_rois], position_embedding[b])
+                      for b in range(rois.size(0))], 0)
+
+
+def timeit(fn, iters):
+    fn()
+    times = []
+    for _ in range(iters):
+        tic = time.time()
+        fn()
+        times.append(time.time() - tic)
+    return np.median(times) * 1000
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    torch.manual_seed(0)
+
+    units = RelationUnits()
+    for param in units.parameters():    # the LayerNorm of a new unit is the identity, randomise it too
+        if param.dim() > 1:
+            nn.init.uniform_(param, -0.05, 0.05)
+        else:
+            nn.init.uniform_(param, -0.5, 0.5)
+    fused = RelationModule()
+    fused.load_state_dict(units.state_dict())    # converted by fuse_relation_units()
+
+    app_feature = torch.randn(args.batch_size * args.num_rois, 2048, requires_grad=True)
+    rois = random_rois(args.batch_size, args.num_rois)
+
+    reference = old_forward(units, fused, app_feature, rois)
+    output = fused(app_feature, rois)
+    assert torch.allclose(output, reference, rtol=1e-4, atol=1e-5), \
+        'outputs differ by {:.2e}'.format((output - reference).abs().max().item())
+
+    grad = torch.randn_like(output)
+    reference_grad = torch.autograd.grad(reference, app_feature, grad)[0]
+    output_grad = torch.autograd.grad(output, app_feature, grad)[0]
+    assert torch.allclose(output_grad, reference_grad, rtol=1e-4, atol=1e-5), \
+        'gradients differ by {:.2e}'.format((output_grad - reference_grad).abs().max().item())
+
+    with torch.no_grad():
+        ms_old = timeit(lambda: old_forward(units, fused, app_feature, rois), args.iters)
+        ms_fused = timeit(lambda: fused(app_feature, rois), args.iters)
+    print('{:d} x {:d} rois: units loop {:.2f} ms, stacked {:.2f} ms, max difference {:.2e}'.format(
+        args.batch_size, args.num_rois, ms_old, ms_fused, (output - reference).abs().max().item()))
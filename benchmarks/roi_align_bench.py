@@ -0,0 +1,94 @@
+# --------------------------------------------------------
+# CPU ROIAlign forward kernels on RPN-like RoIs
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+    python benchmarks/roi_align_bench.py --num_rois 64 300 1000 --feat_sizes 38x50 75x100 --channels 1024
+"""
+
+import _init_paths
+import argparse
+import time
+import numpy as np
+import torch
+
+from model import _C
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the CPU ROIAlign forward kernels')
+    parser.add_argument('--num_rois', dest='num_rois',
+                        help='numbers of RoIs to time',
+                        default=[64, 300, 1000], type=int, nargs='+')
+    parser.add_argument('--feat_sizes', dest='feat_sizes',
+                        help='feature map sizes to time, HxW',
+                        default=['38x50', '75x100'], type=str, nargs='+')
+    parser.add_argument('--channels', dest='channels',
+                        help='channels of the feature map, 1024 for res101 conv4',
+                        default=1024, type=int)
+    parser.add_argument('--pooling_size', dest='pooling_size',
+                        help='pooled height and width, cfg.POOLING_SIZE',
+                        default=7, type=int)
+    parser.add_argument('--sampling_ratio', dest='sampling_ratio',
+                        help='sampling points per bin and axis, 0 for adaptive',
+                        default=0, type=int)
+    parser.add_argument('--iters', dest='iters',
+                        help='timed iterations per kernel',
+                        default=5, type=int)
+    parser.add_argument('--threads', dest='threads',
+                        help='number of threads of the kernels, default is torch.get_num_threads()',
+                        default=0, type=int)
+
+    args = parser.parse_args()
+    return args
+
+
+def random_rois(num_rois, feat_height, feat_width, feat_stride=16):
+    """
+    :return: 2D tensor (num_rois, 5), each row is [batch_ind, x1, y1, x2, y2] in image coordinates
+    """
+    width, height = feat_width * feat_stride, feat_height * feat_stride
+    wh = torch.rand(num_rois, 2) * torch.tensor([width, height]).float() / 2 + 16
+    xy = torch.rand(num_rois, 2) * (torch.tensor([width, height]).float() - wh)
+    return torch.cat([torch.zeros(num_rois, 1), xy, xy + wh], 1).contiguous()
+
+
+def timeit(fn, iters):
+    fn()
+    times = []
+    for _ in range(iters):
+        tic = time.time()
+        fn()
+        times.append(time.time() - tic)
+    return np.median(times) * 1000
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    print('threads: {:d}'.format(torch.get_num_threads()))
+
+    size, scale, ratio = args.pooling_size, 1.0 / 16.0, args.sampling_ratio
+    kernels = [('serial (previous)', lambda f, r: _C.roi_align_forward_cpu_reference(f, r, scale, size, size, ratio)),
+               ('parallel', lambda f, r: _C.roi_align_forward(f, r, scale, size, size, ratio)),
+               ('parallel, channels_last', lambda f, r: _C.roi_align_forward(
+                   f.contiguous(memory_format=torch.channels_last), r, scale, size, size, ratio))]
+
+    print('{:>10s} {:>6s} {:>26s} {:>10s}'.format('feature', 'rois', 'kernel', 'ms'))
+    for feat_size in args.feat_sizes:
+        feat_height, feat_width = [int(x) for x in feat_size.split('x')]
+        features = torch.randn(1, args.channels, feat_height, feat_width)
+        for num_rois in args.num_rois:
+            rois = random_rois(num_rois, feat_height, feat_width)
+            reference = kernels[0][1](features, rois)
+            for name, kernel in kernels[1:]:
+                assert torch.equal(kernel(features, rois), reference), '{} kernel differs from the serial one'.format(name)
+
+            for name, kernel in kernels:
+                ms = timeit(lambda: kernel(features, rois), args.iters)
+                print('{:>10s} {:>6d} {:>26s} {:>10.2f}'.format(feat_size, num_rois, name, ms))
@@ -0,0 +1,133 @@
+# --------------------------------------------------------
+# Vectorised hand AP evaluation vs the per-detection loop
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+    python benchmarks/voc_eval_bench.py --num_images 2000 --thresholds 0.5 0.75
+"""
+
+import _init_paths
+import argparse
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import numpy as np
+
+from datasets.voc_eval import HAND_CONSTRAINTS, voc_eval_hand_all, voc_eval_hand_reference
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Check voc_eval_hand_all against the per-detection loop')
+    parser.add_argument('--num_images', dest='num_images',
+                        help='number of synthetic images',
+                        default=2000, type=int)
+    parser.add_argument('--thresholds', dest='thresholds',
+                        help='overlap thresholds',
+                        default=[0.5, 0.75], type=float, nargs='+')
+    parser.add_argument('--num_workers', dest='num_workers',
+                        help='matching processes of voc_eval_hand_all',
+                        default=0, type=int)
+
+    args = parser.parse_args()
+    return args
+
+
+def random_box(rng, width=600, height=400):
+    x1, y1 = rng.randint(0, width - 60), rng.randint(0, height - 60)
+    return [x1, y1, x1 + rng.randint(10, 60) // 5 * 5, y1 + rng.randint(10, 60) // 5 * 5]
+
+
+def jitter(rng, box, pixels):
+    """ a detection near a gt box, the coordinates are on a coarse grid so that IoU ties happen """
+    box = np.array(box, dtype=float) + rng.randint(-pixels, pixels + 1, 4) // 3 * 3
+    box[2] = max(box[2], box[0] + 1)
+    box[3] = max(box[3], box[1] + 1)
+    return box
+
+
+def synthetic_set(out_dir, num_images, seed=0):
+    """
+    gt labels (the pkl cache of parse_rec) and hand / target detection files of random images: duplicated,
+    missed, wrong-state, wrong-side and background detections, difficult gts, hands with and without a target
+    :return: detpath, imagesetfile
+    """
+    rng = np.random.RandomState(seed)
+    imagenames = ['img{:06d}'.format(i) for i in range(num_images)]
+    imagesetfile = os.path.join(out_dir, 'test.txt')
+    with open(imagesetfile, 'w') as f:
+        f.write('\n'.join(imagenames) + '\n')
+
+    recs = {}
+    for imagename in imagenames:
+        recs[imagename] = [{'name': 'hand' if rng.rand() < 0.7 else 'targetobject',
+                            'difficult': int(rng.rand() < 0.1),
+                            'bbox': random_box(rng),
+                            'handstate': rng.randint(0, 5),
+                            'leftright': rng.randint(0, 2),
+                            'objectbbox': random_box(rng) if rng.rand() < 0.6 else None}
+                           for _ in range(rng.randint(0, 5))]
+    with open(os.path.join(out_dir, '%s_annots.pkl' % imagesetfile), 'wb') as f:
+        pickle.dump(recs, f)
+
+    hands, objects = [], []
+    for imagename in imagenames:
+        for obj in recs[imagename]:
+            for _ in range(rng.randint(0, 3)):
+                box = jitter(rng, obj['bbox'], 4)
+                state = rng.randint(0, 5) if rng.rand() < 0.5 else obj['handstate']
+                hands.append('{} {:.2f} {:.1f} {:.1f} {:.1f} {:.1f} {:d} {:.3f} {:.3f} {:.3f} {:d} 1'.format(
+                    imagename, rng.randint(0, 20) / 20., box[0], box[1], box[2], box[3], state, rng.rand() * 0.01,
+                    rng.randn(), rng.randn(), rng.randint(0, 2)))
+            if obj['objectbbox'] is not None and rng.rand() < 0.8:
+                box = jitter(rng, obj['objectbbox'], 5)
+                objects.append('{} {:.2f} {:.1f} {:.1f} {:.1f} {:.1f} 0 0 0 0 0 1'.format(
+                    imagename, rng.rand(), box[0], box[1], box[2], box[3]))
+        for _ in range(rng.randint(0, 3)):
+            box = random_box(rng)
+            hands.append('{} {:.2f} {:.1f} {:.1f} {:.1f} {:.1f} {:d} 0.001 0 0 0 1'.format(
+                imagename, rng.randint(0, 20) / 20., box[0], box[1], box[2], box[3], rng.randint(0, 5)))
+
+    rng.shuffle(hands)
+    rng.shuffle(objects)
+    detpath = os.path.join(out_dir, 'det_test_{:s}.txt')
+    for classname, lines in [('hand', hands), ('targetobject', objects)]:
+        with open(detpath.format(classname), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return detpath, imagesetfile
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    out_dir = tempfile.mkdtemp()
+    try:
+        detpath, imagesetfile = synthetic_set(out_dir, args.num_images)
+
+        tic = time.time()
+        reference = {(constraint, ovthresh): voc_eval_hand_reference(detpath, None, imagesetfile, 'hand', out_dir,
+                                                                     ovthresh, constraint=constraint)
+                     for constraint in HAND_CONSTRAINTS for ovthresh in args.thresholds}
+        reference_time = time.time() - tic
+
+        tic = time.time()
+        results = voc_eval_hand_all(detpath, None, imagesetfile, 'hand', out_dir, args.thresholds,
+                                    num_workers=args.num_workers)
+        vectorised_time = time.time() - tic
+    finally:
+        shutil.rmtree(out_dir)
+
+    print('{:>12s} {:>8s} {:>8s}'.format('constraint', 'thresh', 'ap'))
+    for key in sorted(reference):
+        recall, precision, ap = results[key]
+        ref_recall, ref_precision, ref_ap = reference[key]
+        assert np.array_equal(recall, ref_recall), '{}: recall differs'.format(key)
+        assert np.array_equal(precision, ref_precision), '{}: precision differs'.format(key)
+        assert ap == ref_ap, '{}: ap {} differs from {}'.format(key, ap, ref_ap)
+        print('{:>12s} {:>8.2f} {:>8.4f}'.format(repr(key[0]), key[1], ap))
+    print('{:d} images: per-detection loop {:.2f}s, voc_eval_hand_all {:.2f}s'.format(
+        args.num_images, reference_time, vectorised_time))
@@ -29,14 +29,8 @@ import torchvision.datasets as dset
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
-from model.rpn.bbox_transform import clip_boxes
-# from model.nms.nms_wrapper import nms
-from model.roi_layers import nms
-from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import save_net, load_net, vis_detections, vis_detections_PIL, vis_detections_filtered_objects_PIL, vis_detections_filtered_objects # (1) here add a function to viz
-from model.utils.blob import im_list_to_blob
-from model.faster_rcnn.vgg16 import vgg16
-from model.faster_rcnn.resnet import resnet
+from model.inference import HandObjectDetector
 import pdb
 
 try:
@@ -101,6 +95,12 @@ def parse_args():
   parser.add_argument('--webcam_num', dest='webcam_num',
                       help='webcam ID number',
                       default=-1, type=int)
+  parser.add_argument('--fuse', dest='fuse',
+                      help='fold the BatchNorm of the backbone into the convs and use channels last',
+                      action='store_true')
+  parser.add_argument('--quantize', dest='quantize',
+                      help='CPU quantisation mode: dynamic, fp16 or static (calibrated by quantize_net.py)',
+                      default=None, type=str)
   parser.add_argument('--thresh_hand',
                       type=float, default=0.5,
                       required=False)
@@ -115,40 +115,6 @@ lr = cfg.TRAIN.LEARNING_RATE
 momentum = cfg.TRAIN.MOMENTUM
 weight_decay = cfg.TRAIN.WEIGHT_DECAY
 
-def _get_image_blob(im):
-  """Converts an image into a network input.
-  Arguments:
-    im (ndarray): a color image in BGR order
-  Returns:
-    blob (ndarray): a data blob holding an image pyramid
-    im_scale_factors (list): list of image scales (relative to im) used
-      in the image pyramid
-  """
-  im_orig = im.astype(np.float32, copy=True)
-  im_orig -= cfg.PIXEL_MEANS
-
-  im_shape = im_orig.shape
-  im_size_min = np.min(im_shape[0:2])
-  im_size_max = np.max(im_shape[0:2])
-
-  processed_ims = []
-  im_scale_factors = []
-
-  for target_size in cfg.TEST.SCALES:
-    im_scale = float(target_size) / float(im_size_min)
-    # Prevent the biggest axis from being more than MAX_SIZE
-    if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:
-      im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
-    im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale,
-            interpolation=cv2.INTER_LINEAR)
-    im_scale_factors.append(im_scale)
-    processed_ims.append(im)
-
-  # Create a blob to hold the input images
-  blob = im_list_to_blob(processed_ims)
-
-  return blob, np.array(im_scale_factors)
-
 if __name__ == '__main__':
 
   args = parse_args()
@@ -161,7 +127,6 @@ if __name__ == '__main__':
   if args.set_cfgs is not None:
     cfg_from_list(args.set_cfgs)
 
-  cfg.USE_GPU_NMS = args.cuda
   np.random.seed(cfg.RNG_SEED)
 
   # load model
@@ -173,55 +138,12 @@ if __name__ == '__main__':
   pascal_classes = np.asarray(['__background__', 'targetobject', 'hand']) 
   args.set_cfgs = ['ANCHOR_SCALES', '[8, 16, 32, 64]', 'ANCHOR_RATIOS', '[0.5, 1, 2]'] 
 
-  # initilize the network here.
-  if args.net == 'vgg16':
-    fasterRCNN = vgg16(pascal_classes, pretrained=False, class_agnostic=args.class_agnostic)
-  elif args.net == 'res101':
-    fasterRCNN = resnet(pascal_classes, 101, pretrained=False, class_agnostic=args.class_agnostic)
-  elif args.net == 'res50':
-    fasterRCNN = resnet(pascal_classes, 50, pretrained=False, class_agnostic=args.class_agnostic)
-  elif args.net == 'res152':
-    fasterRCNN = resnet(pascal_classes, 152, pretrained=False, class_agnostic=args.class_agnostic)
-  else:
-    print("network is not defined")
-    pdb.set_trace()
-
-  fasterRCNN.create_architecture()
-
-  print("load checkpoint %s" % (load_name))
-  if args.cuda > 0:
-    checkpoint = torch.load(load_name)
-  else:
-    checkpoint = torch.load(load_name, map_location=(lambda storage, loc: storage))
-  fasterRCNN.load_state_dict(checkpoint['model'])
-  if 'pooling_mode' in checkpoint.keys():
-    cfg.POOLING_MODE = checkpoint['pooling_mode']
-
-  print('load model successfully!')
-
-
-  # initilize the tensor holder here.
-  im_data = torch.FloatTensor(1)
-  im_info = torch.FloatTensor(1)
-  num_boxes = torch.LongTensor(1)
-  gt_boxes = torch.FloatTensor(1)
-  box_info = torch.FloatTensor(1) 
-
-  # ship to cuda
-  if args.cuda > 0:
-    im_data = im_data.cuda()
-    im_info = im_info.cuda()
-    num_boxes = num_boxes.cuda()
-    gt_boxes = gt_boxes.cuda()
+  # initilize the network and the tensor holders here.
+  detector = HandObjectDetector(load_name, args.net, pascal_classes, args.class_agnostic, cuda=args.cuda,
+                                thresh_hand=args.thresh_hand, thresh_obj=args.thresh_obj, fuse=args.fuse,
+                                quantize=args.quantize)
 
   with torch.no_grad():
-    if args.cuda > 0:
-      cfg.CUDA = True
-
-    if args.cuda > 0:
-      fasterRCNN.cuda()
-
-    fasterRCNN.eval()
 
     start = time.time()
     max_per_image = 100
@@ -248,153 +170,62 @@ if __name__ == '__main__':
 
     while (num_images >= 0):
         total_tic = time.time()
-        if webcam_num == -1:
-          num_images -= 1
 
-        # Get image from the webcam
+        # Get image from the webcam, or a batch of --bs images from the image directory
+        ims, im_names = [], []
         if webcam_num >= 0:
           if not cap.isOpened():
             raise RuntimeError("Webcam could not open. Please check connection.")
           ret, frame = cap.read()
-          im_in = np.array(frame)
-        # Load the demo image
+          ims.append(np.array(frame))
+        # Load the demo images
         else:
-          im_file = os.path.join(args.image_dir, imglist[num_images])
-          im_in = cv2.imread(im_file)
-        # bgr
-        im = im_in
-
-        blobs, im_scales = _get_image_blob(im)
-        assert len(im_scales) == 1, "Only single-image batch implemented"
-        im_blob = blobs
-        im_info_np = np.array([[im_blob.shape[1], im_blob.shape[2], im_scales[0]]], dtype=np.float32)
-
-        im_data_pt = torch.from_numpy(im_blob)
-        im_data_pt = im_data_pt.permute(0, 3, 1, 2)
-        im_info_pt = torch.from_numpy(im_info_np)
+          while num_images > 0 and len(ims) < args.batch_size:
+            num_images -= 1
+            im_file = os.path.join(args.image_dir, imglist[num_images])
+            ims.append(cv2.imread(im_file))    # bgr
+            im_names.append(imglist[num_images])
+          if len(ims) == 0:
+            break
+        batch_size = len(ims)
 
-        with torch.no_grad():
-                im_data.resize_(im_data_pt.size()).copy_(im_data_pt)
-                im_info.resize_(im_info_pt.size()).copy_(im_info_pt)
-                gt_boxes.resize_(1, 1, 5).zero_()
-                num_boxes.resize_(1).zero_()
-                box_info.resize_(1, 1, 5).zero_() 
-
-        # pdb.set_trace()
         det_tic = time.time()
-
-        rois, cls_prob, bbox_pred, \
-        rpn_loss_cls, rpn_loss_box, \
-        RCNN_loss_cls, RCNN_loss_bbox, \
-        rois_label, loss_list = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, box_info) 
-
-        scores = cls_prob.data
-        boxes = rois.data[:, :, 1:5]
-
-        # extact predicted params
-        contact_vector = loss_list[0][0] # hand contact state info
-        offset_vector = loss_list[1][0].detach() # offset vector (factored into a unit vector and a magnitude)
-        lr_vector = loss_list[2][0].detach() # hand side info (left/right)
-
-        # get hand contact 
-        _, contact_indices = torch.max(contact_vector, 2)
-        contact_indices = contact_indices.squeeze(0).unsqueeze(-1).float()
-
-        # get hand side 
-        lr = torch.sigmoid(lr_vector) > 0.5
-        lr = lr.squeeze(0).float()
-
-        if cfg.TEST.BBOX_REG:
-            # Apply bounding-box regression deltas
-            box_deltas = bbox_pred.data
-            if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
-            # Optionally normalize targets by a precomputed mean and stdev
-              if args.class_agnostic:
-                  if args.cuda > 0:
-                      box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                                + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                  else:
-                      box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS) \
-                                + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS)
-
-                  box_deltas = box_deltas.view(1, -1, 4)
-              else:
-                  if args.cuda > 0:
-                      box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                                + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                  else:
-                      box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS) \
-                                + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS)
-                  box_deltas = box_deltas.view(1, -1, 4 * len(pascal_classes))
-
-            pred_boxes = bbox_transform_inv(boxes, box_deltas, 1)
-            pred_boxes = clip_boxes(pred_boxes, im_info.data, 1)
-        else:
-            # Simply repeat the boxes, once for each class
-            pred_boxes = np.tile(boxes, (1, scores.shape[1]))
-
-        pred_boxes /= im_scales[0]
-
-        scores = scores.squeeze()
-        pred_boxes = pred_boxes.squeeze()
+        detections = detector.detect(ims)
         det_toc = time.time()
         detect_time = det_toc - det_tic
-        misc_tic = time.time()
-        if vis:
-            im2show = np.copy(im)
-        obj_dets, hand_dets = None, None
-        for j in xrange(1, len(pascal_classes)):
-            # inds = torch.nonzero(cls_scores[:,j] > thresh).view(-1)
-            if pascal_classes[j] == 'hand':
-              inds = torch.nonzero(scores[:,j]>thresh_hand).view(-1)
-            elif pascal_classes[j] == 'targetobject':
-              inds = torch.nonzero(scores[:,j]>thresh_obj).view(-1)
 
-            # if there is det
-            if inds.numel() > 0:
-              cls_scores = scores[:,j][inds]
-              _, order = torch.sort(cls_scores, 0, True)
-              if args.class_agnostic:
-                cls_boxes = pred_boxes[inds, :]
-              else:
-                cls_boxes = pred_boxes[inds][:, j * 4:(j + 1) * 4]
-              
-              cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1), contact_indices[inds], offset_vector.squeeze(0)[inds], lr[inds]), 1)
-              cls_dets = cls_dets[order]
-              keep = nms(cls_boxes[order, :], cls_scores[order], cfg.TEST.NMS)
-              cls_dets = cls_dets[keep.view(-1).long()]
-              if pascal_classes[j] == 'targetobject':
-                obj_dets = cls_dets.cpu().numpy()
-              if pascal_classes[j] == 'hand':
-                hand_dets = cls_dets.cpu().numpy()
-              
-        if vis:
-          # visualization
-          im2show = vis_detections_filtered_objects_PIL(im2show, obj_dets, hand_dets, thresh_hand, thresh_obj)
-
-        misc_toc = time.time()
-        nms_time = misc_toc - misc_tic
-
-        if webcam_num == -1:
-            sys.stdout.write('im_detect: {:d}/{:d} {:.3f}s {:.3f}s   \r' \
-                            .format(num_images + 1, len(imglist), detect_time, nms_time))
-            sys.stdout.flush()
-
-        if vis and webcam_num == -1:
-            
-            folder_name = args.save_dir
-            os.makedirs(folder_name, exist_ok=True)
-            result_path = os.path.join(folder_name, imglist[num_images][:-4] + "_det.png")
-            im2show.save(result_path)
-        else:
-            im2showRGB = cv2.cvtColor(im2show, cv2.COLOR_BGR2RGB)
-            cv2.imshow("frame", im2showRGB)
-            total_toc = time.time()
-            total_time = total_toc - total_tic
-            frame_rate = 1 / total_time
-            print('Frame rate:', frame_rate)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+        for b in range(batch_size):
+            vis_tic = time.time()
+            obj_dets, hand_dets = detections[b]
+            if vis:
+              # visualization
+              im2show = vis_detections_filtered_objects_PIL(np.copy(ims[b]), obj_dets, hand_dets, thresh_hand, thresh_obj)
+
+            vis_toc = time.time()
+            vis_time = vis_toc - vis_tic
+
+            if webcam_num == -1:
+                sys.stdout.write('im_detect: {:d}/{:d} detect {:.3f}s vis {:.3f}s   \r' \
+                                .format(len(imglist) - num_images - batch_size + b + 1, len(imglist),
+                                        detect_time / batch_size, vis_time))
+                sys.stdout.flush()
+
+            if vis and webcam_num == -1:
+
+                folder_name = args.save_dir
+                os.makedirs(folder_name, exist_ok=True)
+                result_path = os.path.join(folder_name, im_names[b][:-4] + "_det.png")
+                im2show.save(result_path)
+            else:
+                im2showRGB = cv2.cvtColor(np.array(im2show), cv2.COLOR_RGBA2BGR)
+                cv2.imshow("frame", im2showRGB)
+                total_toc = time.time()
+                total_time = total_toc - total_tic
+                frame_rate = 1 / total_time
+                print('Frame rate:', frame_rate)
+
+        if webcam_num >= 0 and cv2.waitKey(1) & 0xFF == ord('q'):
+            break
               
     if webcam_num >= 0:
         cap.release()
@@ -13,14 +13,8 @@ import cv2
 import torch
 
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
-from model.rpn.bbox_transform import clip_boxes
-from model.roi_layers import nms
-from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import vis_detections_filtered_objects_PIL
-from model.utils.blob import im_list_to_blob
-from model.faster_rcnn.vgg16 import vgg16
-from model.faster_rcnn.resnet import resnet
-import pdb
+from model.inference import HandObjectDetector
 
 
 def parse_args():
@@ -95,38 +89,6 @@ momentum = cfg.TRAIN.MOMENTUM
 weight_decay = cfg.TRAIN.WEIGHT_DECAY
 
 
-def _get_image_blob(im):
-    """
-    Given an image, normalise and reshape it to size (600, x) where x<=800
-    @param img: BGR images (nd array)
-    @return: blob, 4D array, (num_images, h_max, w_max, 3)
-             im_scale_factors, 1D array of image scale_factor
-    """
-    im_orig = im.astype(np.float32, copy=True)
-    im_orig -= cfg.PIXEL_MEANS
-
-    im_shape = im_orig.shape    # (h, w, 3)
-    im_size_min = np.min(im_shape[0:2])    # w or h
-    im_size_max = np.max(im_shape[0:2])    # w or h
-
-    processed_ims = []
-    im_scale_factors = []
-
-    # reshape img size to (600, x) where x<=800
-    for target_size in cfg.TEST.SCALES:
-        im_scale = float(target_size) / float(im_size_min)    # scale = 600 / shorter_side(w/h)
-        if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:    # make sure the longer_size <= 1000
-            im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
-        im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale, interpolation=cv2.INTER_LINEAR)
-        im_scale_factors.append(im_scale)
-        processed_ims.append(im)
-
-    # Create a blob (curtain) to hold the input images
-    blob = im_list_to_blob(processed_ims)
-
-    return blob, np.array(im_scale_factors)
-
-
 if __name__ == '__main__':
     args = parse_args()
     # print('Called with args:')
@@ -137,9 +99,6 @@ if __name__ == '__main__':
     if args.set_cfgs is not None:
         cfg_from_list(args.set_cfgs)
 
-    # automatically choose GPU or CPU
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    cfg.USE_GPU_NMS = True if torch.cuda.is_available() else False
     np.random.seed(cfg.RNG_SEED)
 
     # load model
@@ -152,45 +111,12 @@ if __name__ == '__main__':
     pascal_classes = np.asarray(['__background__', 'targetobject', 'hand'])
     args.set_cfgs = ['ANCHOR_SCALES', '[8, 16, 32, 64]', 'ANCHOR_RATIOS', '[0.5, 1, 2]']
 
-    # initialize the network here.
-    if args.net == 'vgg16':
-        fasterRCNN = vgg16(pascal_classes, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res101':
-        fasterRCNN = resnet(pascal_classes, 101, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res50':
-        fasterRCNN = resnet(pascal_classes, 50, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res152':
-        fasterRCNN = resnet(pascal_classes, 152, pretrained=False, class_agnostic=args.class_agnostic)
-    else:
-        raise Exception("network is not defined")
-
-    fasterRCNN.create_architecture()
-
-    # Load weights
-    print("load checkpoint %s" % (load_name))
-    if torch.cuda.is_available():
-        checkpoint = torch.load(load_name)
-    else:
-        checkpoint = torch.load(load_name, map_location=(lambda storage, loc: storage))
-
-    fasterRCNN.load_state_dict(checkpoint['model'])
-    if 'pooling_mode' in checkpoint.keys():
-        cfg.POOLING_MODE = checkpoint['pooling_mode']
-    print('load model successfully!')
-
-    # initialize the tensor holder here.
-    im_data = torch.FloatTensor(1).to(device)
-    im_info = torch.FloatTensor(1).to(device)
-    num_boxes = torch.LongTensor(1).to(device)
-    gt_boxes = torch.FloatTensor(1).to(device)
-    box_info = torch.FloatTensor(1).to(device)
-
+    # initialize the network and the tensor holders here, GPU or CPU is chosen automatically
+    detector = HandObjectDetector(load_name, args.net, pascal_classes, args.class_agnostic,
+                                  thresh_hand=args.thresh_hand, thresh_obj=args.thresh_obj)
 
     """start predictions, prediction doesn't need gradient"""
     with torch.no_grad():
-        fasterRCNN.to(device)
-        fasterRCNN.eval()
-
         start = time.time()
         max_per_image = 100
         thresh_hand = args.thresh_hand
@@ -211,142 +137,62 @@ if __name__ == '__main__':
 
         while (num_images >= 0):
             total_tic = time.time()
-            if webcam_num == -1:
-                num_images -= 1
 
-            # Load image from the webcam
+            # Load image from the webcam, or a batch of --bs images from the image directory
+            ims, im_names = [], []
             if webcam_num >= 0:
                 if not cap.isOpened():
                     raise RuntimeError("Webcam could not open. Please check connection.")
                 ret, frame = cap.read()
-                im_in = np.array(frame)
-            # Load the demo image
+                ims.append(np.array(frame))
+            # Load the demo images
             else:
-                im_file = os.path.join(args.image_dir, imglist[num_images])
-                im_in = cv2.imread(im_file)
-            im = im_in    # already BGR
-
-            # get image blob (curtain) and scale_factor
-            blobs, im_scales = _get_image_blob(im)
-            assert len(im_scales) == 1, "Only single-image batch implemented"
-            im_blob = blobs
-            im_info_np = np.array([[im_blob.shape[1], im_blob.shape[2], im_scales[0]]], dtype=np.float32)    # 2D array [[h, w, 1.3]]
-            im_data_pt = torch.from_numpy(im_blob)    # 4D array, image (1, h, w, 3)
-            im_data_pt = im_data_pt.permute(0, 3, 1, 2)    # 4D array, image (1, 3, h, w), channel goes first in pytorch
-            im_info_pt = torch.from_numpy(im_info_np)
-
-            with torch.no_grad():
-                im_data.resize_(im_data_pt.size()).copy_(im_data_pt)    # reshape to (1, 3, h, w) and fill in the img
-                im_info.resize_(im_info_pt.size()).copy_(im_info_pt)    # 2D tensor [[height, width, 1.3]]
-                gt_boxes.resize_(1, 1, 5).zero_()    # 3D tensor [[[x1, y1, x2, y2, cls]]], default as 0 for test
-                num_boxes.resize_(1).zero_()
-                box_info.resize_(1, 1, 5).zero_()
+                while num_images > 0 and len(ims) < args.batch_size:
+                    num_images -= 1
+                    im_file = os.path.join(args.image_dir, imglist[num_images])
+                    ims.append(cv2.imread(im_file))    # already BGR
+                    im_names.append(imglist[num_images])
+                if len(ims) == 0:
+                    break
+            batch_size = len(ims)
 
-            # get the predictions from network
+            # get the predictions from network, then remove low score bbox, do NMS, match the cls name
             det_tic = time.time()
-            rois, cls_prob, bbox_pred, \
-            rpn_loss_cls, rpn_loss_box, \
-            RCNN_loss_cls, RCNN_loss_bbox, \
-            rois_label, loss_list = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, box_info)
-
-            scores = cls_prob.data
-            boxes = rois.data[:, :, 1:5]
-
-            # extract predicted params
-            contact_vector = loss_list[0][0]  # hand contact state info
-            offset_vector = loss_list[1][0].detach()  # offset vector (factored into a unit vector and a magnitude)
-            lr_vector = loss_list[2][0].detach()  # hand side info (left/right)
-
-            # get hand contact
-            _, contact_indices = torch.max(contact_vector, 2)
-            contact_indices = contact_indices.squeeze(0).unsqueeze(-1).float()
-
-            # get hand side
-            lr = torch.sigmoid(lr_vector) > 0.5
-            lr = lr.squeeze(0).float()
-
-            # Apply bounding-box regression deltas
-            if cfg.TEST.BBOX_REG:
-                box_deltas = bbox_pred.data
-                if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
-                    # Optionally normalize targets by a precomputed mean and stdev
-                    if args.class_agnostic:
-                        box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).to(device) \
-                                     + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).to(device)
-                        box_deltas = box_deltas.view(1, -1, 4)
-                    else:
-                        box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).to(device) \
-                                     + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).to(device)
-                        box_deltas = box_deltas.view(1, -1, 4 * len(pascal_classes))
-
-                pred_boxes = bbox_transform_inv(boxes, box_deltas, 1)
-                pred_boxes = clip_boxes(pred_boxes, im_info.data, 1)
-
-            # Simply repeat the boxes, once for each class
-            else:
-                pred_boxes = np.tile(boxes, (1, scores.shape[1]))
-
-            pred_boxes /= im_scales[0]
-            scores = scores.squeeze()
-            pred_boxes = pred_boxes.squeeze()
+            detections = detector.detect(ims)
             det_toc = time.time()
             detect_time = det_toc - det_tic
-            misc_tic = time.time()
-            if vis:
-                im2show = np.copy(im)
-            obj_dets, hand_dets = None, None
 
-            # remove low score bbox, do NMS, match the cls name
-            for j in range(1, len(pascal_classes)):
-                if pascal_classes[j] == 'hand':
-                    inds = torch.nonzero(scores[:, j] > thresh_hand).view(-1)
-                elif pascal_classes[j] == 'targetobject':
-                    inds = torch.nonzero(scores[:, j] > thresh_obj).view(-1)
-
-                # if there is detection
-                if inds.numel() > 0:
-                    cls_scores = scores[:, j][inds]
-                    _, order = torch.sort(cls_scores, 0, True)
-                    if args.class_agnostic:
-                        cls_boxes = pred_boxes[inds, :]
-                    else:
-                        cls_boxes = pred_boxes[inds][:, j * 4:(j + 1) * 4]
-
-                    cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1), contact_indices[inds],
-                                          offset_vector.squeeze(0)[inds], lr[inds]), 1)
-                    cls_dets = cls_dets[order]
-                    keep = nms(cls_boxes[order, :], cls_scores[order], cfg.TEST.NMS)
-                    cls_dets = cls_dets[keep.view(-1).long()]
-                    if pascal_classes[j] == 'targetobject':
-                        obj_dets = cls_dets.cpu().numpy()
-                    if pascal_classes[j] == 'hand':
-                        hand_dets = cls_dets.cpu().numpy()
-
-            # visualization
-            if vis:
-                im2show = vis_detections_filtered_objects_PIL(im2show, obj_dets, hand_dets, thresh_hand, thresh_obj)
-
-            misc_toc = time.time()
-            nms_time = misc_toc - misc_tic
-
-            if webcam_num == -1:
-                sys.stdout.write('im_detect: {:d}/{:d} {:.3f}s {:.3f}s \r'.format(num_images + 1, len(imglist), detect_time, nms_time))
-                sys.stdout.flush()
-
-            if vis and webcam_num == -1:
-                folder_name = args.save_dir
-                os.makedirs(folder_name, exist_ok=True)
-                result_path = os.path.join(folder_name, imglist[num_images][:-4] + "_det.png")
-                im2show.save(result_path)
-            else:
-                im2showRGB = cv2.cvtColor(im2show, cv2.COLOR_BGR2RGB)
-                cv2.imshow("frame", im2showRGB)
-                total_toc = time.time()
-                total_time = total_toc - total_tic
-                frame_rate = 1 / total_time
-                print('Frame rate:', frame_rate)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+            for b in range(batch_size):
+                vis_tic = time.time()
+                obj_dets, hand_dets = detections[b]
+
+                # visualization
+                if vis:
+                    im2show = vis_detections_filtered_objects_PIL(np.copy(ims[b]), obj_dets, hand_dets, thresh_hand, thresh_obj)
+
+                vis_toc = time.time()
+                vis_time = vis_toc - vis_tic
+
+                if webcam_num == -1:
+                    sys.stdout.write('im_detect: {:d}/{:d} detect {:.3f}s vis {:.3f}s \r'.format(
+                        len(imglist) - num_images - batch_size + b + 1, len(imglist), detect_time / batch_size, vis_time))
+                    sys.stdout.flush()
+
+                if vis and webcam_num == -1:
+                    folder_name = args.save_dir
+                    os.makedirs(folder_name, exist_ok=True)
+                    result_path = os.path.join(folder_name, im_names[b][:-4] + "_det.png")
+                    im2show.save(result_path)
+                else:
+                    im2showRGB = cv2.cvtColor(np.array(im2show), cv2.COLOR_RGBA2BGR)
+                    cv2.imshow("frame", im2showRGB)
+                    total_toc = time.time()
+                    total_time = total_toc - total_tic
+                    frame_rate = 1 / total_time
+                    print('Frame rate:', frame_rate)
+
+            if webcam_num >= 0 and cv2.waitKey(1) & 0xFF == ord('q'):
+                break
 
         if webcam_num >= 0:
             cap.release()
@@ -24,16 +24,9 @@ import torchvision.datasets as dset
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
-from model.rpn.bbox_transform import clip_boxes
-# from model.nms.nms_wrapper import nms
-from model.roi_layers import nms
-from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import save_net, load_net, vis_detections, vis_detections_PIL, \
     vis_detections_filtered_objects_PIL, vis_detections_filtered_objects  # (1) here add a function to viz
-from model.utils.blob import im_list_to_blob
-from model.faster_rcnn.vgg16 import vgg16
-from model.faster_rcnn.resnet import resnet
-import pdb
+from model.inference import HandObjectDetector, VideoPipeline, TemporalDetector, FeatureCache
 
 
 def parse_args():
@@ -92,12 +85,39 @@ def parse_args():
     parser.add_argument('--bs', dest='batch_size',
                         help='batch_size',
                         default=1, type=int)
+    parser.add_argument('--pipeline', dest='pipeline',
+                        help='overlap decoding, batched inference and rendering (no display window)',
+                        action='store_true')
+    parser.add_argument('--queue_size', dest='queue_size',
+                        help='maximum number of frames waiting between two pipeline stages',
+                        default=8, type=int)
+    parser.add_argument('--keyframe_interval', dest='keyframe_interval',
+                        help='run the full detector every N frames and track the boxes in between, 1 to disable',
+                        default=1, type=int)
+    parser.add_argument('--scene_thresh', dest='scene_thresh',
+                        help='also take a keyframe when the scene change score is above it, 0 to disable',
+                        default=0., type=float)
+    parser.add_argument('--drift_interval', dest='drift_interval',
+                        help='compare every N-th tracked frame with the full detection, 0 to disable',
+                        default=0, type=int)
+    parser.add_argument('--feature_cache', dest='feature_cache',
+                        help='recompute the backbone features of the changed regions only (static camera)',
+                        action='store_true')
+    parser.add_argument('--check_interval', dest='check_interval',
+                        help='compare the cached features with a full recompute every N frames, 0 to disable',
+                        default=0, type=int)
     parser.add_argument('--vis', dest='vis',
                         help='visualization mode',
                         default=True)
     parser.add_argument('--webcam_num', dest='webcam_num',
                         help='webcam ID number',
                         default=-1, type=int)
+    parser.add_argument('--fuse', dest='fuse',
+                        help='fold the BatchNorm of the backbone into the convs and use channels last',
+                        action='store_true')
+    parser.add_argument('--quantize', dest='quantize',
+                        help='CPU quantisation mode: dynamic, fp16 or static (calibrated by quantize_net.py)',
+                        default=None, type=str)
     parser.add_argument('--thresh_hand',
                         type=float, default=0.5,
                         required=False)
@@ -106,6 +126,11 @@ def parse_args():
                         required=False)
 
     args = parser.parse_args()
+    # the pipeline detects batches of frames in a worker thread, one full detection every two frames
+    if args.pipeline and (args.keyframe_interval > 1 or args.scene_thresh > 0):
+        parser.error('--keyframe_interval and --scene_thresh cannot be used with --pipeline')
+    if args.pipeline and args.feature_cache:
+        parser.error('--feature_cache cannot be used with --pipeline')
     return args
 
 
@@ -114,42 +139,6 @@ momentum = cfg.TRAIN.MOMENTUM
 weight_decay = cfg.TRAIN.WEIGHT_DECAY
 
 
-def _get_image_blob(im):
-    """Converts an image into a network input.
-    Arguments:
-      im (ndarray): a color image in BGR order
-    Returns:
-      blob (ndarray): a data blob holding an image pyramid
-      im_scale_factors (list): list of image scales (relative to im) used
-        in the image pyramid
-    """
-    im_orig = im.astype(np.float32, copy=True)
-    im_orig -= cfg.PIXEL_MEANS
-
-    im_shape = im_orig.shape
-    im_size_min = np.min(im_shape[0:2])
-    im_size_max = np.max(im_shape[0:2])
-
-    processed_ims = []
-    im_scale_factors = []
-
-    for target_size in cfg.TEST.SCALES:
-        im_scale = float(target_size) / float(im_size_min)
-        # Prevent the biggest axis from being more than MAX_SIZE
-        if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:
-            im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
-        im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale,
-                        interpolation=cv2.INTER_LINEAR)
-        im_scale_factors.append(im_scale)
-        processed_ims.append(im)
-
-    # Create a blob to hold the input images
-    # 第一维为batch，H W C
-    blob = im_list_to_blob(processed_ims)
-
-    return blob, np.array(im_scale_factors)
-
-
 if __name__ == '__main__':
     args = parse_args()
     # print('Called with args:')
@@ -161,7 +150,6 @@ if __name__ == '__main__':
         cfg_from_list(args.set_cfgs)
 
     print(args.cuda)
-    cfg.USE_GPU_NMS = args.cuda
     np.random.seed(cfg.RNG_SEED)
 
     # load model
@@ -174,56 +162,14 @@ if __name__ == '__main__':
     pascal_classes = np.asarray(['__background__', 'targetobject', 'hand'])
     args.set_cfgs = ['ANCHOR_SCALES', '[8, 16, 32, 64]', 'ANCHOR_RATIOS', '[0.5, 1, 2]']
 
-    # initialize the network here.
-    if args.net == 'vgg16':
-        fasterRCNN = vgg16(pascal_classes, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res101':
-        fasterRCNN = resnet(pascal_classes, 101, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res50':
-        fasterRCNN = resnet(pascal_classes, 50, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res152':
-        fasterRCNN = resnet(pascal_classes, 152, pretrained=False, class_agnostic=args.class_agnostic)
-    else:
-        print("network is not defined")
-        pdb.set_trace()
-
-    fasterRCNN.create_architecture()
-
-    print("load checkpoint %s" % (load_name))
-    if args.cuda > 0:
-        print("using cuda")
-        checkpoint = torch.load(load_name)
-    else:
-        checkpoint = torch.load(load_name, map_location=(lambda storage, loc: storage))
-    fasterRCNN.load_state_dict(checkpoint['model'])
-    if 'pooling_mode' in checkpoint.keys():
-        cfg.POOLING_MODE = checkpoint['pooling_mode']
-
-    print('load model successfully!')
-
-    # initialize the tensor holder here.
-    im_data = torch.FloatTensor(1)
-    im_info = torch.FloatTensor(1)
-    num_boxes = torch.LongTensor(1)
-    gt_boxes = torch.FloatTensor(1)
-    box_info = torch.FloatTensor(1)
-
-    # ship to cuda
-    if args.cuda > 0:
-        im_data = im_data.cuda()
-        im_info = im_info.cuda()
-        num_boxes = num_boxes.cuda()
-        gt_boxes = gt_boxes.cuda()
+    # initialize the network and the tensor holders here.
+    detector = HandObjectDetector(load_name, args.net, pascal_classes, args.class_agnostic, cuda=args.cuda,
+                                  thresh_hand=args.thresh_hand, thresh_obj=args.thresh_obj, fuse=args.fuse,
+                                  quantize=args.quantize)
+    if args.feature_cache:
+        detector.feature_cache = FeatureCache(detector.fasterRCNN, check_interval=args.check_interval)
 
     with torch.no_grad():
-        if args.cuda > 0:
-            cfg.CUDA = True
-
-        if args.cuda > 0:
-            fasterRCNN.cuda()
-
-        fasterRCNN.eval()
-
         start = time.time()
         max_per_image = 100
         thresh_hand = args.thresh_hand
@@ -246,10 +192,29 @@ if __name__ == '__main__':
         video_size = (int(vc.get(cv2.CAP_PROP_FRAME_WIDTH)),
                       int(vc.get(cv2.CAP_PROP_FRAME_HEIGHT)))
         video_FourCC = cv2.VideoWriter_fourcc(*"mp4v")
+
+        # the temporal mode handles every frame, the full detection mode every two frames
+        temporal = args.keyframe_interval > 1 or args.scene_thresh > 0
+        frame_step = 1 if temporal else 2
+        if temporal:
+            temporal_detector = TemporalDetector(detector, args.keyframe_interval, args.scene_thresh,
+                                                 args.drift_interval)
         if args.output:
             print(type(video_FourCC), type(video_fps), type(video_size))
-            out = cv2.VideoWriter("/home/walter/Videos/detected_video/test.mp4", video_FourCC, video_fps/2, video_size)
+            out = cv2.VideoWriter("/home/walter/Videos/detected_video/test.mp4", video_FourCC, video_fps/frame_step, video_size)
+
+        if args.pipeline:
+            # decode / detect / render overlap, still one detection every two frames
+            pipeline = VideoPipeline(detector, batch_size=args.batch_size, queue_size=args.queue_size, frame_step=2)
+            stats = pipeline.run(vc, sink=(lambda index, cvimg: out.write(cvimg)) if args.output else None)
+            for stage in ['decode', 'infer', 'render', 'total']:
+                print(stats[stage])
+            print(detector.anchor_cache_info())
 
+            vc.release()
+            if args.output:
+                out.release()
+            sys.exit(0)
 
         success =True
         c = 0
@@ -261,132 +226,24 @@ if __name__ == '__main__':
             #print(c)
             c+=1
             #每两帧检测一下
-            if c % 2 == 0:
-                im = frame
-                num_images = 1
-
-                #缩放后图像， 缩放因子
-                blobs, im_scales = _get_image_blob(im)
-                assert len(im_scales) == 1, "Only single-image batch implemented"
-                im_blob = blobs
-                im_info_np = np.array([[im_blob.shape[1], im_blob.shape[2], im_scales[0]]], dtype=np.float32)
-
-                im_data_pt = torch.from_numpy(im_blob)
-                #调整为batch, C, H, W
-                im_data_pt = im_data_pt.permute(0, 3, 1, 2)
-                im_info_pt = torch.from_numpy(im_info_np)
-
-                with torch.no_grad():
-                    im_data.resize_(im_data_pt.size()).copy_(im_data_pt)
-                    im_info.resize_(im_info_pt.size()).copy_(im_info_pt)
-                    gt_boxes.resize_(1, 1, 5).zero_()
-                    num_boxes.resize_(1).zero_()
-                    box_info.resize_(1, 1, 5).zero_()
-
-                    # pdb.set_trace()
+            if c % frame_step == 0:
                 det_tic = time.time()
-
-                rois, cls_prob, bbox_pred, \
-                rpn_loss_cls, rpn_loss_box, \
-                RCNN_loss_cls, RCNN_loss_bbox, \
-                rois_label, loss_list = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, box_info)
-
-                #shape(1,300,3)
-                scores = cls_prob.data
-                boxes = rois.data[:, :, 1:5] #(1,300,4)
-                #rois.data[:,:,0]代表什么?
-
-                # extact predicted params
-                #(1,300,5)
-                contact_vector = loss_list[0][0]  # hand contact state info
-                #(1,300,3)
-                offset_vector = loss_list[1][0].detach()  # offset vector (factored into a unit vector and a magnitude)
-                #(1,300,1)
-                lr_vector = loss_list[2][0].detach()  # hand side info (left/right)
-
-                # get hand contact
-                _, contact_indices = torch.max(contact_vector, 2)
-                contact_indices = contact_indices.squeeze(0).unsqueeze(-1).float()
-
-                # get hand side
-                lr = torch.sigmoid(lr_vector) > 0.5
-                lr = lr.squeeze(0).float()
-
-                if cfg.TEST.BBOX_REG:#???
-                    # Apply bounding-box regression deltas
-                    box_deltas = bbox_pred.data
-                    if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
-                        # Optionally normalize targets by a precomputed mean and stdev
-                        if args.class_agnostic:#???
-                            if args.cuda > 0:
-                                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(
-                                    cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                                            + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                            else:
-                                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS) \
-                                            + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS)
-
-                            box_deltas = box_deltas.view(1, -1, 4)
-                        else:
-                            if args.cuda > 0:
-                                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(
-                                    cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                                            + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                            else:
-                                box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS) \
-                                            + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS)
-                            box_deltas = box_deltas.view(1, -1, 4 * len(pascal_classes))
-
-                    pred_boxes = bbox_transform_inv(boxes, box_deltas, 1)
-                    pred_boxes = clip_boxes(pred_boxes, im_info.data, 1)
+                if temporal:
+                    (obj_dets, hand_dets), is_keyframe = temporal_detector.detect(frame)
                 else:
-                    # Simply repeat the boxes, once for each class
-                    pred_boxes = np.tile(boxes, (1, scores.shape[1]))
-
-                pred_boxes /= im_scales[0]
-
-                scores = scores.squeeze()
-                pred_boxes = pred_boxes.squeeze()
+                    obj_dets, hand_dets = detector.detect(frame)[0]
                 det_toc = time.time()
                 detect_time = det_toc - det_tic
-                misc_tic = time.time()
-                if vis:
-                    im2show = np.copy(im)
-                obj_dets, hand_dets = None, None
-                for j in range(1, len(pascal_classes)):
-                    # inds = torch.nonzero(cls_scores[:,j] > thresh).view(-1)
-                    if pascal_classes[j] == 'hand':
-                        inds = torch.nonzero(scores[:, j] > thresh_hand).view(-1)
-                    elif pascal_classes[j] == 'targetobject':
-                        inds = torch.nonzero(scores[:, j] > thresh_obj).view(-1)
-
-                    # if there is det
-                    if inds.numel() > 0:
-                        cls_scores = scores[:, j][inds]
-                        _, order = torch.sort(cls_scores, 0, True)
-                        if args.class_agnostic:
-                            cls_boxes = pred_boxes[inds, :]
-                        else:
-                            cls_boxes = pred_boxes[inds][:, j * 4:(j + 1) * 4]
-
-                        cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1), contact_indices[inds],
-                                            offset_vector.squeeze(0)[inds], lr[inds]), 1)
-                        cls_dets = cls_dets[order]
-                        keep = nms(cls_boxes[order, :], cls_scores[order], cfg.TEST.NMS)
-                        cls_dets = cls_dets[keep.view(-1).long()]
-                        if pascal_classes[j] == 'targetobject':
-                            obj_dets = cls_dets.cpu().numpy()
-                        if pascal_classes[j] == 'hand':
-                            hand_dets = cls_dets.cpu().numpy()
 
-                if vis:
-                    # visualization
-                    cvimg = vis_detections_filtered_objects_PIL(frame, im2show, obj_dets, hand_dets, thresh_hand, thresh_obj)
+                vis_tic = time.time()
+                # visualization, PIL RGBA image ==> cv2 BGR image
+                cvimg = vis_detections_filtered_objects_PIL(np.copy(frame), obj_dets, hand_dets, thresh_hand, thresh_obj)
+                cvimg = cv2.cvtColor(np.array(cvimg), cv2.COLOR_RGBA2BGR)
 
-                misc_toc = time.time()
-                nms_time = misc_toc - misc_tic
+                vis_toc = time.time()
+                vis_time = vis_toc - vis_tic
 
-                print(nms_time+detect_time)
+                print(vis_time+detect_time)
 
                 #cv2.imwrite("detectedvideo/detected{}.png".format(c),cvimg)
                 cv2.imshow('detection', cvimg)
@@ -395,29 +252,13 @@ if __name__ == '__main__':
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
 
+        if temporal:
+            print(temporal_detector.stats)
+        if args.feature_cache:
+            print(detector.feature_cache.stats)
+        print(detector.anchor_cache_info())
 
-                # if webcam_num == -1:
-                #     sys.stdout.write('im_detect: {:d}/{:d} {:.3f}s {:.3f}s   \r' \
-                #                     .format(num_images + 1, len(imglist), detect_time, nms_time))
-                #     sys.stdout.flush()
-                #
-                # if vis and webcam_num == -1:
-                #
-                #     folder_name = args.save_dir
-                #     os.makedirs(folder_name, exist_ok=True)
-                #     result_path = os.path.join(folder_name, imglist[num_images][:-4] + "_det.png")
-                #     im2show.save(result_path)
-                # else:
-                #     im2showRGB = cv2.cvtColor(im2show, cv2.COLOR_BGR2RGB)
-                #     cv2.imshow("frame", im2showRGB)
-                #     total_toc = time.time()
-                #     total_time = total_toc - total_tic
-                #     frame_rate = 1 / total_time
-                #     print('Frame rate:', frame_rate)
-                #     if cv2.waitKey(1) & 0xFF == ord('q'):
-                #         break
-
-            # if webcam_num >= 0:
-            #     cap.release()
-            #     cv2.destroyAllWindows()
-        vc.release()
\ No newline at end of file
+        vc.release()
+        if args.output:
+            out.release()
+        cv2.destroyAllWindows()
@@ -0,0 +1,246 @@
+"""Columnar store of the hand-object annotations, shared by the training roidb and the evaluation."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import xml.etree.ElementTree as ET
+import numpy as np
+import scipy.sparse
+from multiprocessing import Pool
+
+
+# every column is saved as <column>.npy in the store directory and loaded with mmap
+# per object: name_id, bbox (raw xml coordinates), difficult, contactstate, contactright, contactleft,
+#             magnitude (raw xml value), unitdx, unitdy, handside, objectbbox (nan when there is no object)
+# per image: image_index, offsets (the objects of image i are offsets[i]:offsets[i+1])
+# names: the object names, name_id indexes into it
+# mtimes.npy next to the columns holds the mtime of each xml file when the store was built, see get_annotation_store
+COLUMNS = ['name_id', 'bbox', 'difficult', 'contactstate', 'contactright', 'contactleft', 'magnitude', 'unitdx',
+           'unitdy', 'handside', 'objectbbox', 'image_index', 'offsets', 'names']
+
+
+def _text(obj, tag):
+    """ text of a child element, None if it is missing or 'None' """
+    ele = obj.find(tag)
+    if ele is None or ele.text is None or ele.text == 'None':
+        return None
+    return ele.text
+
+
+def parse_annotation(filename):
+    """
+    parse all objects of one PASCAL VOC xml file
+    :param filename: xml path
+    :return: list of tuples (name, bbox, difficult, contactstate, contactright, contactleft, magnitude, unitdx,
+             unitdy, handside, objectbbox), missing fields are 0 and a missing object bbox is nan
+    """
+    objects = []
+    for obj in ET.parse(filename).findall('object'):
+        bbox = obj.find('bndbox')
+        box = [float(bbox.find(tag).text) for tag in ['xmin', 'ymin', 'xmax', 'ymax']]
+        objbox = [_text(obj, tag) for tag in ['objxmin', 'objymin', 'objxmax', 'objymax']]
+        objbox = [np.nan] * 4 if None in objbox else [float(x) for x in objbox]
+
+        field = lambda tag, cast: 0 if _text(obj, tag) is None else cast(_text(obj, tag))
+        objects.append((obj.find('name').text.lower().strip(), box, field('difficult', int),
+                        field('contactstate', int), field('contactright', int), field('contactleft', int),
+                        field('magnitude', float), field('unitdx', float), field('unitdy', float),
+                        field('handside', lambda x: int(float(x))), objbox))
+    return objects
+
+
+def annotation_mtimes(filenames):
+    """ :return: 1D float array, the mtime of each xml file """
+    return np.array([os.stat(filename).st_mtime for filename in filenames], dtype=np.float64)
+
+
+def _parse_chunk(filenames):
+    return [parse_annotation(filename) for filename in filenames]
+
+
+def build_annotation_store(annopath, image_index, store_dir, num_workers=8, chunk_size=500):
+    """
+    parse the xml annotations of an image set in parallel and save them as columns
+    :param annopath: xml path template, "data/VOCdevkit2007_handobj_100K/VOC2007/Annotations/{:s}.xml"
+    :param image_index: list of image filenames (without .jpg)
+    :param store_dir: output directory
+    :param num_workers: number of parsing processes, 0 to parse in this process
+    :param chunk_size: number of xml files parsed by a worker at a time
+    :return: AnnotationStore
+    """
+    start = time.time()
+    filenames = [annopath.format(index) for index in image_index]
+    # taken before parsing, a file modified meanwhile is parsed again by the next get_annotation_store
+    mtimes = annotation_mtimes(filenames)
+    chunks = [filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)]
+    if num_workers > 0:
+        pool = Pool(num_workers)
+        try:
+            images = [objs for chunk in pool.imap(_parse_chunk, chunks) for objs in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        images = [objs for chunk in chunks for objs in _parse_chunk(chunk)]
+
+    objects = [obj for objs in images for obj in objs]
+    names = sorted(set(obj[0] for obj in objects))
+    name_to_id = dict(zip(names, range(len(names))))
+    columns = {'name_id': np.array([name_to_id[obj[0]] for obj in objects], dtype=np.int32),
+               'bbox': np.array([obj[1] for obj in objects], dtype=np.float64).reshape(-1, 4),
+               'difficult': np.array([obj[2] for obj in objects], dtype=np.int32),
+               'contactstate': np.array([obj[3] for obj in objects], dtype=np.int32),
+               'contactright': np.array([obj[4] for obj in objects], dtype=np.int32),
+               'contactleft': np.array([obj[5] for obj in objects], dtype=np.int32),
+               'magnitude': np.array([obj[6] for obj in objects], dtype=np.float64),
+               'unitdx': np.array([obj[7] for obj in objects], dtype=np.float32),
+               'unitdy': np.array([obj[8] for obj in objects], dtype=np.float32),
+               'handside': np.array([obj[9] for obj in objects], dtype=np.int32),
+               'objectbbox': np.array([obj[10] for obj in objects], dtype=np.float64).reshape(-1, 4),
+               'image_index': np.array(image_index, dtype=np.str_),
+               'offsets': np.cumsum([0] + [len(objs) for objs in images]).astype(np.int64),
+               'names': np.array(names, dtype=np.str_)}
+
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    # offsets is written last, a store without it is incomplete
+    if os.path.exists(os.path.join(store_dir, 'offsets.npy')):
+        os.remove(os.path.join(store_dir, 'offsets.npy'))
+    for column in COLUMNS:
+        if column != 'offsets':
+            np.save(os.path.join(store_dir, column + '.npy'), columns[column])
+    np.save(os.path.join(store_dir, 'mtimes.npy'), mtimes)
+    np.save(os.path.join(store_dir, 'offsets.npy'), columns['offsets'])
+    print('built annotation store of {:d} images ({:d} objects) in {:.2f}s: {}'.format(
+        len(image_index), len(objects), time.time() - start, store_dir))
+
+    return AnnotationStore(store_dir)
+
+
+def get_annotation_store(annopath, image_index, store_dir, num_workers=8):
+    """
+    load the annotation store of an image set, build it first if it is missing, belongs to another image set or
+    an xml file was modified since it was built
+    :return: AnnotationStore
+    """
+    mtimes_file = os.path.join(store_dir, 'mtimes.npy')
+    if os.path.exists(os.path.join(store_dir, 'offsets.npy')) and os.path.exists(mtimes_file):
+        start = time.time()
+        store = AnnotationStore(store_dir)
+        if list(store.image_index) == list(image_index) and np.array_equal(
+                np.load(mtimes_file), annotation_mtimes([annopath.format(index) for index in image_index])):
+            print('loaded annotation store of {:d} images in {:.2f}s: {}'.format(
+                len(store), time.time() - start, store_dir))
+            return store
+        print('annotation store {} is out of date, rebuilding it'.format(store_dir))
+
+    return build_annotation_store(annopath, image_index, store_dir, num_workers)
+
+
+def roidb_entry(columns, start, end, num_classes):
+    """
+    gt labels of one image
+    :param columns: AnnotationStore.roidb_columns()
+    :param start, end: the objects of the image are start:end
+    :param num_classes: 3
+    :return: {'boxes': ..., 'gt_classes': ..., 'gt_overlaps': ..., 'flipped': False, ...}
+    """
+    entry = {key: column[start:end] for key, column in columns.items()}
+    # one overlap of 1.0 per gt box, in the column of its class
+    entry['gt_overlaps'] = scipy.sparse.csr_matrix(
+        (np.ones(end - start, dtype=np.float32), entry['gt_classes'], np.arange(end - start + 1)),
+        shape=(end - start, num_classes))
+    entry['flipped'] = False
+    return entry
+
+
+class AnnotationStore(object):
+    """
+    read-only, memory-mapped annotations of an image set
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        for column in COLUMNS:
+            mmap_mode = None if column in ['image_index', 'names'] else 'r'
+            setattr(self, column, np.load(os.path.join(store_dir, column + '.npy'), mmap_mode=mmap_mode))
+        self.lookup = {index: i for i, index in enumerate(self.image_index)}
+
+
+    def __len__(self):
+        return len(self.image_index)
+
+
+    def name_to_id(self, name):
+        """ id of an object name, -1 if the image set has no such object """
+        ids = np.where(self.names == name)[0]
+        return int(ids[0]) if len(ids) > 0 else -1
+
+
+    def roidb_columns(self, class_to_ind):
+        """
+        the roidb fields of all objects, in memory, split per image by roidb_entry()
+        :param class_to_ind: {'__background__': 0, 'targetobject': 1, 'hand': 2}
+        :return: {field: array with one row per object}
+        """
+        class_ids = np.array([class_to_ind[name] for name in self.names], dtype=np.int32)
+
+        # Make pixel indexes 0-based
+        boxes = np.maximum(self.bbox - 1, 0)
+        columns = {'boxes': boxes.astype(np.uint16),
+                   'gt_classes': class_ids[self.name_id],
+                   'gt_ishard': np.array(self.difficult),
+                   'seg_areas': ((boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)).astype(np.float32),
+                   'contactstate': np.array(self.contactstate),
+                   'contactright': np.array(self.contactright),
+                   'contactleft': np.array(self.contactleft),
+                   'unitdx': np.array(self.unitdx),
+                   'unitdy': np.array(self.unitdy),
+                   'magnitude': (self.magnitude * 0.001).astype(np.float32),    # balance scale
+                   'handside': np.array(self.handside)}
+        return columns
+
+
+    def roidb(self, class_to_ind, num_classes):
+        """
+        gt labels of all images, the same as pascal_voc._load_pascal_annotation() parses from the xml files
+        the columns are converted once and then split per image
+        :param class_to_ind: {'__background__': 0, 'targetobject': 1, 'hand': 2}
+        :param num_classes: 3
+        :return: labels list [{}, {}, ...], each element is a dict that contains all labels for one image
+        """
+        columns = self.roidb_columns(class_to_ind)
+        offsets = np.asarray(self.offsets).tolist()
+        return [roidb_entry(columns, s, e, num_classes) for s, e in zip(offsets[:-1], offsets[1:])]
+
+
+    def class_records(self, classname, image_index=None):
+        """
+        gt labels of one class for the evaluation, the same fields as voc_eval.parse_rec() gives
+        :param classname: 'targetobject', 'hand'
+        :param image_index: image filenames to evaluate, default is all images of the store
+        :return: {imagename: {'bbox': 2D array, 'difficult': 1D bool array, 'handstate': 1D int array,
+                              'leftright': 1D int array, 'objectbbox': 1D object array, a list or None each,
+                              'det': [False, ...]}}
+        """
+        if image_index is None:
+            image_index = self.image_index
+        is_class = np.asarray(self.name_id) == self.name_to_id(classname)
+
+        class_recs = {}
+        for imagename in image_index:
+            i = self.lookup[imagename]
+            s, e = self.offsets[i], self.offsets[i + 1]
+            keep = np.where(is_class[s:e])[0] + s
+            objectbbox = np.empty(len(keep), dtype=object)
+            for k, box in enumerate(self.objectbbox[keep]):
+                objectbbox[k] = None if np.isnan(box).any() else box.tolist()
+            class_recs[imagename] = {'bbox': np.array(self.bbox[keep]),
+                                     'difficult': self.difficult[keep].astype(bool),
+                                     'handstate': np.array(self.contactstate[keep]),
+                                     'leftright': np.array(self.handside[keep]),
+                                     'objectbbox': objectbbox,
+                                     'det': [False] * len(keep)}
+        return class_recs
@@ -0,0 +1,82 @@
+"""Image sizes of an image set, read from the image headers in parallel and cached with the file mtimes."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import numpy as np
+from multiprocessing import Pool
+from PIL import Image
+
+
+def read_image_size(filename):
+    """
+    :param filename: image path
+    :return: (width, height), PIL only reads the header of the file
+    """
+    with Image.open(filename) as im:
+        return im.size
+
+
+def _read_chunk(filenames):
+    return [read_image_size(filename) for filename in filenames]
+
+
+def probe_image_sizes(filenames, num_workers=8, chunk_size=500):
+    """
+    read the sizes of images in parallel
+    :param filenames: list of image paths
+    :param num_workers: number of reading processes, 0 to read in this process
+    :param chunk_size: number of images read by a worker at a time, fewer images are read in this process
+    :return: 2D int array (num_images, 2), each row is [width, height]
+    """
+    chunks = [filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)]
+    if num_workers > 0 and len(chunks) > 1:
+        pool = Pool(num_workers)
+        try:
+            sizes = [size for chunk in pool.imap(_read_chunk, chunks) for size in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        sizes = [size for chunk in chunks for size in _read_chunk(chunk)]
+    return np.array(sizes, dtype=np.int32).reshape(-1, 2)
+
+
+def get_image_sizes(image_paths, cache_file, num_workers=8):
+    """
+    sizes of the images of an image set, only the images which are new or modified since the cache was written
+    are read, then the cache is updated
+    :param image_paths: list of image paths, may contain duplicates (the flipped images)
+    :param cache_file: '/.../data/cache_handobj_100K/voc_2007_trainval_image_sizes.npz'
+    :param num_workers: number of reading processes
+    :return: 2D int array (len(image_paths), 2), each row is [width, height]
+    """
+    start = time.time()
+    paths = list(dict.fromkeys(image_paths))    # unique, in order
+    mtimes = np.array([os.stat(path).st_mtime for path in paths], dtype=np.float64)
+    sizes = np.full((len(paths), 2), -1, dtype=np.int32)
+
+    if os.path.exists(cache_file):
+        cache = np.load(cache_file)
+        cached = {path: i for i, path in enumerate(cache['paths'])}
+        index = np.array([cached.get(path, -1) for path in paths], dtype=np.int64)
+        hit = index >= 0
+        hit[hit] = cache['mtimes'][index[hit]] == mtimes[hit]
+        sizes[hit] = cache['sizes'][index[hit]]
+
+    todo = np.where(sizes[:, 0] < 0)[0]
+    if len(todo) > 0:
+        sizes[todo] = probe_image_sizes([paths[i] for i in todo], num_workers)
+        # written aside then renamed, a reader never sees a partial cache
+        tmp_file = cache_file + '.tmp.npz'
+        np.savez(tmp_file, paths=np.array(paths, dtype=np.str_), mtimes=mtimes, sizes=sizes)
+        os.replace(tmp_file, cache_file)
+        print('read the size of {:d} / {:d} images in {:.2f}s: {}'.format(
+            len(todo), len(paths), time.time() - start, cache_file))
+    else:
+        print('loaded the size of {:d} images in {:.2f}s: {}'.format(len(paths), time.time() - start, cache_file))
+
+    lookup = {path: i for i, path in enumerate(paths)}
+    return sizes[[lookup[path] for path in image_paths]]
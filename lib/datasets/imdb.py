@@ -10,15 +10,46 @@ from __future__ import print_function
 
 import os
 import os.path as osp
-import PIL
 # from model.utils.cython_bbox import bbox_overlaps
 import numpy as np
 import scipy.sparse
 from model.utils.config import cfg
+from .image_sizes import get_image_sizes
 
 ROOT_DIR = osp.join(osp.dirname(__file__), '..', '..')
 
 
+def flip_roidb_entry(entry, width, hand_class):
+    """
+    gt labels of the horizontally flipped image
+    the boxes are mirrored, and when the entry has the hand labels, the hands change side: handside of the hands is
+    swapped (0 left, 1 right), contactleft / contactright of the objects are swapped and the unit vector from a hand
+    to its object points the other way in x (unitdx), unitdy and magnitude do not change
+    :param entry: roidb entry of the image, it is not modified
+    :param width: image width
+    :param hand_class: class id of 'hand'
+    :return: a new roidb entry, with 'flipped': True
+    """
+    flipped = dict(entry)
+    boxes = entry['boxes'].copy()
+    oldx1 = boxes[:, 0].copy()
+    oldx2 = boxes[:, 2].copy()
+    boxes[:, 0] = width - oldx2 - 1
+    boxes[:, 2] = width - oldx1 - 1
+    assert (boxes[:, 2] >= boxes[:, 0]).all()
+    flipped['boxes'] = boxes
+
+    if 'handside' in entry:
+        is_hand = entry['gt_classes'] == hand_class
+        handside = entry['handside']
+        flipped['handside'] = np.where(is_hand, 1 - handside, handside).astype(handside.dtype)
+        flipped['contactleft'] = entry['contactright']
+        flipped['contactright'] = entry['contactleft']
+        flipped['unitdx'] = -entry['unitdx']
+    flipped['flipped'] = True
+    return flipped
+
+
 class imdb(object):
     """Base class of loading image database+annotations."""
 
@@ -113,24 +144,28 @@ class imdb(object):
         """
         raise NotImplementedError
 
+    def image_sizes(self):
+        """
+        sizes of all images, read from the image headers in parallel, then cached with the file mtimes
+        cache file: '/.../data/cache_handobj_100K/voc_2007_trainval_image_sizes.npz'
+        :return: 2D int array (num_images, 2), each row is [width, height]
+        """
+        cache_file = osp.join(self.cache_path, self.name + '_image_sizes.npz')
+        return get_image_sizes([self.image_path_at(i) for i in range(self.num_images)], cache_file)
+
     def _get_widths(self):
-        return [PIL.Image.open(self.image_path_at(i)).size[0]
-                for i in range(self.num_images)]
+        return self.image_sizes()[:, 0].tolist()
+
+    def hand_class(self):
+        """ :return: class id of 'hand', -1 when the image set has no hands """
+        return list(self._classes).index('hand') if 'hand' in self._classes else -1
 
     def append_flipped_images(self, leftright=False):
         num_images = self.num_images
         widths = self._get_widths()
+        hand_class = self.hand_class()
         for i in range(num_images):
-            boxes = self.roidb[i]['boxes'].copy()
-            oldx1 = boxes[:, 0].copy()
-            oldx2 = boxes[:, 2].copy()
-            print('image_index', self.image_path_at(i))
-            print(oldx1, oldx2)
-            boxes[:, 0] = widths[i] - oldx2 - 1
-            boxes[:, 2] = widths[i] - oldx1 - 1
-            # print(boxes[:, 2] >= boxes[:, 0])
-            print(boxes[:, 2], boxes[:, 0])
-            assert (boxes[:, 2] >= boxes[:, 0]).all()
+            entry = flip_roidb_entry(self.roidb[i], widths[i], hand_class)
             gt_index = self.roidb[i]['gt_classes']
             if leftright:
                 if self.roidb[i] == 2:
@@ -139,10 +174,7 @@ class imdb(object):
                 if self.roidb[i] == 3:
                     print("change index")
                     gt_index = 2
-            entry = {'boxes': boxes,
-                     'gt_overlaps': self.roidb[i]['gt_overlaps'],
-                     'gt_classes': gt_index,
-                     'flipped': True}
+            entry['gt_classes'] = gt_index
             self.roidb.append(entry)
         self._image_index = self._image_index * 2
 
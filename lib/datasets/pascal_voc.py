@@ -13,13 +13,15 @@ import numpy as np
 import scipy.sparse
 import subprocess
 import uuid
+import time
 import scipy.io as sio
 import xml.etree.ElementTree as ET
 import pickle
 from .imdb import imdb
 from .imdb import ROOT_DIR
 from . import ds_utils
-from .voc_eval import voc_eval, voc_eval_hand
+from .voc_eval import voc_eval, voc_eval_hand_all
+from .annotation_store import get_annotation_store
 
 # TODO: make fast_rcnn irrelevant
 # >>>> obsolete, because it depends on sth outside of this project
@@ -49,6 +51,7 @@ class pascal_voc(imdb):
         self._roidb_handler = self.gt_roidb    # labels list [{}, {}, ...], each element is a dict that contains all labels for one image
         self._salt = str(uuid.uuid4())
         self._comp_id = 'comp4'
+        self._annotation_store = None
 
         # PASCAL specific config options
         self.config = {'cleanup': True,
@@ -111,28 +114,30 @@ class pascal_voc(imdb):
         return default_path
 
 
-    def gt_roidb(self):
+    def annotation_store(self):
         """
-        This function saves a dataset cache file to speed up future calls.
-        :return: labels list [{}, {}, ...], each element is a dict that contains all labels for one image
+        columnar annotations of the image set, parsed from the xml files once and shared by training and evaluation
+        store dir: '/.../data/cache_handobj_100K/voc_2007_trainval_annotations'
+        :return: an AnnotationStore
         """
+        if self._annotation_store is None:
+            annopath = os.path.join(self._data_path, 'Annotations', '{:s}.xml')
+            store_dir = os.path.join(self.cache_path, self.name + '_annotations')
+            self._annotation_store = get_annotation_store(annopath, self.image_index, store_dir)
+        return self._annotation_store
 
-        # cache_file: absolute dir '/.../data/cache_handobj_100K/VOC_2007_trainval_gt_roidb.pkl'
-        cache_file = os.path.join(self.cache_path, self.name+'_gt_roidb.pkl')
 
-        # load sequenced data from .pkl cache file
-        if os.path.exists(cache_file):
-            with open(cache_file, 'rb') as fid:
-                roidb = pickle.load(fid)
-            print('{} gt annotations loaded from {}'.format(self.name, cache_file))
-            return roidb
+    def gt_roidb(self):
+        """
+        This function builds the gt labels from the annotation store (which is cached) to speed up future calls.
+        :return: labels list [{}, {}, ...], each element is a dict that contains all labels for one image
+        """
+        store = self.annotation_store()
 
-        # save the annotation (parsed from xml) into .pkl cache file
         # [{}, {}, ...] each element is a dictionary that contains all labels for one image
-        gt_roidb = [self._load_pascal_annotation(index) for index in self.image_index]
-        with open(cache_file, 'wb') as fid:
-            pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
-        print('wrote gt roidb to {}'.format(cache_file))
+        start = time.time()
+        gt_roidb = store.roidb(self._class_to_ind, self.num_classes)
+        print('{} gt roidb built in {:.2f}s'.format(self.name, time.time() - start))
 
         return gt_roidb
 
@@ -384,7 +389,8 @@ class pascal_voc(imdb):
             filename = self._get_voc_results_file_template().format(cls)    # filename of the saved detections
 
             # hand, target AP evaluation
-            rec, prec, ap = voc_eval(filename, annopath, imagesetfile, cls, cachedir, ovthresh=0.5, use_07_metric=use_07_metric)
+            rec, prec, ap = voc_eval(filename, annopath, imagesetfile, cls, cachedir, ovthresh=0.5, use_07_metric=use_07_metric,
+                                     annotations=self.annotation_store())
             print('AP for {} = {:.4f}'.format(cls, ap))
 
             with open(os.path.join(output_dir, cls + '_pr.pkl'), 'wb') as f:
@@ -393,9 +399,12 @@ class pascal_voc(imdb):
             # hand + x, AP evaluation
             if cls == 'hand':
                 filename = self._get_voc_results_file_template()  # .format(cls)
-                for constraint in ['handstate', 'handside', 'objectbbox', 'all']:
-                    rec, prec, ap = voc_eval_hand(filename, annopath, imagesetfile, cls, cachedir, ovthresh=0.5,
-                                                  use_07_metric=use_07_metric, constraint=constraint)
+                constraints = ['handstate', 'handside', 'objectbbox', 'all']
+                results = voc_eval_hand_all(filename, annopath, imagesetfile, cls, cachedir, ovthresholds=(0.5,),
+                                            use_07_metric=use_07_metric, constraints=constraints,
+                                            annotations=self.annotation_store())
+                for constraint in constraints:
+                    rec, prec, ap = results[constraint, 0.5]
                     print('AP for {} + {} = {:.4f}'.format(cls, constraint, ap))
                     with open(os.path.join(output_dir, cls + f'_pr_{constraint}.pkl'), 'wb') as f:
                         pickle.dump({'rec': rec, 'prec': prec, 'ap': ap}, f)
@@ -408,6 +417,25 @@ class pascal_voc(imdb):
         print('--------------------------------------------------------------')
 
 
+    def evaluate_hand(self, all_boxes, constraints=('', 'handstate', 'handside', 'objectbbox', 'all')):
+        """
+        write the detection results and evaluate the hand AP under each constraint, without saving the pr curves
+        :param all_boxes: 2D list, 3 rows, num_images columns, each element is a 2D array (num_bbox, 11)
+        :param constraints: constraints of voc_eval_hand, '' is the hand box only
+        :return: {constraint: ap}
+        """
+        self._write_voc_results_file(all_boxes)
+        annopath = os.path.join(self._devkit_path, 'VOC'+self._year, 'Annotations', '{:s}.xml')
+        imagesetfile = os.path.join(self._devkit_path, 'VOC'+self._year, 'ImageSets', 'Main', self._image_set+'.txt')
+        cachedir = os.path.join(self._devkit_path, 'annotations_cache')
+        use_07_metric = True if int(self._year) < 2010 else False
+
+        results = voc_eval_hand_all(self._get_voc_results_file_template(), annopath, imagesetfile, 'hand', cachedir,
+                                    ovthresholds=(0.5,), use_07_metric=use_07_metric, constraints=constraints,
+                                    annotations=self.annotation_store())
+        return {constraint: results[constraint, 0.5][2] for constraint in constraints}
+
+
     def _do_matlab_eval(self, output_dir='output'):
         print('-----------------------------------------------------')
         print('Computing results with the official MATLAB eval code.')
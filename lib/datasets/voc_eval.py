@@ -11,6 +11,7 @@ import xml.etree.ElementTree as ET
 import os, sys, pdb, math
 import pickle
 import numpy as np
+from multiprocessing import Pool
 from PIL import Image, ImageDraw, ImageFont
 
 
@@ -90,7 +91,7 @@ def voc_ap(rec, prec, use_07_metric=False):
 '''
 @description: raw evaluation for fasterrcnn
 '''
-def voc_eval(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5, use_07_metric=False):
+def voc_eval(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5, use_07_metric=False, annotations=None):
     """
     PASCAL VOC AP evaluation.
     :param detpath: detection path, "data/VOCdevkit2007_handobj_100K/results/VOC2007/Main/comp4_det_test_hand.txt"
@@ -100,6 +101,7 @@ def voc_eval(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5,
     :param cachedir: annotation cash dir, "data/VOCdevkit2007_handobj_100K/annotations_cache"
     :param ovthresh: Overlap threshold (default = 0.5)
     :param use_07_metric: Whether to use VOC07's 11 point AP computation
+    :param annotations: optional AnnotationStore of the image set, replaces the xml parsing and the pkl cache
     :return:
     """
 
@@ -117,7 +119,9 @@ def voc_eval(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5,
     imagenames = [x.strip() for x in lines]
 
     # 1. load, parse and save gt labels (pkl file) based on image filename
-    if not os.path.isfile(cachefile):
+    if annotations is not None:
+        recs = None
+    elif not os.path.isfile(cachefile):
         recs = {}
         for i, imagename in enumerate(imagenames):
             recs[imagename] = parse_rec(annopath.format(imagename))    # annopath.format(imagename), replace {:s} with imagename
@@ -137,15 +141,19 @@ def voc_eval(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5,
     # 2. extract gt labels for current class
     class_recs = {}
     npos = 0
-    for imagename in imagenames:
-        R = [obj for obj in recs[imagename] if obj['name'].lower() == classname]
-        bbox = np.array([x['bbox'] for x in R])
-        difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-        det = [False] * len(R)
-        npos = npos + sum(~difficult)
-        class_recs[imagename] = {'bbox': bbox,
-                                 'difficult': difficult,
-                                 'det': det}
+    if annotations is not None:
+        class_recs = annotations.class_records(classname, imagenames)
+        npos = sum(np.sum(~R['difficult']) for R in class_recs.values())
+    else:
+        for imagename in imagenames:
+            R = [obj for obj in recs[imagename] if obj['name'].lower() == classname]
+            bbox = np.array([x['bbox'] for x in R])
+            difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
+            det = [False] * len(R)
+            npos = npos + sum(~difficult)
+            class_recs[imagename] = {'bbox': bbox,
+                                     'difficult': difficult,
+                                     'det': det}
 
     # 3. read file of detection results
     detfile = detpath.format(classname)
@@ -220,9 +228,10 @@ def voc_eval(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5,
 @description: eval hand-object-interaction
 @compare: hand_bbox, object_bbox, state, side
 '''
-def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5, use_07_metric=False, constraint=''):
+def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5, use_07_metric=False, constraint='',
+                  annotations=None):
     """
-    AP evaluation for hand interaction
+    AP evaluation for hand interaction under one constraint, see voc_eval_hand_all() to evaluate several at once
     :param detpath: detection results path, "data/VOCdevkit2007_handobj_100K/results/VOC2007/Main/comp4_det_test_hand.txt"
     :param annopath: gt lables path, "data/VOCdevkit2007_handobj_100K/VOC2007/Annotations/{:s}.xml"
     :param imagesetfile: image filename, one image per line. "data/VOCdevkit2007_handobj_100K/VOC2007/ImageSets/Main/test.txt"
@@ -231,12 +240,33 @@ def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh
     :param ovthresh: Overlap threshold (default = 0.5)
     :param use_07_metric: Whether to use VOC07's 11 point AP computation
     :param constraint: one of ['handstate', 'handside', 'objectbbox', 'all']
+    :param annotations: optional AnnotationStore of the image set, replaces the xml parsing and the pkl cache
     """
 
     print(f'\n\n*** current overlap thd = {ovthresh}')
     print(f'*** current constraint = {constraint}')
-    assert constraint in ['', 'handstate', 'handside', 'objectbbox', 'all']
+    results = voc_eval_hand_all(detpath, annopath, imagesetfile, classname, cachedir, ovthresholds=(ovthresh,),
+                                use_07_metric=use_07_metric, constraints=(constraint,), annotations=annotations)
+    return results[constraint, ovthresh]
+
+
+# constraints of voc_eval_hand
+#   '': the hand box only
+#   'handstate': hand + contact state
+#   'handside': hand + hand side
+#   'objectbbox': hand + target box (IoU > 0.5, or no target for both)
+#   'all': hand + target + hand side + contact state
+HAND_CONSTRAINTS = ['', 'handstate', 'handside', 'objectbbox', 'all']
 
+
+def _load_class_recs(annopath, imagesetfile, classname, cachedir, annotations=None):
+    """
+    gt labels of one class, from the annotation store or the xml files (cached in a pkl file)
+    :return: imagenames: list of image filenames of the image set
+             class_recs: {imagename: {'bbox': 2D array, 'difficult': 1D bool array, 'handstate': 1D int array,
+                                      'leftright': 1D int array, 'objectbbox': target bbox of each gt, or None}}
+             npos: number of non-difficult gt boxes
+    """
     if not os.path.isdir(cachedir):
         os.mkdir(cachedir)
     # data/VOCdevkit2007_handobj_100K/VOC2007/ImageSets/Main/test.txt_annots.pkl
@@ -247,7 +277,12 @@ def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh
         lines = f.readlines()
     imagenames = [x.strip() for x in lines]
 
-    # 1. load, parse and save gt labels (pkl file) based on image filename
+    if annotations is not None:
+        class_recs = annotations.class_records(classname, imagenames)
+        npos = sum(np.sum(~R['difficult']) for R in class_recs.values())
+        return imagenames, class_recs, npos
+
+    # load, parse and save gt labels (pkl file) based on image filename
     if not os.path.isfile(cachefile):
         recs = {}
         for i, imagename in enumerate(imagenames):
@@ -257,7 +292,6 @@ def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh
         print('Saving cached annotations to {:s}'.format(cachefile))
         with open(cachefile, 'wb') as f:
             pickle.dump(recs, f)
-    # load gt labels (pkl file)
     else:
         with open(cachefile, 'rb') as f:
             try:
@@ -265,60 +299,292 @@ def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh
             except:
                 recs = pickle.load(f, encoding='bytes')
 
-    """
-    recs is a dictionary of gt labels, each key is an image name, each value is a list of gt labels
-    e.g. recs['boardgame_v_-22f4DmhjLs_frame000022'] is shown as follows:
-    {'boardgame_v_-22f4DmhjLs_frame000022': [{'name': 'hand', 'difficult': 0, 'bbox': [851, 508, 900, 542], 'handstate': 0, 'leftright': 0, 'objxmin': None, 'objymin': None, 'objxmax': None, 'objymax': None, 'objectbbox': None},
-                                             {'name': 'hand', 'difficult': 0, 'bbox': [266, 226, 332, 254], 'handstate': 3, 'leftright': 0, 'objxmin': 238.0, 'objymin': 240.0, 'objxmax': 290.0, 'objymax': 266.0, 'objectbbox': [238.0, 240.0, 290.0, 266.0]}]
-    """
-
-    # 2. extract gt labels for hand class
     class_recs = {}
     npos = 0
-    for imagename in imagenames:    # for each image
-
+    for imagename in imagenames:
         # R: each element is a dictionary of a hand labels
         # [{'name': 'hand', 'difficult': 0, 'bbox': [851, 508, 900, 542], 'handstate': 0, 'leftright': 0}, {}, ...{}]
         R = [obj for obj in recs[imagename] if obj['name'].lower() == classname]
-        bbox = np.array([x['bbox'] for x in R])    # 2D int array, each row is a hand bbox
-        difficult = np.array([x['difficult'] for x in R]).astype(np.bool)    # 2D bool array, each row is a True/False
-        handstate = np.array([x['handstate'] for x in R]).astype(np.int)    # 2D int array, each row is 0/1/2/3/4
-        leftright = np.array([x['leftright'] for x in R]).astype(np.int)    # 2D int array, each row is 0/1
-        objectbbox = np.array([x['objectbbox'] for x in R])    # 2D float array, each row is a target bbox
-        det = [False] * len(R)
+        difficult = np.array([x['difficult'] for x in R]).astype(bool)
         npos = npos + sum(~difficult)    # number of non-difficult gt hand bbox for all images
-
-        # pack all useful gt into a dictionary, each key-value is an image
-        class_recs[imagename] = {'bbox': bbox,
+        class_recs[imagename] = {'bbox': np.array([x['bbox'] for x in R]),
                                  'difficult': difficult,
-                                 'handstate': handstate,
-                                 'leftright': leftright,
-                                 'objectbbox': objectbbox,
-                                 'det': det}
+                                 'handstate': np.array([x['handstate'] for x in R]).astype(int),
+                                 'leftright': np.array([x['leftright'] for x in R]).astype(int),
+                                 'objectbbox': [x['objectbbox'] for x in R]}
+    return imagenames, class_recs, npos
 
-    # 3. read detection results (hand / target)
-    # BB_det_object: 2D list, each element is a target detection [cls_score x1 y1 x2 y2 contactstate magnitude dx dy handside 1]
-    BB_det_object, image_ids_object, detfile_object = extract_BB(detpath, extract_class='targetobject')
 
-    # BB_det_object: 2D list, each element is a hand detection [cls_score x1 y1 x2 y2 contactstate magnitude dx dy handside 1]
-    BB_det_hand, image_ids_hand, detfile_hand = extract_BB(detpath, extract_class='hand')
+def _ragged_pairs(rows, starts, counts):
+    """
+    all (row, column) pairs of a ragged matrix
+    :param rows: 1D int array, the rows
+    :param starts: 1D int array, first column of each row
+    :param counts: 1D int array, number of columns of each row
+    :return: pair_rows, pair_columns, 1D int arrays, the pairs of a row are consecutive
+    """
+    pair_rows = np.repeat(rows, counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)    # position of the first pair of each row
+    pair_columns = np.repeat(starts, counts) + np.arange(len(pair_rows)) - first
+    return pair_rows, pair_columns
+
+
+def _first_best(pair_rows, values, num_rows):
+    """
+    argmax of each row of a ragged matrix, the first one on ties (as np.argmax)
+    :param pair_rows: 1D int array, row of each value, the values of a row are consecutive
+    :param values: 1D float array
+    :param num_rows: number of rows
+    :return: best: 1D float array (num_rows), -inf for an empty row
+             index: 1D int array (num_rows), position in values of the best value, -1 for an empty row
+    """
+    best = np.full(num_rows, -np.inf)
+    index = np.full(num_rows, -1, dtype=np.int64)
+    if len(values) > 0:
+        order = np.lexsort((np.arange(len(values)), -values, pair_rows))
+        first = order[np.r_[True, pair_rows[order][1:] != pair_rows[order][:-1]]]
+        best[pair_rows[first]] = values[first]
+        index[pair_rows[first]] = first
+    return best, index
+
+
+def _box_iou(boxes, gt):
+    """ IoU of voc_eval, +1 pixel, between the rows of two (n, 4) arrays """
+    ixmin = np.maximum(gt[:, 0], boxes[:, 0])
+    iymin = np.maximum(gt[:, 1], boxes[:, 1])
+    ixmax = np.minimum(gt[:, 2], boxes[:, 2])
+    iymax = np.minimum(gt[:, 3], boxes[:, 3])
+    iw = np.maximum(ixmax - ixmin + 1., 0.)
+    ih = np.maximum(iymax - iymin + 1., 0.)
+    inters = iw * ih
+    uni = ((boxes[:, 2] - boxes[:, 0] + 1.) * (boxes[:, 3] - boxes[:, 1] + 1.) +
+           (gt[:, 2] - gt[:, 0] + 1.) * (gt[:, 3] - gt[:, 1] + 1.) - inters)
+    return inters / uni
+
+
+def _object_iou(bb1, bb2):
+    """ IoU of get_iou(), without +1 pixel, between the rows of two (n, 4) arrays """
+    x_left = np.maximum(bb1[:, 0], bb2[:, 0])
+    y_top = np.maximum(bb1[:, 1], bb2[:, 1])
+    x_right = np.minimum(bb1[:, 2], bb2[:, 2])
+    y_bottom = np.minimum(bb1[:, 3], bb2[:, 3])
+    intersection_area = (x_right - x_left) * (y_bottom - y_top)
+    bb1_area = (bb1[:, 2] - bb1[:, 0]) * (bb1[:, 3] - bb1[:, 1])
+    bb2_area = (bb2[:, 2] - bb2[:, 0]) * (bb2[:, 3] - bb2[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = intersection_area / (bb1_area + bb2_area - intersection_area)
+    return np.where((x_right < x_left) | (y_bottom < y_top), 0., iou)
+
 
-    # zip target and hand predictions into a dictionary for each image
-    ho_dict = make_hand_object_dict(BB_det_object, BB_det_hand, image_ids_object, image_ids_hand)
+def _read_hand_detections(detpath, lookup):
+    """
+    read the hand and target detections, and assign each hand a target as gen_det_result() does
+    :param detpath: detection results path template, "data/.../comp4_det_test_{:s}.txt"
+    :param lookup: {imagename: image index}
+    :return: dict of 1D / 2D arrays, one row per hand, in the order of gen_det_result():
+             'image' (image index), 'score', 'bbox' (n, 4), 'handstate', 'handside',
+             'objectbbox' (n, 4, nan when the hand has no target)
+    """
+    BB_o, image_o, _ = extract_BB(detpath, extract_class='targetobject')
+    BB_h, image_h, _ = extract_BB(detpath, extract_class='hand')
+    BB_o = BB_o.reshape(-1, 11)
+    BB_h = BB_h.reshape(-1, 11)
+    num_images = len(lookup)
+
+    # the hands are grouped by image, in the order of the first hand of each image (the order of ho_dict)
+    image_h = np.array([lookup[x] for x in image_h], dtype=np.int64)
+    _, first, inverse = np.unique(image_h, return_index=True, return_inverse=True)
+    order = np.argsort(first[inverse.reshape(-1)], kind='stable')
+    BB_h, image_h = BB_h[order], image_h[order]
+
+    # the targets of each image, in file order, the targets of images without hands are never used
+    image_o = np.array([lookup.get(x, -1) for x in image_o], dtype=np.int64)
+    keep = np.where(image_o >= 0)[0]
+    keep = keep[np.argsort(image_o[keep], kind='stable')]
+    BB_o, image_o = BB_o[keep], image_o[keep]
+    obj_counts = np.bincount(image_o, minlength=num_images)
+    obj_starts = np.cumsum(obj_counts) - obj_counts
+
+    # a hand in contact goes to the target closest to center + magnitude * 10000 * (dx, dy)
+    objectbbox = np.full((len(BB_h), 4), np.nan)
+    linked = np.where((BB_h[:, 5] > 0) & (obj_counts[image_h] > 0))[0]
+    pair_rows, pair_objs = _ragged_pairs(linked, obj_starts[image_h[linked]], obj_counts[image_h[linked]])
+    hand = BB_h[pair_rows]
+    obj = BB_o[pair_objs]
+    point_x = (hand[:, 1] + hand[:, 3]) / 2 + hand[:, 6] * 10000 * hand[:, 7]
+    point_y = (hand[:, 2] + hand[:, 4]) / 2 + hand[:, 6] * 10000 * hand[:, 8]
+    dist = ((obj[:, 1] + obj[:, 3]) / 2 - point_x) ** 2 + ((obj[:, 2] + obj[:, 4]) / 2 - point_y) ** 2
+    _, closest = _first_best(pair_rows, -dist, len(BB_h))
+    objectbbox[linked] = BB_o[pair_objs[closest[linked]], 1:5]
+
+    return {'image': image_h, 'score': BB_h[:, 0], 'bbox': BB_h[:, 1:5],
+            'handstate': BB_h[:, 5].astype(int), 'handside': BB_h[:, 9].astype(int), 'objectbbox': objectbbox}
+
+
+def _hand_gt_arrays(class_recs, imagenames):
+    """
+    :return: dict of the concatenated gt of all images, 'offsets': the gt of image i are offsets[i]:offsets[i+1],
+             'bbox' (n, 4), 'difficult', 'handstate', 'leftright', 'objectbbox' (n, 4, nan when there is no target)
+    """
+    records = [class_recs[imagename] for imagename in imagenames]
+    counts = np.array([len(R['difficult']) for R in records], dtype=np.int64)
+    objectbbox = [np.nan * np.ones(4) if box is None else np.array(box, dtype=float)
+                  for R in records for box in R['objectbbox']]
+    return {'offsets': np.r_[0, np.cumsum(counts)],
+            'bbox': np.concatenate([np.reshape(R['bbox'], (-1, 4)) for R in records] + [np.zeros((0, 4))]).astype(float),
+            'difficult': np.concatenate([R['difficult'] for R in records] + [np.zeros(0)]).astype(bool),
+            'handstate': np.concatenate([R['handstate'] for R in records] + [np.zeros(0)]).astype(int),
+            'leftright': np.concatenate([R['leftright'] for R in records] + [np.zeros(0)]).astype(int),
+            'objectbbox': np.array(objectbbox).reshape(-1, 4)}
+
+
+def _match_hands(args):
+    """
+    match the hands of a range of images to their gt
+    :param args: (dets, gt), the arrays of _read_hand_detections() and _hand_gt_arrays() for these images,
+                 the image indices of dets start at 0
+    :return: max_iou: 1D array, best IoU with a gt hand of the image, -inf when the image has no gt hand
+             gt_index: 1D int array, index of the best gt in gt, -1 when the image has no gt hand
+             conditions: {constraint: 1D bool array, whether the detection agrees with its best gt}
+    """
+    dets, gt = args
+    num_dets = len(dets['score'])
+    counts = np.diff(gt['offsets'])[dets['image']]
+    pair_rows, pair_gt = _ragged_pairs(np.arange(num_dets), gt['offsets'][dets['image']], counts)
+    overlaps = _box_iou(dets['bbox'][pair_rows], gt['bbox'][pair_gt])
+    max_iou, best = _first_best(pair_rows, overlaps, num_dets)
+    gt_index = np.where(best >= 0, pair_gt[np.maximum(best, 0)] if len(pair_gt) else -1, -1)
+
+    matched = np.where(gt_index >= 0)[0]
+    handstate = np.zeros(num_dets, dtype=bool)
+    handside = np.zeros(num_dets, dtype=bool)
+    objectbbox = np.zeros(num_dets, dtype=bool)
+    handstate[matched] = gt['handstate'][gt_index[matched]] == dets['handstate'][matched]
+    handside[matched] = gt['leftright'][gt_index[matched]] == dets['handside'][matched]
+
+    # val_objectbbox(): no target for both, or targets with IoU > 0.5
+    obj_gt = gt['objectbbox'][gt_index[matched]]
+    obj_det = dets['objectbbox'][matched]
+    none_gt = np.isnan(obj_gt).any(axis=1)
+    none_det = np.isnan(obj_det).any(axis=1)
+    objectbbox[matched] = (none_gt & none_det) | (~none_gt & ~none_det & (_object_iou(obj_gt, obj_det) > 0.5))
+
+    conditions = {'': np.ones(num_dets, dtype=bool), 'handstate': handstate, 'handside': handside,
+                  'objectbbox': objectbbox, 'all': handstate & handside & objectbbox}
+    return max_iou, gt_index, conditions
+
+
+def _image_chunk(dets, gt, start, end):
+    """ the detections and gt of the images start:end, re-indexed from 0 """
+    rows = np.where((dets['image'] >= start) & (dets['image'] < end))[0]
+    chunk_dets = {key: value[rows] for key, value in dets.items()}
+    chunk_dets['image'] = chunk_dets['image'] - start
+    s, e = gt['offsets'][start], gt['offsets'][end]
+    chunk_gt = {key: value[s:e] for key, value in gt.items() if key != 'offsets'}
+    chunk_gt['offsets'] = gt['offsets'][start:end + 1] - s
+    return rows, (chunk_dets, chunk_gt)
+
+
+def voc_eval_hand_all(detpath, annopath, imagesetfile, classname, cachedir, ovthresholds=(0.5,), use_07_metric=False,
+                      constraints=HAND_CONSTRAINTS, annotations=None, num_workers=0):
+    """
+    AP evaluation for hand interaction under every constraint and overlap threshold at once, the same results as
+    voc_eval_hand() for each of them: the detections are read once and matched to the gt with array operations
+    :param detpath: detection results path, "data/VOCdevkit2007_handobj_100K/results/VOC2007/Main/comp4_det_test_{:s}.txt"
+    :param annopath: gt lables path, "data/VOCdevkit2007_handobj_100K/VOC2007/Annotations/{:s}.xml"
+    :param imagesetfile: image filename, one image per line. "data/VOCdevkit2007_handobj_100K/VOC2007/ImageSets/Main/test.txt"
+    :param classname: 'hand'
+    :param cachedir: annotation cash dir, "data/VOCdevkit2007_handobj_100K/annotations_cache"
+    :param ovthresholds: overlap thresholds
+    :param use_07_metric: Whether to use VOC07's 11 point AP computation
+    :param constraints: constraints of HAND_CONSTRAINTS
+    :param annotations: optional AnnotationStore of the image set, replaces the xml parsing and the pkl cache
+    :param num_workers: number of processes matching the detections of a part of the images, 0 for this process
+    :return: {(constraint, ovthresh): (recall, precision, ap)}
+    """
+    for constraint in constraints:
+        assert constraint in HAND_CONSTRAINTS
+
+    # 1. gt labels and detections, as arrays
+    imagenames, class_recs, npos = _load_class_recs(annopath, imagesetfile, classname, cachedir, annotations)
+    lookup = {imagename: i for i, imagename in enumerate(imagenames)}
+    gt = _hand_gt_arrays(class_recs, imagenames)
+    dets = _read_hand_detections(detpath, lookup)
+
+    # 2. sort by hand confidence from high to low
+    sorted_ind = np.argsort(-dets['score'])
+    dets = {key: value[sorted_ind] for key, value in dets.items()}
+
+    # 3. best gt of each detection, the images are independent
+    if num_workers > 0 and len(imagenames) > 1:
+        bounds = np.linspace(0, len(imagenames), min(num_workers, len(imagenames)) + 1).astype(int)
+        chunks = [_image_chunk(dets, gt, s, e) for s, e in zip(bounds[:-1], bounds[1:])]
+        pool = Pool(num_workers)
+        try:
+            results = pool.map(_match_hands, [chunk for _, chunk in chunks])
+        finally:
+            pool.close()
+            pool.join()
+        max_iou = np.full(len(dets['score']), -np.inf)
+        gt_index = np.full(len(dets['score']), -1, dtype=np.int64)
+        conditions = {key: np.zeros(len(dets['score']), dtype=bool) for key in HAND_CONSTRAINTS}
+        for (rows, _), (s, e), result in zip(chunks, zip(bounds[:-1], bounds[1:]), results):
+            max_iou[rows] = result[0]
+            gt_index[rows] = np.where(result[1] >= 0, result[1] + gt['offsets'][s], -1)
+            for key in HAND_CONSTRAINTS:
+                conditions[key][rows] = result[2][key]
+    else:
+        max_iou, gt_index, conditions = _match_hands((dets, gt))
+
+    # 4. TPs and FPs: above the threshold, a non-difficult gt is taken by its first (most confident) detection which
+    # satisfies the constraint, the other detections are FPs; a difficult gt ignores its detections
+    results = {}
+    difficult = gt['difficult'][np.maximum(gt_index, 0)] if len(gt['difficult']) else np.zeros(len(gt_index), bool)
+    for ovthresh in ovthresholds:
+        above = max_iou > ovthresh
+        candidate = above & ~difficult
+        for constraint in constraints:
+            tp = np.zeros(len(max_iou))
+            take = np.where(candidate & conditions[constraint])[0]
+            _, first = np.unique(gt_index[take], return_index=True)
+            tp[take[first]] = 1.
+            fp = (~above | (candidate & (tp == 0))).astype(float)
+
+            # compute precision recall
+            fp = np.cumsum(fp)
+            tp = np.cumsum(tp)
+            recall = tp / float(npos)
+            # avoid divide by zero in case the first detection matches a difficult
+            # ground truth
+            precision = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+            results[constraint, ovthresh] = (recall, precision, voc_ap(recall, precision, use_07_metric))
+    return results
+
+
+def voc_eval_hand_reference(detpath, annopath, imagesetfile, classname, cachedir, ovthresh=0.5, use_07_metric=False,
+                            constraint='', annotations=None):
+    """
+    the per-detection loop voc_eval_hand() ran before voc_eval_hand_all(), kept as the reference of its results
+    (benchmarks/voc_eval_bench.py), do not use it for the evaluation
+    :return: recall, precision, ap of one constraint and overlap threshold
+    """
+    assert constraint in HAND_CONSTRAINTS
+    imagenames, class_recs, npos = _load_class_recs(annopath, imagesetfile, classname, cachedir, annotations)
+    for R in class_recs.values():
+        R['det'] = [False] * len(R['difficult'])
 
-    # 4. each hand is assigned with a target by link info
-    # hand detection results, 2D list, each sub-list has 8 elements
+    # each hand is assigned with a target by link info
     # [img_filename, handscore, handbbox, contactstate, vector, side, objectbbox, objectbbox_score]
-    # ['boardgame_v_-22f4DmhjLs_frame000022', 0.794, array([846.9, 504.3, 890.8, 545.2]), 1.0, array([ 0.071, -0.023, -0.097]), 0.0, [747.6, 152.5, 1135.1, 701.1], 0.875]
-    hand_det_res = gen_det_result(ho_dict)
+    BB_det_object, image_ids_object, _ = extract_BB(detpath, extract_class='targetobject')
+    BB_det_hand, image_ids_hand, _ = extract_BB(detpath, extract_class='hand')
+    hand_det_res = gen_det_result(make_hand_object_dict(BB_det_object, BB_det_hand, image_ids_object, image_ids_hand))
 
     image_ids = [x[0] for x in hand_det_res]    # image filename
     confidence = np.array([x[1] for x in hand_det_res])    # hand class score
     BB_det = np.array([x[2] for x in hand_det_res]).astype(float)    # hand bbox, 2D array
     handstate_det = np.array([int(x[3]) for x in hand_det_res])  # contact state
-    leftright_det = np.array([int(x[5]) for x in hand_det_res])  # hand sie
+    leftright_det = np.array([int(x[5]) for x in hand_det_res])  # hand side
     objectbbox_det = [x[6] for x in hand_det_res]    # target bbox, 2D list
-    objectbbox_score_det = [x[7] for x in hand_det_res]    # target score
 
     nd = len(image_ids)    # number of detected hand among the test set
     tp = np.zeros(nd)
@@ -331,23 +597,16 @@ def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh
         BB_det = BB_det[sorted_ind, :]
         handstate_det = handstate_det[sorted_ind]
         leftright_det = leftright_det[sorted_ind]
-        objectbbox_det = [objectbbox_det[x] for x in sorted_ind]  # objectbbox_det[sorted_ind, :]
+        objectbbox_det = [objectbbox_det[x] for x in sorted_ind]
 
-        # 5. for each detected hand, compute TPs and FPs
+        # for each detected hand, compute TPs and FPs
         for d in range(nd):
-            # one hand detection
             bb_det = BB_det[d, :].astype(float)    # predicted hand bbox, 1D array
-            hstate_det = handstate_det[d].astype(int)
-            hside_det = leftright_det[d].astype(int)
-            objbbox_det = objectbbox_det[d]  # .astype(float)
 
             # get gt hand labels of one image
             max_iou = -np.inf
             R = class_recs[image_ids[d]]    # all gt labels for the same image
             BBGT = R['bbox'].astype(float)    # hand bbox, 2D array
-            hstate_GT = R['handstate'].astype(int)    # contactstate, 1D array [0, 0, 0, 0, 0]
-            hside_GT = R['leftright'].astype(int)    # hand side, 1D array [0, 0, 1, 1, 1]
-            objbbox_GT = R['objectbbox']    # target bbox, 1D array, [list([337.0, 488.0, 915.0, 653.0]), None, None, None, None]
 
             if BBGT.size > 0:
                 # compute the IoU between one predicted hand and all gt hands
@@ -367,71 +626,25 @@ def voc_eval_hand(detpath, annopath, imagesetfile, classname, cachedir, ovthresh
                 max_iou = np.max(overlaps)    # max IoU value
                 ind = np.argmax(overlaps)    # index of the max IoU
 
-            if constraint == '':
-                if max_iou > ovthresh:
-                    if not R['difficult'][ind]:
-                        if not R['det'][ind]:    # if the gt hand hasn't been assigned to any prediction
-                            tp[d] = 1.
-                            R['det'][ind] = 1
-                        else:
-                            fp[d] = 1.
-                else:
-                    fp[d] = 1.
-
-            # hand + contact state
-            elif constraint == 'handstate':
-                if max_iou > ovthresh:
-                    if not R['difficult'][ind]:
-                        if not R['det'][ind] and hstate_GT[ind] == hstate_det:
-                            tp[d] = 1.
-                            R['det'][ind] = 1
-                        else:
-                            fp[d] = 1.
-                else:
-                    fp[d] = 1.
-
-            # hand + hand side
-            elif constraint == 'handside':
-                if max_iou > ovthresh:
-                    if not R['difficult'][ind]:
-                        if not R['det'][ind] and hside_GT[ind] == hside_det:
-                            tp[d] = 1.
-                            R['det'][ind] = 1
-                        else:
-                            fp[d] = 1.
-                else:
-                    fp[d] = 1.
-
-            # hand + target
-            elif constraint == 'objectbbox':
-                if max_iou > ovthresh:
-                    if not R['difficult'][ind]:
-                        if not R['det'][ind] and val_objectbbox(objbbox_GT[ind], objbbox_det):
-                            tp[d] = 1.
-                            R['det'][ind] = 1
-                        else:
-                            fp[d] = 1.
-                else:
-                    fp[d] = 1.
-
-            # hand + target + hand side + contact state
-            elif constraint == 'all':
-                if max_iou > ovthresh:
-                    if not R['difficult'][ind]:
-                        if not R['det'][ind] and hstate_GT[ind] == hstate_det and hside_GT[ind] == hside_det and val_objectbbox(objbbox_GT[ind], objbbox_det):
-                            tp[d] = 1.
-                            R['det'][ind] = 1
-                        else:
-                            fp[d] = 1.
-                else:
-                    fp[d] = 1.
+            if max_iou > ovthresh:
+                if not R['difficult'][ind]:
+                    state_ok = constraint not in ['handstate', 'all'] or R['handstate'][ind] == handstate_det[d]
+                    side_ok = constraint not in ['handside', 'all'] or R['leftright'][ind] == leftright_det[d]
+                    # if the gt hand hasn't been assigned to any prediction
+                    if not R['det'][ind] and state_ok and side_ok and \
+                            (constraint not in ['objectbbox', 'all'] or
+                             val_objectbbox(R['objectbbox'][ind], objectbbox_det[d])):
+                        tp[d] = 1.
+                        R['det'][ind] = 1
+                    else:
+                        fp[d] = 1.
+            else:
+                fp[d] = 1.
 
     # compute precision recall
     fp = np.cumsum(fp)
     tp = np.cumsum(tp)
     recall = tp / float(npos)
-    # avoid divide by zero in case the first detection matches a difficult
-    # ground truth
     precision = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
     ap = voc_ap(recall, precision, use_07_metric)
 
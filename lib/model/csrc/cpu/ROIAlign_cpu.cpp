@@ -1,5 +1,8 @@
 // Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 #include "cpu/vision.h"
+#include <ATen/Parallel.h>
+
+#include <vector>
 
 // implementation taken from Caffe2
 template <typename T>
@@ -110,8 +113,172 @@ void pre_calc_for_bilinear_interpolate(
   }
 }
 
+// channels of a RoI pooled together by one task, the tasks are spread over the threads
+int const channelsPerTask = 128;
+
 template <typename T>
 void ROIAlignForward_cpu_kernel(
+    const int num_rois,
+    const T* bottom_data,
+    const T& spatial_scale,
+    const int channels,
+    const int height,
+    const int width,
+    const int pooled_height,
+    const int pooled_width,
+    const int sampling_ratio,
+    const T* bottom_rois,
+    //int roi_cols,
+    T* top_data) {
+  //AT_ASSERT(roi_cols == 4 || roi_cols == 5);
+  int roi_cols = 5;
+
+  // bottom_data is channels last (n, h, w, c), so that the 4 neighbours of a sampling point are read as contiguous
+  // runs of channels; each task pools a block of channels of one RoI, (n, c, ph, pw) is an element in the output
+  const int channel_tasks = (channels + channelsPerTask - 1) / channelsPerTask;
+  at::parallel_for(0, static_cast<int64_t>(num_rois) * channel_tasks, 1, [&](int64_t begin, int64_t end) {
+    // buffers of the thread, the precalc is only recomputed when the task moves to another RoI
+    std::vector<PreCalc<T>> pre_calc;
+    std::vector<T> output_val(channelsPerTask);
+    int cached_n = -1;
+    int roi_batch_ind = 0;
+    int roi_bin_grid_h = 0;
+    int roi_bin_grid_w = 0;
+    T count = 1;
+
+    for (int64_t task = begin; task < end; task++) {
+      const int n = task / channel_tasks;
+      const int c_start = (task % channel_tasks) * channelsPerTask;
+      const int c_size = std::min(channels - c_start, channelsPerTask);
+
+      if (n != cached_n) {
+        cached_n = n;
+        // roi could have 4 or 5 columns
+        const T* offset_bottom_rois = bottom_rois + n * roi_cols;
+        roi_batch_ind = 0;
+        if (roi_cols == 5) {
+          roi_batch_ind = offset_bottom_rois[0];
+          offset_bottom_rois++;
+        }
+
+        // Do not using rounding; this implementation detail is critical
+        T roi_start_w = offset_bottom_rois[0] * spatial_scale;
+        T roi_start_h = offset_bottom_rois[1] * spatial_scale;
+        T roi_end_w = offset_bottom_rois[2] * spatial_scale;
+        T roi_end_h = offset_bottom_rois[3] * spatial_scale;
+
+        // Force malformed ROIs to be 1x1
+        T roi_width = std::max(roi_end_w - roi_start_w, (T)1.);
+        T roi_height = std::max(roi_end_h - roi_start_h, (T)1.);
+        T bin_size_h = static_cast<T>(roi_height) / static_cast<T>(pooled_height);
+        T bin_size_w = static_cast<T>(roi_width) / static_cast<T>(pooled_width);
+
+        // We use roi_bin_grid to sample the grid and mimic integral
+        roi_bin_grid_h = (sampling_ratio > 0)
+            ? sampling_ratio
+            : ceil(roi_height / pooled_height); // e.g., = 2
+        roi_bin_grid_w =
+            (sampling_ratio > 0) ? sampling_ratio : ceil(roi_width / pooled_width);
+
+        // We do average (integral) pooling inside a bin
+        count = roi_bin_grid_h * roi_bin_grid_w; // e.g. = 4
+
+        // we want to precalculate indeces and weights shared by all chanels,
+        // this is the key point of optimiation
+        pre_calc.resize(roi_bin_grid_h * roi_bin_grid_w * pooled_width * pooled_height);
+        pre_calc_for_bilinear_interpolate(
+            height,
+            width,
+            pooled_height,
+            pooled_width,
+            roi_bin_grid_h,
+            roi_bin_grid_w,
+            roi_start_h,
+            roi_start_w,
+            bin_size_h,
+            bin_size_w,
+            roi_bin_grid_h,
+            roi_bin_grid_w,
+            pre_calc);
+      }
+
+      const T* offset_bottom_data = bottom_data + static_cast<int64_t>(roi_batch_ind) * height * width * channels + c_start;
+      T* val = output_val.data();
+      int pre_calc_index = 0;
+
+      for (int ph = 0; ph < pooled_height; ph++) {
+        for (int pw = 0; pw < pooled_width; pw++) {
+          std::fill(val, val + c_size, static_cast<T>(0));
+          for (int iy = 0; iy < roi_bin_grid_h; iy++) {
+            for (int ix = 0; ix < roi_bin_grid_w; ix++) {
+              PreCalc<T> pc = pre_calc[pre_calc_index];
+              const T* data1 = offset_bottom_data + static_cast<int64_t>(pc.pos1) * channels;
+              const T* data2 = offset_bottom_data + static_cast<int64_t>(pc.pos2) * channels;
+              const T* data3 = offset_bottom_data + static_cast<int64_t>(pc.pos3) * channels;
+              const T* data4 = offset_bottom_data + static_cast<int64_t>(pc.pos4) * channels;
+              for (int c = 0; c < c_size; c++) {
+                val[c] += pc.w1 * data1[c] + pc.w2 * data2[c] + pc.w3 * data3[c] + pc.w4 * data4[c];
+              }
+
+              pre_calc_index += 1;
+            }
+          }
+
+          T* offset_top_data = top_data + ((static_cast<int64_t>(n) * channels + c_start) * pooled_height + ph) * pooled_width + pw;
+          for (int c = 0; c < c_size; c++) {
+            offset_top_data[c * pooled_height * pooled_width] = val[c] / count;
+          }
+        } // for pw
+      } // for ph
+    } // for task
+  });
+}
+
+at::Tensor ROIAlign_forward_cpu(const at::Tensor& input,
+                                const at::Tensor& rois,
+                                const float spatial_scale,
+                                const int pooled_height,
+                                const int pooled_width,
+                                const int sampling_ratio) {
+  AT_ASSERTM(!input.type().is_cuda(), "input must be a CPU tensor");
+  AT_ASSERTM(!rois.type().is_cuda(), "rois must be a CPU tensor");
+
+  auto num_rois = rois.size(0);
+  auto channels = input.size(1);
+  auto height = input.size(2);
+  auto width = input.size(3);
+
+  auto output = at::empty({num_rois, channels, pooled_height, pooled_width}, input.options());
+
+  if (output.numel() == 0) {
+    return output;
+  }
+
+  // channels last, free when the features already are (e.g. a channels_last backbone)
+  auto input_nhwc = input.permute({0, 2, 3, 1}).contiguous();
+  auto rois_t = rois.contiguous();
+
+  AT_DISPATCH_FLOATING_TYPES(input.type(), "ROIAlign_forward", [&] {
+    ROIAlignForward_cpu_kernel<scalar_t>(
+         num_rois,
+         input_nhwc.data<scalar_t>(),
+         spatial_scale,
+         channels,
+         height,
+         width,
+         pooled_height,
+         pooled_width,
+         sampling_ratio,
+         rois_t.data<scalar_t>(),
+         output.data<scalar_t>());
+  });
+  return output;
+}
+
+
+// the previous kernel, one RoI at a time on channels first features, kept as the reference of tests and benchmarks
+template <typename T>
+void ROIAlignForward_cpu_reference_kernel(
     const int nthreads,
     const T* bottom_data,
     const T& spatial_scale,
@@ -218,12 +385,12 @@ void ROIAlignForward_cpu_kernel(
   } // for n
 }
 
-at::Tensor ROIAlign_forward_cpu(const at::Tensor& input,
-                                const at::Tensor& rois,
-                                const float spatial_scale,
-                                const int pooled_height,
-                                const int pooled_width,
-                                const int sampling_ratio) {
+at::Tensor ROIAlign_forward_cpu_reference(const at::Tensor& input,
+                                          const at::Tensor& rois,
+                                          const float spatial_scale,
+                                          const int pooled_height,
+                                          const int pooled_width,
+                                          const int sampling_ratio) {
   AT_ASSERTM(!input.type().is_cuda(), "input must be a CPU tensor");
   AT_ASSERTM(!rois.type().is_cuda(), "rois must be a CPU tensor");
 
@@ -239,8 +406,8 @@ at::Tensor ROIAlign_forward_cpu(const at::Tensor& input,
     return output;
   }
 
-  AT_DISPATCH_FLOATING_TYPES(input.type(), "ROIAlign_forward", [&] {
-    ROIAlignForward_cpu_kernel<scalar_t>(
+  AT_DISPATCH_FLOATING_TYPES(input.type(), "ROIAlign_forward_reference", [&] {
+    ROIAlignForward_cpu_reference_kernel<scalar_t>(
          output_size,
          input.data<scalar_t>(),
          spatial_scale,
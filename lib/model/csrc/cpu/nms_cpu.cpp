@@ -1,11 +1,142 @@
 // Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 #include "cpu/vision.h"
+#include <ATen/Parallel.h>
+
+#include <vector>
+
+
+// boxes are processed in blocks of 64, the suppression of a box by the boxes of a block is one 64-bit word
+int const boxesPerBlock = sizeof(uint64_t) * 8;
+
+
+// IoU of box i against the 64 boxes of a block, as a bitmask of the boxes with IoU >= threshold
+// the boxes are in SoA layout so that the loop over the block vectorises
+template <typename scalar_t>
+inline uint64_t block_mask(const scalar_t* x1, const scalar_t* y1, const scalar_t* x2, const scalar_t* y2,
+                           const scalar_t* areas, const int64_t i, const int64_t start, const int64_t size,
+                           const scalar_t threshold) {
+  const scalar_t ix1 = x1[i], iy1 = y1[i], ix2 = x2[i], iy2 = y2[i], iarea = areas[i];
+  uint8_t flags[boxesPerBlock];
+  for (int64_t k = 0; k < size; k++) {
+    const int64_t j = start + k;
+    scalar_t w = std::min(ix2, x2[j]) - std::max(ix1, x1[j]) + 1;
+    scalar_t h = std::min(iy2, y2[j]) - std::max(iy1, y1[j]) + 1;
+    w = w > 0 ? w : 0;
+    h = h > 0 ? h : 0;
+    const scalar_t inter = w * h;
+    flags[k] = inter / (iarea + areas[j] - inter) >= threshold;
+  }
+  uint64_t mask = 0;
+  for (int64_t k = 0; k < size; k++) {
+    mask |= static_cast<uint64_t>(flags[k]) << k;
+  }
+  return mask;
+}
 
 
 template <typename scalar_t>
 at::Tensor nms_cpu_kernel(const at::Tensor& dets,
                           const at::Tensor& scores,
-                          const float threshold) {
+                          const float threshold,
+                          const int64_t max_keep) {
+  AT_ASSERTM(!dets.type().is_cuda(), "dets must be a CPU tensor");
+  AT_ASSERTM(!scores.type().is_cuda(), "scores must be a CPU tensor");
+  AT_ASSERTM(dets.type() == scores.type(), "dets should have the same type as scores");
+
+  if (dets.numel() == 0) {
+    return at::empty({0}, dets.options().dtype(at::kLong).device(at::kCPU));
+  }
+
+  // boxes sorted by decreasing score, one contiguous array per coordinate
+  auto order_t = std::get<1>(scores.sort(0, /* descending=*/true));
+  auto sorted_t = dets.index_select(0, order_t);
+  auto x1_t = sorted_t.select(1, 0).contiguous();
+  auto y1_t = sorted_t.select(1, 1).contiguous();
+  auto x2_t = sorted_t.select(1, 2).contiguous();
+  auto y2_t = sorted_t.select(1, 3).contiguous();
+  at::Tensor areas_t = (x2_t - x1_t + 1) * (y2_t - y1_t + 1);
+
+  auto order = order_t.data<int64_t>();
+  auto x1 = x1_t.data<scalar_t>();
+  auto y1 = y1_t.data<scalar_t>();
+  auto x2 = x2_t.data<scalar_t>();
+  auto y2 = y2_t.data<scalar_t>();
+  auto areas = areas_t.data<scalar_t>();
+  const scalar_t thresh = threshold;
+
+  const int64_t ndets = dets.size(0);
+  const int64_t col_blocks = (ndets + boxesPerBlock - 1) / boxesPerBlock;
+  const int64_t limit = max_keep > 0 ? std::min(max_keep, ndets) : ndets;
+
+  // removed: bitmask of the suppressed boxes, mask: suppression bitmasks of the 64 boxes of the current block
+  std::vector<uint64_t> removed(col_blocks, 0);
+  std::vector<uint64_t> mask(boxesPerBlock * col_blocks);
+  std::vector<int64_t> rows;
+  std::vector<int64_t> keep;
+  keep.reserve(limit);
+
+  for (int64_t block = 0; block < col_blocks && static_cast<int64_t>(keep.size()) < limit; block++) {
+    const int64_t row_start = block * boxesPerBlock;
+    const int64_t row_size = std::min(ndets - row_start, static_cast<int64_t>(boxesPerBlock));
+
+    // the boxes of the block which are not suppressed by the kept boxes of the previous blocks
+    rows.clear();
+    for (int64_t r = 0; r < row_size; r++) {
+      if (!(removed[block] & (1ULL << r))) {
+        rows.push_back(r);
+      }
+    }
+    if (rows.empty()) {
+      continue;
+    }
+
+    // suppression masks of these boxes against all following blocks, the blocks are split across threads
+    at::parallel_for(block, col_blocks, 1, [&](int64_t begin, int64_t end) {
+      for (int64_t col = begin; col < end; col++) {
+        const int64_t col_start = col * boxesPerBlock;
+        const int64_t col_size = std::min(ndets - col_start, static_cast<int64_t>(boxesPerBlock));
+        for (auto r : rows) {
+          uint64_t t = block_mask(x1, y1, x2, y2, areas, row_start + r, col_start, col_size, thresh);
+          if (col == block) {
+            // a box only suppresses the boxes after it
+            t &= r + 1 < boxesPerBlock ? ~((2ULL << r) - 1) : 0;
+          }
+          mask[r * col_blocks + col] = t;
+        }
+      }
+    });
+
+    // greedy selection inside the block, as the GPU kernel does on the host
+    for (auto r : rows) {
+      if (removed[block] & (1ULL << r)) {
+        continue;
+      }
+      keep.push_back(row_start + r);
+      if (static_cast<int64_t>(keep.size()) == limit) {
+        break;
+      }
+      const uint64_t* p = &mask[r * col_blocks];
+      for (int64_t col = block; col < col_blocks; col++) {
+        removed[col] |= p[col];
+      }
+    }
+  }
+
+  // indices of the kept boxes in the input, in increasing order like the previous kernel
+  at::Tensor keep_t = at::empty({static_cast<int64_t>(keep.size())}, dets.options().dtype(at::kLong));
+  auto keep_out = keep_t.data<int64_t>();
+  for (size_t k = 0; k < keep.size(); k++) {
+    keep_out[k] = order[keep[k]];
+  }
+  return std::get<0>(keep_t.sort(0, false));
+}
+
+
+// the previous scalar kernel, kept as the reference of tests and benchmarks
+template <typename scalar_t>
+at::Tensor nms_cpu_scalar_kernel(const at::Tensor& dets,
+                                 const at::Tensor& scores,
+                                 const float threshold) {
   AT_ASSERTM(!dets.type().is_cuda(), "dets must be a CPU tensor");
   AT_ASSERTM(!scores.type().is_cuda(), "scores must be a CPU tensor");
   AT_ASSERTM(dets.type() == scores.type(), "dets should have the same type as scores");
@@ -66,10 +197,21 @@ at::Tensor nms_cpu_kernel(const at::Tensor& dets,
 
 at::Tensor nms_cpu(const at::Tensor& dets,
                const at::Tensor& scores,
-               const float threshold) {
+               const float threshold,
+               const int64_t max_keep) {
   at::Tensor result;
   AT_DISPATCH_FLOATING_TYPES(dets.type(), "nms", [&] {
-    result = nms_cpu_kernel<scalar_t>(dets, scores, threshold);
+    result = nms_cpu_kernel<scalar_t>(dets, scores, threshold, max_keep);
+  });
+  return result;
+}
+
+at::Tensor nms_cpu_scalar(const at::Tensor& dets,
+                          const at::Tensor& scores,
+                          const float threshold) {
+  at::Tensor result;
+  AT_DISPATCH_FLOATING_TYPES(dets.type(), "nms_scalar", [&] {
+    result = nms_cpu_scalar_kernel<scalar_t>(dets, scores, threshold);
   });
   return result;
 }
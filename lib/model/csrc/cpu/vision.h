@@ -11,6 +11,20 @@ at::Tensor ROIAlign_forward_cpu(const at::Tensor& input,
                                 const int sampling_ratio);
 
 
+at::Tensor ROIAlign_forward_cpu_reference(const at::Tensor& input,
+                                          const at::Tensor& rois,
+                                          const float spatial_scale,
+                                          const int pooled_height,
+                                          const int pooled_width,
+                                          const int sampling_ratio);
+
+
 at::Tensor nms_cpu(const at::Tensor& dets,
                    const at::Tensor& scores,
-                   const float threshold);
+                   const float threshold,
+                   const int64_t max_keep);
+
+
+at::Tensor nms_cpu_scalar(const at::Tensor& dets,
+                          const at::Tensor& scores,
+                          const float threshold);
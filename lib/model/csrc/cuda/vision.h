@@ -40,7 +40,7 @@ at::Tensor ROIPool_backward_cuda(const at::Tensor& grad,
                                  const int height,
                                  const int width);
 
-at::Tensor nms_cuda(const at::Tensor boxes, float nms_overlap_thresh);
+at::Tensor nms_cuda(const at::Tensor boxes, float nms_overlap_thresh, int64_t max_keep);
 
 
 at::Tensor compute_flow_cuda(const at::Tensor& boxes,
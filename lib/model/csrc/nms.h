@@ -7,9 +7,12 @@
 #endif
 
 
+// indices of the kept boxes in increasing order,
+// when max_keep > 0 only the max_keep highest scoring kept boxes are returned
 at::Tensor nms(const at::Tensor& dets,
                const at::Tensor& scores,
-               const float threshold) {
+               const float threshold,
+               const int64_t max_keep) {
 
   if (dets.type().is_cuda()) {
 #ifdef WITH_CUDA
@@ -17,12 +20,12 @@ at::Tensor nms(const at::Tensor& dets,
     if (dets.numel() == 0)
       return at::empty({0}, dets.options().dtype(at::kLong).device(at::kCPU));
     auto b = at::cat({dets, scores.unsqueeze(1)}, 1);
-    return nms_cuda(b, threshold);
+    return nms_cuda(b, threshold, max_keep);
 #else
     AT_ERROR("Not compiled with GPU support");
 #endif
   }
 
-  at::Tensor result = nms_cpu(dets, scores, threshold);
+  at::Tensor result = nms_cpu(dets, scores, threshold, max_keep);
   return result;
 }
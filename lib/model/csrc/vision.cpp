@@ -5,8 +5,11 @@
 
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
-  m.def("nms", &nms, "non-maximum suppression");
+  m.def("nms", &nms, "non-maximum suppression",
+        py::arg("dets"), py::arg("scores"), py::arg("threshold"), py::arg("max_keep") = -1);
+  m.def("nms_cpu_scalar", &nms_cpu_scalar, "reference scalar CPU non-maximum suppression");
   m.def("roi_align_forward", &ROIAlign_forward, "ROIAlign_forward");
+  m.def("roi_align_forward_cpu_reference", &ROIAlign_forward_cpu_reference, "reference serial CPU ROIAlign_forward");
   m.def("roi_align_backward", &ROIAlign_backward, "ROIAlign_backward");
   m.def("roi_pool_forward", &ROIPool_forward, "ROIPool_forward");
   m.def("roi_pool_backward", &ROIPool_backward, "ROIPool_backward");
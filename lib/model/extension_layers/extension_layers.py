@@ -17,8 +17,8 @@ class extension_layer(nn.Module):
     def forward(self, input, input_padded, roi_labels, box_info):
         """
         compute both predictions and loss for 3 branches (contact_state, link, hand_side)
-        :param input: pooled_feat, 2D tensor (128*batch_size, 2048)
-        :param input_padded: padded_pooled_feat, 2D tensor (128*batch_size, 2048)
+        :param input: pooled_feat, 2D tensor (128*batch_size, 2048), or 3D tensor (batch, 300, 2048) at test time
+        :param input_padded: padded_pooled_feat, 2D tensor (128*batch_size, 2048), or 3D tensor (batch, 300, 2048) at test time
         :param roi_labels: object class labels, 2D tensor (batch, 128)
         :param box_info: contact gt labels, 3D tensor (batch, num_boxes, 5), each row is [contactstate, handside, magnitude, unitdx, unitdy]
         :return:
@@ -30,7 +30,7 @@ class extension_layer(nn.Module):
             num_proposals = cfg.TRAIN.BATCH_SIZE
             input = input.view(batch_size, num_proposals, -1)    # ==> (batch, 128, 2048)
             input_padded = input_padded.view(batch_size, num_proposals, -1)    # ==> (batch, 128, 2048)
-        else:
+        elif input.dim() == 2:
             input = input.unsqueeze(0)
             input_padded = input_padded.unsqueeze(0)
 
@@ -106,6 +106,8 @@ class extension_layer(nn.Module):
             dxdymagnitude_loss: 1D tensor
         """
         dxdymagnitude_pred = self.hand_dydx_layer(input)    # (batch, 128, 3), each row is [magnitude, dx, dy]
+        # fp32 under autocast (mixed-precision training), dx.^2+dy.^2 of small vectors underflows in fp16
+        dxdymagnitude_pred = dxdymagnitude_pred.float()
         dxdymagnitude_pred_sub = 0.1 * F.normalize(dxdymagnitude_pred[:, :, 1:], p=2, dim=2)    # dx = dx / sqrt(dx.^2+dy.^2)
         dxdymagnitude_pred_norm = torch.cat([dxdymagnitude_pred[:, :, 0].unsqueeze(-1), dxdymagnitude_pred_sub], dim=2)    # (batch, 128, 3)
         dxdymagnitude_loss = torch.zeros(1, dtype=torch.float).to(self.device)
@@ -47,7 +47,7 @@ class _fasterRCNN(nn.Module):
         self.relation_module = relation_module.RelationModule()
 
 
-    def forward(self, im_data, im_info, gt_boxes, num_boxes, box_info):
+    def forward(self, im_data, im_info, gt_boxes, num_boxes, box_info, base_feat=None):
         """
         get call when fasterRCNN(im_data, im_info, gt_boxes, num_boxes), after fasterRCNN.create_architecture
         @param im_data: 4D tensor, (batch, 3, h, w)
@@ -55,6 +55,8 @@ class _fasterRCNN(nn.Module):
         @param gt_boxes: 3D tensor (batch, num_boxes, 5), each row is [cls, x1, y1, x2, y2]
         @param num_boxes: 1D tensor [num_boxes]
         @param box_info: 3D tensor (batch, num_boxes, 5), each row is [contactstate, handside, magnitude, unitdx, unitdy]
+        @param base_feat: optional 4D tensor (batch, dout_base_model, h/16, w/16), backbone feature maps of im_data
+                          which are already computed (e.g. by a video feature cache), RCNN_base is skipped if given
         @return:
             rois: roi proposals, 3D tensor (batch, 128, 5), each row: [batch_ind, x1, y1, x2, y2]
             cls_prob: class prediction, 3D tensor (batch, 128, num_total_classes), each row is processed by softmax: [0.1, 0.1, 0.8]
@@ -73,7 +75,8 @@ class _fasterRCNN(nn.Module):
         box_info = box_info.data
 
         # 1. img --> backbone (resnet) --> feature maps
-        base_feat = self.RCNN_base(im_data)    # RCNN_base() is defined in the child class (resnet)
+        if base_feat is None:
+            base_feat = self.RCNN_base(im_data)    # RCNN_base() is defined in the child class (resnet)
 
         # 2. feature map --> RPN --> roi bboxes (also compute the loss of RPN proposals)
         # rois: 3D tensor (batch, 2000, 5), each row is a bbox [batch_ind, x1, y1, x2, y2]
@@ -148,6 +151,8 @@ class _fasterRCNN(nn.Module):
             RCNN_loss_bbox = _smooth_l1_loss(bbox_pred, rois_target, rois_inside_ws, rois_outside_ws)    # bbox regression L1 loss
             loss_list = self.extension_layer(relation_pooled_feat, relation_pooled_feat, rois_label_retain, box_info)
         else:
+            # keep the proposals of each image apart, (300*batch, 2048) ==> (batch, 300, 2048)
+            relation_pooled_feat = relation_pooled_feat.view(batch_size, rois.size(1), -1)
             loss_list = self.extension_layer(relation_pooled_feat, relation_pooled_feat, None, box_info)
 
         cls_prob = cls_prob.view(batch_size, rois.size(1), -1)
@@ -0,0 +1,17 @@
+from .hand_object_detector import HandObjectDetector
+from .hand_object_detector import Detections
+from .hand_object_detector import build_network
+from .video import VideoPipeline
+from .video import StageStats
+from .video import render_detections
+from .temporal import TemporalDetector
+from .temporal import TemporalStats
+from .feature_cache import FeatureCache
+from .feature_cache import FeatureCacheStats
+from .fused_backbone import fuse_backbone
+from .fused_backbone import load_fused_checkpoint
+from .quantization import quantize_network
+
+__all__ = ["HandObjectDetector", "Detections", "build_network", "VideoPipeline", "StageStats", "render_detections",
+           "TemporalDetector", "TemporalStats", "FeatureCache", "FeatureCacheStats", "fuse_backbone",
+           "load_fused_checkpoint", "quantize_network"]
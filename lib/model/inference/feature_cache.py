@@ -0,0 +1,168 @@
+import torch
+import torch.nn.functional as F
+
+from model.utils.config import cfg
+
+
+class FeatureCacheStats(object):
+    """
+    how much of the backbone was recomputed, and how far the merged features are from a full recompute
+    """
+
+    def __init__(self):
+        self.num_frames = 0
+        self.num_full = 0    # frames with a full recompute (first frame, new size, too many changes, failed check)
+        self.num_tiles = 0    # tiles seen in the frames using the cache
+        self.num_recomputed_tiles = 0
+        self.num_checks = 0
+        self.num_failed_checks = 0
+        self.max_error = 0.    # largest relative error seen by the checks
+
+
+    @property
+    def recompute_ratio(self):
+        return self.num_recomputed_tiles / float(self.num_tiles) if self.num_tiles > 0 else 0.
+
+
+    def __str__(self):
+        return ('frames: {:d}, full recomputes: {:d}, recomputed tiles: {:.3f}, '
+                'checks: {:d} ({:d} failed), max relative error: {:.2e}').format(
+            self.num_frames, self.num_full, self.recompute_ratio, self.num_checks, self.num_failed_checks,
+            self.max_error)
+
+
+class FeatureCache(object):
+    """
+    Backbone feature cache for static-camera video, used by HandObjectDetector.predict().
+    The preprocessed frame is split into tiles of tile x tile feature cells; the tiles whose mean absolute
+    difference to the cached frame is above diff_thresh are recomputed on a crop of the frame with margin
+    feature cells of context on each side, the other tiles of base_feat are reused.
+    The crops start on the feature stride so that their features are aligned with the full feature map; they
+    only differ from a full recompute by the part of the receptive field beyond the margin, which is measured
+    every check_interval frames.
+    """
+
+    def __init__(self, fasterRCNN, tile=8, margin=4, diff_thresh=1., max_changed_ratio=0.5, check_interval=0,
+                 max_error=0.05):
+        """
+        :param fasterRCNN: the detection network, its RCNN_base computes the features
+        :param tile: size of the tiles in feature cells
+        :param margin: context added around each recomputed tile, in feature cells
+        :param diff_thresh: recompute a tile when its mean absolute pixel difference is above it
+        :param max_changed_ratio: recompute the whole frame when more tiles changed
+        :param check_interval: compare the merged features with a full recompute every check_interval frames,
+                               0 to disable
+        :param max_error: when a check finds a larger relative error, the full features are used and cached
+        """
+        self.fasterRCNN = fasterRCNN
+        self.feat_stride = cfg.FEAT_STRIDE[0]
+        self.tile = tile
+        self.margin = margin
+        self.diff_thresh = diff_thresh
+        self.max_changed_ratio = max_changed_ratio
+        self.check_interval = check_interval
+        self.max_error = max_error
+        self.reset()
+
+
+    def reset(self):
+        """ drop the cached frame, e.g. at the beginning of a new video """
+        self.stats = FeatureCacheStats()
+        self.ref_data = None    # the frame the cached features belong to, updated tile by tile
+        self.base_feat = None
+
+
+    def __call__(self, im_data):
+        """
+        :param im_data: 4D tensor, (batch, 3, h, w)
+        :return: base_feat, 4D tensor (batch, dout_base_model, h/16, w/16)
+        """
+        self.stats.num_frames += 1
+
+        # only a single stream of same-sized frames can be cached
+        if im_data.size(0) != 1 or self.ref_data is None or self.ref_data.size() != im_data.size():
+            return self.full(im_data)
+
+        tile_px = self.tile * self.feat_stride
+        diff = (im_data - self.ref_data).abs().mean(1, keepdim=True)
+        changed = F.avg_pool2d(diff, tile_px, ceil_mode=True)[0, 0] > self.diff_thresh    # (tiles_h, tiles_w)
+        if changed.float().mean().item() > self.max_changed_ratio:
+            return self.full(im_data)
+
+        self.stats.num_tiles += changed.numel()
+        tiles = changed.nonzero().tolist()
+        if len(tiles) > 0:
+            self.stats.num_recomputed_tiles += len(tiles)
+            self.update(im_data, tiles)
+
+        if self.check_interval > 0 and self.stats.num_frames % self.check_interval == 0:
+            self.check(im_data)
+
+        return self.base_feat
+
+
+    def full(self, im_data):
+        """ recompute the whole feature map """
+        self.stats.num_full += 1
+        base_feat = self.fasterRCNN.RCNN_base(im_data)
+        if im_data.size(0) == 1:
+            self.ref_data = im_data.clone()
+            self.base_feat = base_feat
+        else:
+            self.ref_data, self.base_feat = None, None
+        return base_feat
+
+
+    def update(self, im_data, tiles):
+        """
+        recompute the given tiles of the cached features, crops of the same size go through the backbone together
+        :param im_data: 4D tensor, (1, 3, h, w)
+        :param tiles: list of [tile_y, tile_x]
+        """
+        height, width = im_data.size(2), im_data.size(3)
+        stride = self.feat_stride
+        crop_px = (self.tile + 2 * self.margin) * stride
+
+        def crop_range(t, size):
+            # feature-aligned pixel range of the crop, pushed back inside the frame at the borders
+            start = max((t * self.tile - self.margin) * stride, 0)
+            end = min(start + crop_px, size)
+            start = max(end - crop_px, 0) // stride * stride
+            return start, end
+
+        crops = {}
+        for ty, tx in tiles:
+            y1, y2 = crop_range(ty, height)
+            x1, x2 = crop_range(tx, width)
+            crops.setdefault((y2 - y1, x2 - x1), []).append((ty, tx, y1, x1))
+
+        feat_h, feat_w = self.base_feat.size(2), self.base_feat.size(3)
+        for (crop_h, crop_w), group in crops.items():
+            batch = torch.cat([im_data[:, :, y1:y1 + crop_h, x1:x1 + crop_w] for _, _, y1, x1 in group], 0)
+            crop_feat = self.fasterRCNN.RCNN_base(batch)
+            for i, (ty, tx, y1, x1) in enumerate(group):
+                fy1, fx1 = ty * self.tile, tx * self.tile
+                fy2, fx2 = min(fy1 + self.tile, feat_h), min(fx1 + self.tile, feat_w)
+                cy, cx = fy1 - y1 // stride, fx1 - x1 // stride
+                self.base_feat[0, :, fy1:fy2, fx1:fx2] = crop_feat[i, :, cy:cy + fy2 - fy1, cx:cx + fx2 - fx1]
+
+                py1, px1 = ty * self.tile * stride, tx * self.tile * stride
+                self.ref_data[:, :, py1:py1 + self.tile * stride, px1:px1 + self.tile * stride] = \
+                    im_data[:, :, py1:py1 + self.tile * stride, px1:px1 + self.tile * stride]
+
+
+    def check(self, im_data):
+        """
+        compare the merged features with a full recompute, keep the full ones if the error is too large
+        :param im_data: 4D tensor, (1, 3, h, w)
+        :return: relative error, max |merged - full| / max |full|
+        """
+        base_feat = self.fasterRCNN.RCNN_base(im_data)
+        error = ((self.base_feat - base_feat).abs().max() / base_feat.abs().max().clamp(min=1e-12)).item()
+        self.stats.num_checks += 1
+        self.stats.max_error = max(self.stats.max_error, error)
+        if error > self.max_error:
+            self.stats.num_failed_checks += 1
+            self.ref_data = im_data.clone()
+            self.base_feat = base_feat
+        return error
@@ -0,0 +1,151 @@
+import copy
+import os
+import torch
+import torch.nn as nn
+
+from model.utils.config import cfg
+
+
+def fuse_conv_bn(conv, bn):
+    """
+    fold a BatchNorm2d with frozen statistics into the Conv2d before it
+    :param conv: nn.Conv2d
+    :param bn: nn.BatchNorm2d which follows conv
+    :return: nn.Conv2d with a bias, it gives the output of bn(conv(x))
+    """
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, conv.padding,
+                      conv.dilation, conv.groups, bias=True).to(conv.weight.device)
+
+    # y = (conv(x) + b - mean) * gamma / sqrt(var + eps) + beta, computed in double then rounded once
+    with torch.no_grad():
+        scale = (bn.weight.double() if bn.affine else 1.) / torch.sqrt(bn.running_var.double() + bn.eps)
+        bias = conv.bias.double() if conv.bias is not None else torch.zeros_like(scale)
+        beta = bn.bias.double() if bn.affine else 0.
+        fused.weight.copy_(conv.weight.double() * scale.view(-1, 1, 1, 1))
+        fused.bias.copy_((bias - bn.running_mean.double()) * scale + beta)
+    fused.weight.requires_grad = False
+    fused.bias.requires_grad = False
+    return fused
+
+
+def fold_batchnorm(module):
+    """
+    replace, recursively, each BatchNorm2d which follows a Conv2d by nn.Identity and fold it into the conv
+    the pairs are the consecutive layers of nn.Sequential (e.g. RCNN_base, downsample) and the convN / bnN layers
+    of the residual blocks
+    :param module: nn.Module in eval mode
+    :return: number of folded BatchNorm2d
+    """
+    num_folded = 0
+    for child in module.children():
+        num_folded += fold_batchnorm(child)
+
+    names = list(module._modules.keys())
+    if isinstance(module, nn.Sequential):
+        pairs = zip(names[:-1], names[1:])
+    else:
+        pairs = [('conv' + name[2:], name) for name in names if name.startswith('bn')]
+
+    for conv_name, bn_name in pairs:
+        conv, bn = module._modules.get(conv_name), module._modules[bn_name]
+        if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+            setattr(module, conv_name, fuse_conv_bn(conv, bn))
+            setattr(module, bn_name, nn.Identity())
+            num_folded += 1
+    return num_folded
+
+
+def backbone_parity(reference, fasterRCNN, im_size=(256, 320)):
+    """
+    largest relative difference between the backbone outputs of two networks, on a random image
+    :param reference: the unfused network, only its RCNN_base and RCNN_top are used
+    :param fasterRCNN: the fused network
+    :param im_size: (h, w) of the random image
+    :return: max |fused - reference| / max |reference|, the worst of RCNN_base and RCNN_top
+    """
+    device = next(fasterRCNN.parameters()).device
+    im_data = torch.randn(1, 3, im_size[0], im_size[1], device=device) * 50.    # about the range of a blob
+    error = 0.
+    with torch.no_grad():
+        base_ref = reference.RCNN_base(im_data)
+        base_feat = fasterRCNN.RCNN_base(im_data)
+        # the pooled features of a RoI are a crop of the feature map
+        pooled = base_ref[:, :, :cfg.POOLING_SIZE, :cfg.POOLING_SIZE].contiguous()
+        for ref, out in [(base_ref, base_feat), (reference.RCNN_top(pooled), fasterRCNN.RCNN_top(pooled))]:
+            error = max(error, ((out - ref).abs().max() / ref.abs().max().clamp(min=1e-12)).item())
+    return error
+
+
+def fuse_backbone(fasterRCNN, channels_last=True, check=True, max_error=1e-4):
+    """
+    inference pass over the backbone (RCNN_base) and the head (RCNN_top): the frozen BatchNorm2d are folded into
+    the convs before them, then the convs are converted to the channels last memory format
+    :param fasterRCNN: the detection network in eval mode
+    :param channels_last: whether convert RCNN_base and RCNN_top to channels last
+    :param check: whether compare the outputs with the unfused network, raises ValueError when they differ
+    :param max_error: largest relative difference allowed by the check
+    :return: the relative difference measured by the check, 0 without check
+    """
+    if fasterRCNN.training:
+        raise ValueError('the BatchNorm2d can only be folded in eval mode')
+    reference = copy.deepcopy(fasterRCNN) if check else None
+
+    num_folded = fold_batchnorm(fasterRCNN.RCNN_base) + fold_batchnorm(fasterRCNN.RCNN_top)
+    if channels_last:
+        fasterRCNN.RCNN_base.to(memory_format=torch.channels_last)
+        fasterRCNN.RCNN_top.to(memory_format=torch.channels_last)
+
+    error = 0.
+    if check:
+        error = backbone_parity(reference, fasterRCNN)
+        if error > max_error:
+            raise ValueError('the fused backbone differs from the checkpoint: relative error {:.2e} > {:.2e}'
+                             .format(error, max_error))
+    print('fused backbone: {:d} BatchNorm2d folded, channels_last: {}, relative error: {:.2e}'.format(
+        num_folded, channels_last, error))
+    return error
+
+
+def fused_cache_path(load_name):
+    """ models/.../faster_rcnn_1_8_89999.pth ==> models/.../faster_rcnn_1_8_89999_fused.pth """
+    return os.path.splitext(load_name)[0] + '_fused.pth'
+
+
+def load_fused_checkpoint(fasterRCNN, load_name, channels_last=True, cache=True):
+    """
+    load a checkpoint into fasterRCNN (on the CPU, in eval mode) with a fused backbone, see fuse_backbone()
+    the fused weights are cached next to the checkpoint, and rebuilt (with a parity check) when the checkpoint changes
+    :param fasterRCNN: the detection network, built by build_network()
+    :param load_name: path of the checkpoint
+    :param channels_last: whether convert RCNN_base and RCNN_top to channels last
+    :param cache: whether read and write the cached fused weights
+    :return: the checkpoint dict, its 'model' is the fused state dict
+    """
+    fasterRCNN.eval()
+    cache_name = fused_cache_path(load_name)
+    stat = os.stat(load_name)
+    source = (os.path.basename(load_name), stat.st_size, stat.st_mtime)
+
+    if cache and os.path.exists(cache_name):
+        checkpoint = torch.load(cache_name, map_location=(lambda storage, loc: storage))
+        if tuple(checkpoint.get('source', ())) == source:
+            print("load fused checkpoint %s" % (cache_name))
+            fold_batchnorm(fasterRCNN.RCNN_base)    # the layout of the cached weights
+            fold_batchnorm(fasterRCNN.RCNN_top)
+            fasterRCNN.load_state_dict(checkpoint['model'])
+            if channels_last:
+                fasterRCNN.RCNN_base.to(memory_format=torch.channels_last)
+                fasterRCNN.RCNN_top.to(memory_format=torch.channels_last)
+            return checkpoint
+        print('fused checkpoint {} is out of date, rebuilding it'.format(cache_name))
+
+    print("load checkpoint %s" % (load_name))
+    checkpoint = torch.load(load_name, map_location=(lambda storage, loc: storage))
+    fasterRCNN.load_state_dict(checkpoint['model'])
+    fuse_backbone(fasterRCNN, channels_last)
+
+    checkpoint = {'model': fasterRCNN.state_dict(), 'source': source,
+                  'pooling_mode': checkpoint.get('pooling_mode', cfg.POOLING_MODE)}
+    if cache:
+        torch.save(checkpoint, cache_name)
+    return checkpoint
@@ -0,0 +1,327 @@
+import collections
+import numpy as np
+import cv2
+import torch
+
+from model.utils.config import cfg
+from model.rpn.bbox_transform import clip_boxes
+from model.rpn.bbox_transform import bbox_transform_inv
+from model.rpn.anchor_generator import get_anchor_generator
+from model.roi_layers import batched_nms, select_backend
+from model.utils.blob import im_list_to_blob
+from model.faster_rcnn.vgg16 import vgg16
+from model.faster_rcnn.resnet import resnet
+from model.inference.fused_backbone import load_fused_checkpoint
+from model.inference.quantization import quantize_network
+
+
+# detections of one image, each one is a 2D array (num_dets, 10) or None if nothing is detected
+# each row is [x1, y1, x2, y2, score, contact_state, magnitude, dx, dy, handside]
+Detections = collections.namedtuple('Detections', ['obj_dets', 'hand_dets'])
+
+
+def build_network(net, classes, class_agnostic=False):
+    """
+    initialise the faster rcnn (without pre-trained weights) for a given backbone
+    :param net: 'vgg16', 'res50', 'res101' or 'res152'
+    :param classes: 1D array of class names, e.g. ['__background__', 'targetobject', 'hand']
+    :param class_agnostic: whether perform class_agnostic bbox regression
+    :return: fasterRCNN, nn.Module
+    """
+    if net == 'vgg16':
+        fasterRCNN = vgg16(classes, pretrained=False, class_agnostic=class_agnostic)
+    elif net == 'res101':
+        fasterRCNN = resnet(classes, 101, pretrained=False, class_agnostic=class_agnostic)
+    elif net == 'res50':
+        fasterRCNN = resnet(classes, 50, pretrained=False, class_agnostic=class_agnostic)
+    elif net == 'res152':
+        fasterRCNN = resnet(classes, 152, pretrained=False, class_agnostic=class_agnostic)
+    else:
+        raise Exception("network is not defined")
+
+    fasterRCNN.create_architecture()
+    return fasterRCNN
+
+
+class HandObjectDetector(object):
+    """
+    Hand-object detection engine for demos, videos and evaluation.
+    The checkpoint is loaded once and the input tensors are allocated once, then
+    detect() runs a whole batch of images through a single forward pass.
+    """
+
+    def __init__(self, load_name, net='res101', classes=None, class_agnostic=False, cuda=None,
+                 thresh_hand=0.5, thresh_obj=0.5, fuse=False, quantize=None, nms_backend=None):
+        """
+        :param load_name: path of the checkpoint, e.g. models/res101_handobj_100K/pascal_voc/faster_rcnn_1_8_89999.pth
+        :param net: 'vgg16', 'res50', 'res101' or 'res152'
+        :param classes: 1D array of class names, default is ['__background__', 'targetobject', 'hand']
+        :param class_agnostic: whether perform class_agnostic bbox regression
+        :param cuda: whether use CUDA, default is to use it when available
+        :param thresh_hand: score threshold of hand detections
+        :param thresh_obj: score threshold of object detections
+        :param fuse: whether fold the BatchNorm of the backbone and use channels last, see fused_backbone.py
+        :param quantize: None, or a CPU quantisation mode 'dynamic', 'fp16' or 'static', see quantization.py
+        :param nms_backend: 'cuda', 'cpu' or 'torch', the backend of the detection NMS,
+                            default is the fastest one for the device, see roi_layers/nms.py
+        """
+        if quantize == 'static' and fuse:
+            raise ValueError('the static quantisation folds the BatchNorm itself, it cannot be used with fuse')
+        if classes is None:
+            classes = np.asarray(['__background__', 'targetobject', 'hand'])
+        if cuda is None:
+            cuda = torch.cuda.is_available()
+        self.classes = classes
+        self.class_agnostic = class_agnostic
+        self.thresh_hand = thresh_hand
+        self.thresh_obj = thresh_obj
+        self.device = torch.device("cuda") if cuda else torch.device("cpu")
+        if nms_backend is None:
+            nms_backend = select_backend(torch.zeros(0, 4, device=self.device))
+        self.nms_backend = nms_backend
+
+        # load model
+        self.fasterRCNN = build_network(net, classes, class_agnostic)
+        if fuse:
+            checkpoint = load_fused_checkpoint(self.fasterRCNN, load_name)
+        else:
+            print("load checkpoint %s" % (load_name))
+            checkpoint = torch.load(load_name, map_location=(lambda storage, loc: storage))
+            self.fasterRCNN.load_state_dict(checkpoint['model'])
+        if 'pooling_mode' in checkpoint.keys():
+            cfg.POOLING_MODE = checkpoint['pooling_mode']
+        print('load model successfully!')
+
+        if quantize is not None:
+            if cuda:
+                raise ValueError('the quantised network only runs on the CPU, use cuda=False')
+            self.fasterRCNN.eval()
+            quantize_network(self.fasterRCNN, quantize, load_name)
+
+        self.fasterRCNN.to(self.device)
+        self.fasterRCNN.eval()
+
+        # initialize the tensor holder here, they are resized (not re-allocated) for each batch
+        self.im_data = torch.FloatTensor(1).to(self.device)
+        self.im_info = torch.FloatTensor(1).to(self.device)
+        self.num_boxes = torch.LongTensor(1).to(self.device)
+        self.gt_boxes = torch.FloatTensor(1).to(self.device)
+        self.box_info = torch.FloatTensor(1).to(self.device)
+        self.bbox_stds = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).to(self.device)
+        self.bbox_means = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).to(self.device)
+
+        # optional FeatureCache, reuses the backbone features of unchanged regions between video frames
+        self.feature_cache = None
+
+
+    def get_image_blob(self, ims):
+        """
+        Given BGR images, subtract the pixel means and resize each of them to (600, x) where x<=1000
+        :param ims: list of BGR images (nd array)
+        :return: blob, 4D array, (num_images, h_max, w_max, 3)
+                 im_info, 2D array (num_images, 3), each row is [height, width, scale_factor]
+        """
+        assert len(cfg.TEST.SCALES) == 1, "Only single-scale test implemented"
+        target_size = cfg.TEST.SCALES[0]
+
+        processed_ims = []
+        im_info = []
+        for im in ims:
+            im_orig = im.astype(np.float32, copy=True)
+            im_orig -= cfg.PIXEL_MEANS
+
+            im_size_min = np.min(im_orig.shape[0:2])
+            im_size_max = np.max(im_orig.shape[0:2])
+            im_scale = float(target_size) / float(im_size_min)
+            # Prevent the biggest axis from being more than MAX_SIZE
+            if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:
+                im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
+            im_resized = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale, interpolation=cv2.INTER_LINEAR)
+            processed_ims.append(im_resized)
+            im_info.append([im_resized.shape[0], im_resized.shape[1], im_scale])
+
+        # Create a blob (canvas) to hold the input images
+        blob = im_list_to_blob(processed_ims)
+
+        return blob, np.array(im_info, dtype=np.float32)
+
+
+    def detect(self, images):
+        """
+        detect hands and objects in a batch of images
+        :param images: list of BGR images (nd array), or a single BGR image
+        :return: list of Detections, one for each image
+        """
+        if isinstance(images, np.ndarray) and images.ndim == 3:
+            images = [images]
+        im_blob, im_info_np = self.get_image_blob(images)
+        im_data_pt = torch.from_numpy(im_blob).permute(0, 3, 1, 2)    # (batch, h, w, 3) ==> (batch, 3, h, w)
+        im_info_pt = torch.from_numpy(im_info_np)
+
+        return self.detect_blob(im_data_pt, im_info_pt)
+
+
+    def detect_blob(self, im_data_pt, im_info_pt):
+        """
+        detect hands and objects in a batch of images which are already preprocessed
+        :param im_data_pt: 4D tensor, (batch, 3, h, w)
+        :param im_info_pt: 2D tensor, (batch, 3), each row is [height, width, scale_factor]
+        :return: list of Detections, one for each image, boxes are in the original image coordinates
+        """
+        scores, pred_boxes, contact_indices, offset_vector, lr = self.predict(im_data_pt, im_info_pt)
+
+        return [self.postprocess(scores[b], pred_boxes[b], contact_indices[b], offset_vector[b], lr[b])
+                for b in range(scores.size(0))]
+
+
+    def predict(self, im_data_pt, im_info_pt):
+        """
+        run the network and decode the raw predictions of all proposals
+        :param im_data_pt: 4D tensor, (batch, 3, h, w)
+        :param im_info_pt: 2D tensor, (batch, 3), each row is [height, width, scale_factor]
+        :return:
+            scores: 3D tensor (batch, 300, num_classes)
+            pred_boxes: 3D tensor (batch, 300, 4*num_classes) or (batch, 300, 4) if class_agnostic, original image coordinates
+            contact_indices: 3D tensor (batch, 300, 1)
+            offset_vector: 3D tensor (batch, 300, 3), each row is [magnitude, dx, dy]
+            lr: 3D tensor (batch, 300, 1)
+        """
+        batch_size = im_data_pt.size(0)
+        with torch.no_grad():
+            self.im_data.resize_(im_data_pt.size()).copy_(im_data_pt)
+            self.im_info.resize_(im_info_pt.size()).copy_(im_info_pt)
+            self.gt_boxes.resize_(batch_size, 1, 5).zero_()
+            self.num_boxes.resize_(batch_size).zero_()
+            self.box_info.resize_(batch_size, 1, 5).zero_()
+            base_feat = self.feature_cache(self.im_data) if self.feature_cache is not None else None
+
+            rois, cls_prob, bbox_pred, \
+            rpn_loss_cls, rpn_loss_box, \
+            RCNN_loss_cls, RCNN_loss_bbox, \
+            rois_label, loss_list = self.fasterRCNN(self.im_data, self.im_info, self.gt_boxes, self.num_boxes,
+                                                    self.box_info, base_feat)
+
+            scores = cls_prob.data
+            boxes = rois.data[:, :, 1:5]
+
+            # extract predicted params
+            contact_vector = loss_list[0][0]    # hand contact state info
+            offset_vector = loss_list[1][0].detach()    # offset vector (factored into a unit vector and a magnitude)
+            lr_vector = loss_list[2][0].detach()    # hand side info (left/right)
+
+            # get hand contact
+            _, contact_indices = torch.max(contact_vector, 2)
+            contact_indices = contact_indices.unsqueeze(-1).float()
+
+            # get hand side
+            lr = (torch.sigmoid(lr_vector) > 0.5).float()
+
+            # Apply bounding-box regression deltas
+            if cfg.TEST.BBOX_REG:
+                box_deltas = bbox_pred.data
+                if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
+                    # Optionally normalize targets by a precomputed mean and stdev
+                    box_deltas = box_deltas.view(-1, 4) * self.bbox_stds + self.bbox_means
+                    if self.class_agnostic:
+                        box_deltas = box_deltas.view(batch_size, -1, 4)
+                    else:
+                        box_deltas = box_deltas.view(batch_size, -1, 4 * len(self.classes))
+
+                pred_boxes = bbox_transform_inv(boxes, box_deltas, batch_size)
+                pred_boxes = clip_boxes(pred_boxes, self.im_info.data, batch_size)
+
+            # Simply repeat the boxes, once for each class
+            else:
+                pred_boxes = boxes.repeat(1, 1, 1 if self.class_agnostic else scores.size(2))
+
+            pred_boxes /= self.im_info.data[:, 2].view(batch_size, 1, 1)
+
+        return scores, pred_boxes, contact_indices, offset_vector, lr
+
+
+    def postprocess(self, scores, pred_boxes, contact_indices, offset_vector, lr):
+        """
+        remove low score bboxes, do NMS for every class at once, match the cls name
+        :param scores: 2D tensor (300, num_classes)
+        :param pred_boxes: 2D tensor (300, 4*num_classes) or (300, 4) if class_agnostic
+        :param contact_indices: 2D tensor (300, 1)
+        :param offset_vector: 2D tensor (300, 3)
+        :param lr: 2D tensor (300, 1)
+        :return: Detections of the image, the detections of each class from the highest score to the lowest
+        """
+        num_rois, num_classes = scores.size()
+
+        # score threshold of each class, the background is never kept
+        thresh = [float('inf')] + [self.thresh_hand if self.classes[j] == 'hand' else self.thresh_obj
+                                   for j in range(1, num_classes)]
+        mask = scores > scores.new_tensor(thresh)    # (300, num_classes)
+        roi_inds, cls_inds = torch.nonzero(mask, as_tuple=True)    # every (proposal, class) pair above threshold
+        if roi_inds.numel() == 0:
+            return Detections(None, None)
+
+        cls_scores = scores[roi_inds, cls_inds]
+        if self.class_agnostic:
+            cls_boxes = pred_boxes[roi_inds]
+        else:
+            cls_boxes = pred_boxes.view(num_rois, num_classes, 4)[roi_inds, cls_inds]
+
+        # all detections, 2D tensor (num, 10)
+        dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1), contact_indices[roi_inds],
+                          offset_vector[roi_inds], lr[roi_inds]), 1)
+
+        # one NMS over all classes
+        keep = batched_nms(cls_boxes, cls_scores, cls_inds, cfg.TEST.NMS, backend=self.nms_backend)
+        # the kept indices are in proposal order, sort them by score, the visualisation draws the first 10
+        keep = keep[torch.argsort(cls_scores[keep], descending=True)]
+        dets = dets[keep].cpu().numpy()
+        dets_cls = cls_inds[keep].cpu().numpy()
+
+        obj_dets, hand_dets = None, None
+        for j in range(1, num_classes):
+            cls_dets = dets[dets_cls == j]
+            if cls_dets.shape[0] == 0:
+                continue
+            if self.classes[j] == 'targetobject':
+                obj_dets = cls_dets
+            if self.classes[j] == 'hand':
+                hand_dets = cls_dets
+
+        return Detections(obj_dets, hand_dets)
+
+
+    def image_boxes(self, detections, max_per_image=100):
+        """
+        the detections of one image in the layout of all_boxes, which test_net.py saves and imdb evaluates
+        :param detections: Detections of the image
+        :param max_per_image: keep the max_per_image highest scoring detections over all classes, 0 for no limit
+        :return: list of num_classes elements, [] for the background, then a 2D array (num_dets, 11) for each class,
+                 each row is the 10 columns of Detections and the no-contact prob
+        """
+        empty_array = np.transpose(np.array([[], [], [], [], []]), (1, 0))
+        boxes = [[]]
+        for j in range(1, len(self.classes)):
+            cls_dets = detections.hand_dets if self.classes[j] == 'hand' else detections.obj_dets
+            if cls_dets is not None:
+                # the last column is the no-contact prob, the softmax over a single logit is always 1
+                nc_prob = np.ones((cls_dets.shape[0], 1), dtype=cls_dets.dtype)
+                boxes.append(np.hstack((cls_dets, nc_prob)))
+            else:
+                boxes.append(empty_array)
+
+        # Limit to max_per_image detections *over all classes*
+        if max_per_image > 0:
+            image_scores = np.hstack([boxes[j][:, 4] for j in range(1, len(self.classes))])
+            if len(image_scores) > max_per_image:
+                image_thresh = np.sort(image_scores)[-max_per_image]
+                for j in range(1, len(self.classes)):
+                    keep = np.where(boxes[j][:, 4] >= image_thresh)[0]
+                    boxes[j] = boxes[j][keep, :]
+        return boxes
+
+
+    def anchor_cache_info(self):
+        """
+        :return: CacheInfo(hits, misses, maxsize, currsize) of the RPN anchors, cached per feature map size
+        """
+        rpn = self.fasterRCNN.RCNN_rpn
+        return get_anchor_generator(rpn.anchor_scales, rpn.anchor_ratios).cache_info()
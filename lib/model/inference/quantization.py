@@ -0,0 +1,119 @@
+import os
+import torch
+import torch.nn as nn
+
+from model.utils.config import cfg
+
+try:
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+except ImportError:
+    prepare_fx = None    # torch < 1.13, only the dynamic quantisation is available
+
+
+# quantisation modes of HandObjectDetector
+#   'dynamic': int8 weights for all nn.Linear (RCNN_cls_score, RCNN_bbox_pred, the relation module projections
+#              and the extension heads), the activations are quantised on the fly
+#   'fp16': the same nn.Linear with float16 weights (weight-only), float32 compute
+#   'static': 'dynamic' plus an int8 RCNN_base and RCNN_top calibrated by quantize_net.py
+QUANTIZE_MODES = ['dynamic', 'fp16', 'static']
+
+
+def _check_cpu(fasterRCNN):
+    if any(p.is_cuda for p in fasterRCNN.parameters()):
+        raise ValueError('the quantised kernels only run on the CPU')
+
+
+def quantize_dynamic(fasterRCNN, dtype=torch.qint8):
+    """
+    replace, in place, every nn.Linear by its dynamically quantised version
+    :param fasterRCNN: the detection network on the CPU, in eval mode
+    :param dtype: torch.qint8, or torch.float16 for weight-only quantisation
+    :return: number of quantised nn.Linear
+    """
+    _check_cpu(fasterRCNN)
+    num_linear = sum(isinstance(m, nn.Linear) for m in fasterRCNN.modules())
+    torch.quantization.quantize_dynamic(fasterRCNN, {nn.Linear}, dtype=dtype, inplace=True)
+    return num_linear
+
+
+def prepare_static(fasterRCNN):
+    """
+    replace RCNN_base and RCNN_top by traced copies with observers, which record the range of the activations
+    while the network runs on calibration images, then call convert_static()
+    :param fasterRCNN: the detection network on the CPU, in eval mode
+    """
+    if prepare_fx is None:
+        raise ImportError('the static quantisation needs torch >= 1.13 (torch.ao.quantization.quantize_fx)')
+    _check_cpu(fasterRCNN)
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    im_data = torch.zeros(1, 3, 224, 224)
+    pooled_feat = torch.zeros(1, fasterRCNN.dout_base_model, cfg.POOLING_SIZE, cfg.POOLING_SIZE)
+    fasterRCNN.RCNN_base = prepare_fx(fasterRCNN.RCNN_base, qconfig_mapping, (im_data,))
+    fasterRCNN.RCNN_top = prepare_fx(fasterRCNN.RCNN_top, qconfig_mapping, (pooled_feat,))
+
+
+def convert_static(fasterRCNN):
+    """ int8 RCNN_base and RCNN_top from the observed ones of prepare_static() """
+    fasterRCNN.RCNN_base = convert_fx(fasterRCNN.RCNN_base)
+    fasterRCNN.RCNN_top = convert_fx(fasterRCNN.RCNN_top)
+
+
+def calibration_path(load_name):
+    """ models/.../faster_rcnn_1_8_89999.pth ==> models/.../faster_rcnn_1_8_89999_int8_calib.pth """
+    return os.path.splitext(load_name)[0] + '_int8_calib.pth'
+
+
+def save_calibration(fasterRCNN, load_name, num_images):
+    """
+    save the activation ranges recorded by the observers of prepare_static()
+    :param fasterRCNN: the network after prepare_static() and the calibration
+    :param load_name: path of the checkpoint, the calibration is saved next to it
+    :param num_images: number of calibration images, for the record
+    """
+    observers = {}
+    for name in ['RCNN_base', 'RCNN_top']:
+        for key, value in getattr(fasterRCNN, name).state_dict().items():
+            if 'activation_post_process' in key:
+                observers[name + '.' + key] = value
+    torch.save({'observers': observers, 'source': os.path.basename(load_name), 'num_images': num_images,
+                'engine': torch.backends.quantized.engine}, calibration_path(load_name))
+    print('saved the calibration of {:d} images: {}'.format(num_images, calibration_path(load_name)))
+
+
+def load_calibration(fasterRCNN, load_name):
+    """
+    int8 RCNN_base and RCNN_top from the calibration saved by quantize_net.py
+    :param fasterRCNN: the detection network with the weights of the checkpoint, on the CPU, in eval mode
+    :param load_name: path of the checkpoint
+    """
+    path = calibration_path(load_name)
+    if not os.path.exists(path):
+        raise Exception('There is no calibration {}, run quantize_net.py first'.format(path))
+    calibration = torch.load(path, map_location='cpu')
+    prepare_static(fasterRCNN)
+    for name in ['RCNN_base', 'RCNN_top']:
+        module = getattr(fasterRCNN, name)
+        observers = {key[len(name) + 1:]: value for key, value in calibration['observers'].items()
+                     if key.startswith(name + '.')}
+        missing, unexpected = module.load_state_dict(observers, strict=False)
+        missing = [key for key in missing if 'activation_post_process' in key]
+        if missing or unexpected:
+            raise Exception('the calibration {} does not match the network: {}'.format(path, (missing + unexpected)[:3]))
+    convert_static(fasterRCNN)
+    print('load calibration of {:d} images {}'.format(calibration['num_images'], path))
+
+
+def quantize_network(fasterRCNN, mode, load_name=None):
+    """
+    quantise the detection network for the CPU inference
+    :param fasterRCNN: the detection network with the weights of the checkpoint, on the CPU, in eval mode
+    :param mode: one of QUANTIZE_MODES
+    :param load_name: path of the checkpoint, needed by the 'static' mode to find its calibration
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError('quantisation mode must be one of {}, not {}'.format(QUANTIZE_MODES, mode))
+    if mode == 'static':
+        load_calibration(fasterRCNN, load_name)
+    num_linear = quantize_dynamic(fasterRCNN, torch.float16 if mode == 'fp16' else torch.qint8)
+    print('quantised network ({}): {:d} nn.Linear'.format(mode, num_linear))
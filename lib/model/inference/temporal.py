@@ -0,0 +1,219 @@
+import time
+import numpy as np
+import cv2
+import torch
+
+from model.rpn.bbox_transform import bbox_overlaps
+from model.inference.hand_object_detector import Detections
+
+
+def scene_change_score(gray_a, gray_b):
+    """
+    mean absolute difference of two downsampled gray frames
+    :param gray_a: 2D array (h, w), uint8
+    :param gray_b: 2D array (h, w), uint8
+    :return: float in [0, 1], 0 means identical frames
+    """
+    return float(np.mean(cv2.absdiff(gray_a, gray_b))) / 255.
+
+
+def detection_agreement(dets, ref_dets):
+    """
+    compare propagated detections of one class with the full detections of the same frame
+    :param dets: 2D array (num_dets, 10) or None, propagated detections
+    :param ref_dets: 2D array (num_ref, 10) or None, detections of the full detector
+    :return: list of (iou, same_contact, same_side), one tuple for each reference detection,
+             iou of the best overlapping propagated box, 0 if there is none
+    """
+    if ref_dets is None:
+        return []
+    if dets is None:
+        return [(0., False, False)] * ref_dets.shape[0]
+
+    overlaps = bbox_overlaps(torch.from_numpy(ref_dets[:, :4]).float(), torch.from_numpy(dets[:, :4]).float())
+    iou, match = overlaps.max(1)
+    iou, match = iou.numpy(), match.numpy()
+    same_contact = ref_dets[:, 5] == dets[match, 5]
+    same_side = ref_dets[:, 9] == dets[match, 9]
+    return list(zip(iou.tolist(), same_contact.tolist(), same_side.tolist()))
+
+
+class TemporalStats(object):
+    """
+    speed and drift of the temporal detector
+    """
+
+    def __init__(self):
+        self.num_frames = 0
+        self.num_keyframes = 0
+        self.detect_time = 0.    # full detection of the keyframes
+        self.propagate_time = 0.    # tracking of the frames in between
+        self.drift = []    # (iou, same_contact, same_side) of every checked reference detection
+
+
+    @property
+    def effective_fps(self):
+        total_time = self.detect_time + self.propagate_time
+        return self.num_frames / total_time if total_time > 0 else float('inf')
+
+
+    @property
+    def full_fps(self):
+        """ estimated fps if every frame ran the full detector """
+        return self.num_keyframes / self.detect_time if self.detect_time > 0 else float('inf')
+
+
+    def __str__(self):
+        lines = ['frames: {:d}, keyframes: {:d}'.format(self.num_frames, self.num_keyframes),
+                 'effective fps: {:.2f}, full detection fps: {:.2f}, gain: {:.2f}x'.format(
+                     self.effective_fps, self.full_fps, self.effective_fps / self.full_fps)]
+        if len(self.drift) > 0:
+            drift = np.array(self.drift, dtype=np.float64)
+            lines.append('drift on {:d} detections: mean iou {:.3f}, iou>=0.5 {:.3f}, '
+                         'contact agreement {:.3f}, side agreement {:.3f}'.format(
+                             drift.shape[0], drift[:, 0].mean(), (drift[:, 0] >= 0.5).mean(),
+                             drift[:, 1].mean(), drift[:, 2].mean()))
+        return '\n'.join(lines)
+
+
+class TemporalDetector(object):
+    """
+    Video detection which runs the full detector on keyframes only.
+    A keyframe is taken every keyframe_interval frames, or earlier when the scene changed too much since the
+    last keyframe. In the frames in between, every box is moved by the median sparse optical flow (Lucas-Kanade)
+    of the points inside it, the contact state, offset vector and hand side are kept from the keyframe.
+    """
+
+    def __init__(self, detector, keyframe_interval=5, scene_change_thresh=0., drift_interval=0,
+                 scene_scale=0.125, max_points=20):
+        """
+        :param detector: HandObjectDetector
+        :param keyframe_interval: maximum number of frames between two keyframes, 1 means every frame
+        :param scene_change_thresh: take a keyframe when scene_change_score() to the last keyframe is above it,
+                                    0 to disable
+        :param drift_interval: run the full detector on every drift_interval-th propagated frame as well and
+                               record the drift in stats (not counted in the timings), 0 to disable
+        :param scene_scale: downsampling factor of the frames for the scene change score
+        :param max_points: maximum number of tracked points in each box
+        """
+        self.detector = detector
+        self.keyframe_interval = keyframe_interval
+        self.scene_change_thresh = scene_change_thresh
+        self.drift_interval = drift_interval
+        self.scene_scale = scene_scale
+        self.max_points = max_points
+        self.lk_params = dict(winSize=(15, 15), maxLevel=2,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.reset()
+
+
+    def reset(self):
+        """ forget the previous frames, e.g. at the beginning of a new video """
+        self.stats = TemporalStats()
+        self.detections = Detections(None, None)
+        self.prev_gray = None
+        self.key_small = None
+        self.since_keyframe = 0
+        self.num_propagated = 0
+
+
+    def detect(self, frame):
+        """
+        detect hands and objects in the next frame of the video
+        :param frame: BGR image (nd array)
+        :return: (Detections of the frame, whether it is a keyframe)
+        """
+        tic = time.time()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, None, None, fx=self.scene_scale, fy=self.scene_scale, interpolation=cv2.INTER_AREA)
+
+        is_keyframe = self.prev_gray is None or self.since_keyframe + 1 >= self.keyframe_interval
+        if not is_keyframe and self.scene_change_thresh > 0:
+            is_keyframe = scene_change_score(small, self.key_small) > self.scene_change_thresh
+
+        if is_keyframe:
+            self.detections = self.detector.detect(frame)[0]
+            self.key_small = small
+            self.since_keyframe = 0
+            self.stats.num_keyframes += 1
+            self.stats.detect_time += time.time() - tic
+        else:
+            self.detections = Detections(*[self.propagate(dets, self.prev_gray, gray) for dets in self.detections])
+            self.since_keyframe += 1
+            self.num_propagated += 1
+            self.stats.propagate_time += time.time() - tic
+
+        self.prev_gray = gray
+        self.stats.num_frames += 1
+
+        if not is_keyframe and self.drift_interval > 0 and self.num_propagated % self.drift_interval == 0:
+            ref = self.detector.detect(frame)[0]
+            for dets, ref_dets in zip(self.detections, ref):
+                self.stats.drift.extend(detection_agreement(dets, ref_dets))
+
+        return self.detections, is_keyframe
+
+
+    def propagate(self, dets, prev_gray, gray):
+        """
+        move the boxes from the previous frame to the current one
+        :param dets: 2D array (num_dets, 10) or None, detections of the previous frame
+        :param prev_gray: 2D array (h, w), previous frame
+        :param gray: 2D array (h, w), current frame
+        :return: 2D array (num_dets, 10) or None, detections of the current frame
+        """
+        if dets is None:
+            return None
+        height, width = gray.shape
+
+        # points to track inside each box, corners if there are some, a regular grid otherwise
+        points, owners = [], []
+        for i, (x1, y1, x2, y2) in enumerate(dets[:, :4].astype(np.int64)):
+            x1, y1 = max(x1, 0), max(y1, 0)
+            x2, y2 = min(x2, width - 1), min(y2, height - 1)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            corners = cv2.goodFeaturesToTrack(prev_gray[y1:y2 + 1, x1:x2 + 1], self.max_points, 0.01, 3)
+            if corners is not None:
+                pts = corners.reshape(-1, 2)
+            else:
+                n = int(np.sqrt(self.max_points))
+                gx, gy = np.meshgrid(np.linspace(0, x2 - x1, n + 2)[1:-1], np.linspace(0, y2 - y1, n + 2)[1:-1])
+                pts = np.stack((gx.ravel(), gy.ravel()), 1)
+            points.append(pts + np.array([x1, y1]))
+            owners.append(np.full(pts.shape[0], i))
+        if len(points) == 0:
+            return dets
+
+        points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        owners = np.concatenate(owners)
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **self.lk_params)
+        points, new_points = points.reshape(-1, 2), new_points.reshape(-1, 2)
+        tracked = status.ravel() == 1
+
+        dets = dets.copy()
+        for i in range(dets.shape[0]):
+            keep = tracked & (owners == i)
+            if not keep.any():
+                continue
+            p0, p1 = points[keep], new_points[keep]
+            shift = np.median(p1 - p0, 0)
+
+            # scale change, from the spread of the points around their centre
+            scale = 1.
+            if p0.shape[0] >= 3:
+                d0 = np.linalg.norm(p0 - p0.mean(0), axis=1)
+                d1 = np.linalg.norm(p1 - p1.mean(0), axis=1)
+                valid = d0 > 1
+                if valid.any():
+                    scale = float(np.clip(np.median(d1[valid] / d0[valid]), 0.8, 1.25))
+
+            cx = (dets[i, 0] + dets[i, 2]) / 2. + shift[0]
+            cy = (dets[i, 1] + dets[i, 3]) / 2. + shift[1]
+            half_w = (dets[i, 2] - dets[i, 0]) / 2. * scale
+            half_h = (dets[i, 3] - dets[i, 1]) / 2. * scale
+            dets[i, :4] = [cx - half_w, cy - half_h, cx + half_w, cy + half_h]
+
+        dets[:, 0:4:2] = np.clip(dets[:, 0:4:2], 0, width - 1)
+        dets[:, 1:4:2] = np.clip(dets[:, 1:4:2], 0, height - 1)
+        return dets
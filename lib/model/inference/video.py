@@ -0,0 +1,196 @@
+import threading
+import time
+import numpy as np
+import cv2
+
+try:
+    import queue  # Python 3
+except ImportError:
+    import Queue as queue  # Python 2
+
+from model.utils.net_utils import vis_detections_filtered_objects_PIL
+
+
+# marks the end of the stream in the queues
+_END = None
+
+
+class StageStats(object):
+    """
+    busy time and number of frames of one pipeline stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.num_frames = 0
+        self.busy_time = 0.
+
+
+    def add(self, num_frames, busy_time):
+        self.num_frames += num_frames
+        self.busy_time += busy_time
+
+
+    @property
+    def fps(self):
+        """ throughput of the stage if it never had to wait for the others """
+        return self.num_frames / self.busy_time if self.busy_time > 0 else float('inf')
+
+
+    def __str__(self):
+        return '{:>8s}: {:6d} frames  {:8.3f}s busy  {:8.2f} fps'.format(self.name, self.num_frames, self.busy_time,
+                                                                         self.fps)
+
+
+def render_detections(frame, detections, thresh_hand=0.5, thresh_obj=0.5):
+    """
+    draw the detections of one frame
+    :param frame: BGR image (nd array)
+    :param detections: Detections of the frame
+    :return: BGR image (nd array)
+    """
+    obj_dets, hand_dets = detections
+    im2show = vis_detections_filtered_objects_PIL(np.copy(frame), obj_dets, hand_dets, thresh_hand, thresh_obj)
+    return cv2.cvtColor(np.array(im2show), cv2.COLOR_RGBA2BGR)
+
+
+class VideoPipeline(object):
+    """
+    decode --> batched inference --> render/write, overlapped with bounded queues:
+        decoder thread: reads the frames from a cv2.VideoCapture
+        inference: runs on the calling thread, one detector.detect() for up to batch_size frames
+        renderer thread: draws the detections and hands the image to the sink (e.g. cv2.VideoWriter.write)
+    The throughput of the whole pipeline is bounded by the slowest stage rather than the sum of all stages.
+    """
+
+    def __init__(self, detector, batch_size=1, queue_size=8, frame_step=1, render_fn=None):
+        """
+        :param detector: HandObjectDetector
+        :param batch_size: number of frames in each forward pass
+        :param queue_size: maximum number of frames waiting between two stages
+        :param frame_step: detect one frame out of every frame_step frames
+        :param render_fn: render_fn(frame, detections) returns the image given to the sink, default is render_detections()
+        """
+        self.detector = detector
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.frame_step = frame_step
+        if render_fn is None:
+            render_fn = lambda frame, detections: render_detections(frame, detections, detector.thresh_hand,
+                                                                    detector.thresh_obj)
+        self.render_fn = render_fn
+
+
+    def run(self, capture, sink=None, max_frames=None):
+        """
+        process a whole video
+        :param capture: cv2.VideoCapture (or any object with a read() method returning (success, frame))
+        :param sink: sink(frame_index, image) is called in frame order with each rendered image, can be None
+        :param max_frames: stop after reading max_frames frames
+        :return: dict of StageStats, keys are 'decode', 'infer', 'render', 'total'
+        """
+        stats = {'decode': StageStats('decode'), 'infer': StageStats('infer'), 'render': StageStats('render'),
+                 'total': StageStats('total')}
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+
+        # a stage never blocks forever on a queue: it gives up as soon as another stage failed
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while True:
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        return _END
+
+        def decode():
+            try:
+                index = 0
+                while not stop.is_set() and (max_frames is None or index < max_frames):
+                    tic = time.time()
+                    success, frame = capture.read()
+                    if not success:
+                        break
+                    stats['decode'].add(1, time.time() - tic)
+                    if index % self.frame_step == 0 and not put(frame_queue, (index, frame)):
+                        break
+                    index += 1
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                put(frame_queue, _END)
+
+        def render():
+            try:
+                while True:
+                    item = get(result_queue)
+                    if item is _END:
+                        break
+                    index, frame, detections = item
+                    tic = time.time()
+                    image = self.render_fn(frame, detections)
+                    if sink is not None:
+                        sink(index, image)
+                    stats['render'].add(1, time.time() - tic)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        decoder = threading.Thread(target=decode, name='decoder')
+        renderer = threading.Thread(target=render, name='renderer')
+        decoder.daemon = True
+        renderer.daemon = True
+
+        start = time.time()
+        decoder.start()
+        renderer.start()
+        try:
+            finished = False
+            while not finished:
+                # gather up to batch_size frames, do not wait for a full batch at the end of the video
+                batch = [get(frame_queue)]
+                while len(batch) < self.batch_size and batch[-1] is not _END:
+                    try:
+                        batch.append(frame_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is _END:
+                    finished = True
+                    batch = batch[:-1]
+                if len(batch) == 0:
+                    continue
+
+                tic = time.time()
+                detections = self.detector.detect([frame for _, frame in batch])
+                stats['infer'].add(len(batch), time.time() - tic)
+
+                for (index, frame), dets in zip(batch, detections):
+                    if not put(result_queue, (index, frame, dets)):
+                        finished = True
+                        break
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            put(result_queue, _END)
+            renderer.join()
+            stop.set()
+            decoder.join()
+
+        if errors:
+            raise errors[0]
+
+        stats['total'].add(stats['render'].num_frames, time.time() - start)
+        return stats
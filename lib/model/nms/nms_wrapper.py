@@ -5,17 +5,18 @@
 # Written by Ross Girshick
 # --------------------------------------------------------
 import torch
-from model.utils.config import cfg
-if torch.cuda.is_available():
-    from model.nms.nms_gpu import nms_gpu
-from model.nms.nms_cpu import nms_cpu
+from model.roi_layers import nms as _nms
+
 
 def nms(dets, thresh, force_cpu=False):
-    """Dispatch to either CPU or GPU NMS implementations."""
+    """
+    Dispatch to model.roi_layers.nms, which picks the backend by device and falls back to pure torch.
+    :param dets: 2D tensor (N, 5), each row is [x1, y1, x2, y2, score]
+    :param force_cpu: run on the CPU whatever the device of dets is
+    :return: 1D long tensor, indices of the kept dets in increasing order
+    """
     if dets.shape[0] == 0:
         return []
-    # ---numpy version---
-    # original: return gpu_nms(dets, thresh, device_id=cfg.GPU_ID)
-    # ---pytorch version---
-
-    return nms_gpu(dets, thresh) if force_cpu == False else nms_cpu(dets, thresh)
+    if force_cpu:
+        return _nms(dets[:, :4].cpu(), dets[:, 4].cpu(), thresh).to(dets.device)
+    return _nms(dets[:, :4], dets[:, 4], thresh)
@@ -1,134 +1,217 @@
+import math
+import numpy as np
 import torch
 import torch.nn as nn
-import numpy as np
-
+import torch.nn.functional as F
 
 
 class RelationModule(nn.Module):
+    """
+    16 relation units (heads) computed together, the weights of all heads are stacked:
+    head n owns the rows [n*128, (n+1)*128) of WQ, WK, WV, the row n of WG and the slice n of layer_norm, W1, W2
+    """
 
-    def __init__(self, n_relations=16, appear_feature_dim=2048, key_feature_dim=128, geo_feature_dim=128):
+    def __init__(self, n_relations=16, appear_feature_dim=2048, key_feature_dim=128, geo_feature_dim=128, wave_len=1000):
         super(RelationModule, self).__init__()
         self.num_relations = n_relations
         self.dim_g = geo_feature_dim
+        self.dim_k = key_feature_dim
+
+        # frequencies of the positional embedding, [1.0000, 0.4217, 0.1778, 0.0750, 0.0316, 0.0133, 0.0056, 0.0024]
+        # a buffer follows the device and dtype of the module, it is not saved in the checkpoint
+        feat_range = torch.arange(geo_feature_dim // 8, dtype=torch.float32)  # [0,1,2,3,...,7]
+        dim_mat = 1. / (torch.pow(wave_len, feat_range / (geo_feature_dim / 8)))
+        self.register_buffer('dim_mat', dim_mat.view(1, 1, 1, 1, -1), persistent=False)  # (1, 1, 1, 1, 8)
 
-        # define 32 relation modules
-        self.relation = nn.ModuleList()
-        for N in range(self.num_relations):
-            self.relation.append(RelationUnit(appear_feature_dim, key_feature_dim, geo_feature_dim))
+        # preallocated tensors of the positional embedding, reused at test time while the number of proposals is unchanged
+        self._workspaces = {}
+
+        self.WG = nn.Linear(geo_feature_dim, n_relations, bias=True)  # (128, 128, 64) ==> (128, 128, 16)
+        self.WK = nn.Linear(appear_feature_dim, n_relations * key_feature_dim, bias=True)  # (128, 2048) ==> (128, 16*64)
+        self.WQ = nn.Linear(appear_feature_dim, n_relations * key_feature_dim, bias=True)
+        self.WV = nn.Linear(appear_feature_dim, n_relations * key_feature_dim, bias=True)
+        self.relu = nn.ReLU(inplace=True)
+        self.layer_norm = StackedLayerNorm(n_relations, key_feature_dim, eps=1e-6)  # layer norm after self-attention
+        self.W1 = StackedLinear(n_relations, key_feature_dim, key_feature_dim)  # FC layer
+        self.W2 = StackedLinear(n_relations, key_feature_dim, key_feature_dim)  # FC layer
 
 
     def forward(self, app_feature, bbox_coordinates):
         """
-        build up 32 relation modules
+        build up 16 relation units, the relations are computed within each image of the batch
         :param app_feature: appearance feature of 128 proposals, 2D tensor (128*batch, 2048)
-        :param bbox_coordinates: coordinate of 128 proposals, 2D tensor (batch, 128, 5)
-        :return: 
+        :param bbox_coordinates: coordinate of 128 proposals, 3D tensor (batch, 128, 5)
+        :return: relation feature, 2D tensor (128*batch, 2048), the output of each unit is concatenated along the last channel
         """
-        position_embedding = self.PositionalEmbedding(bbox_coordinates)
+        B, N = bbox_coordinates.size(0), bbox_coordinates.size(1)
+        H, K = self.num_relations, self.dim_k
+        # the log-ratio geometry is computed in fp32, also under autocast (mixed-precision training)
+        position_embedding = self.PositionalEmbedding(bbox_coordinates.float())    # (batch, 128, 128, 64)
+        app_feature = app_feature.view(B, N, -1)  # (128*batch, 2048) ==> (batch, 128, 2048)
+
+        # similarity measurement
+        w_q = self.WQ(app_feature).view(B, N, H, K).transpose(1, 2)  # (batch, 128, 2048) ==> (batch, 16, 128, 64)
+        w_k = self.WK(app_feature).view(B, N, H, K).permute(0, 2, 3, 1)  # (batch, 128, 2048) ==> (batch, 16, 64, 128)
+        scaled_dot = torch.matmul(w_q, w_k)  # (batch, 16, 128, 128), each element is a appearance score between obj_n and obj_m
+        scaled_dot = scaled_dot / np.sqrt(K)
+
+        # positional embedding
+        w_g = self.relu(self.WG(position_embedding))  # (batch, 128, 128, 64) ==> (batch, 128, 128, 16)
+        w_g = w_g.permute(0, 3, 1, 2)  # (batch, 16, 128, 128), each element is a position score between obj_n and obj_m
+
+        # self-attention
+        w_mn = scaled_dot + w_g  # merge appearance feature and geo feature
+        w_mn = F.softmax(w_mn, dim=3)  # (batch, 16, 128, 128), each element is a relation score between obj_n and obj_m
+        w_v = self.WV(app_feature).view(B, N, H, K).transpose(1, 2)  # (batch, 128, 2048) ==> (batch, 16, 128, 64)
+        attention = torch.matmul(w_mn, w_v).transpose(1, 2)  # (batch, 128, 16, 64)
+
+        # layer norm and FC layers
+        norm_attention = self.layer_norm(attention)
+        output = self.W2(F.relu(self.W1(norm_attention)))  # (batch, 128, 16, 64) ==> (batch, 128, 16, 64)
+
+        return output.reshape(B * N, H * K)
+
 
-        for N in range(self.num_relations):
-            if (N == 0):
-                concat = self.relation[N](app_feature, position_embedding)
-            else:
-                concat = torch.cat((concat, self.relation[N](app_feature, position_embedding)), -1)  # concat along last channel
-        # return concat + app_feature
-        return concat 
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys,
+                              error_msgs):
+        # checkpoints saved before the heads were stacked hold one RelationUnit per head
+        if prefix + 'relation.0.WQ.weight' in state_dict:
+            fuse_relation_units(state_dict, prefix, self.num_relations)
+        super(RelationModule, self)._load_from_state_dict(state_dict, prefix, local_metadata, strict, missing_keys,
+                                                          unexpected_keys, error_msgs)
 
 
-    def PositionalEmbedding(self, bbox_coor, dim_g=128, wave_len=1000):
-        bbox_coor = bbox_coor.squeeze(0)  # (batch, 128, 5) ==> (128, 5)
-        bbox_coor = bbox_coor[:, 1:]  # (128, 5) == > (128, 4), remove the first column
-        x_min, y_min, x_max, y_max = torch.chunk(bbox_coor, 4, dim=1)  # (128, 4) ==> (128, 1)
+    def PositionalEmbedding(self, bbox_coor):
+        """
+        :param bbox_coor: coordinate of 128 proposals, 3D tensor (batch, 128, 5)
+        :return: positional embedding between the proposals of the same image, 4D tensor (batch, 128, 128, 64)
+        """
+        bbox_coor = bbox_coor[:, :, 1:]  # (batch, 128, 5) == > (batch, 128, 4), remove the first column
+        x_min, y_min, x_max, y_max = torch.chunk(bbox_coor, 4, dim=2)  # (batch, 128, 4) ==> (batch, 128, 1)
+        B, N = bbox_coor.size(0), bbox_coor.size(1)
 
-        cx = (x_min + x_max) * 0.5  # (128, 1)
+        cx = (x_min + x_max) * 0.5  # (batch, 128, 1)
         cy = (y_min + y_max) * 0.5
         w = (x_max - x_min)
         h = (y_max - y_min)
         w = torch.clamp(w, min=1e-4)
         h = torch.clamp(h, min=1e-4)
 
-        delta_x = cx - cx.view(1, -1)  # (128, 128), each row is the delta_x between the box and the all boxes
-        delta_x = torch.clamp(torch.abs(delta_x / w), min=1e-3)
-        delta_x = torch.log(delta_x)
+        # (batch, 128, 128, 4), each row is the [delta_x, delta_y, delta_w, delta_h] between the box and the all boxes
+        position_mat = self._workspace('position_mat', (B, N, N, 4), bbox_coor)
+        delta_x, delta_y, delta_w, delta_h = position_mat.unbind(3)  # views, (batch, 128, 128)
 
-        delta_y = cy - cy.view(1, -1)  # (128, 128), each row is the delta_y between the box and the all boxes
-        delta_y = torch.clamp(torch.abs(delta_y / h), min=1e-3)
-        delta_y = torch.log(delta_y)
+        torch.sub(cx, cx.transpose(1, 2), out=delta_x)
+        delta_x.div_(w).abs_().clamp_(min=1e-3).log_()
 
-        delta_w = torch.log(w / w.view(1, -1))  # (128, 128), each row is the delta_w between the box and the all boxes
-        delta_h = torch.log(h / h.view(1, -1))  # (128, 128), each row is the delta_h between the box and the all boxes
-        size = delta_h.size()
+        torch.sub(cy, cy.transpose(1, 2), out=delta_y)
+        delta_y.div_(h).abs_().clamp_(min=1e-3).log_()
 
-        delta_x = delta_x.view(size[0], size[1], 1)  # (128, 128) ==> (128, 128, 1)
-        delta_y = delta_y.view(size[0], size[1], 1)
-        delta_w = delta_w.view(size[0], size[1], 1)
-        delta_h = delta_h.view(size[0], size[1], 1)
+        torch.div(w, w.transpose(1, 2), out=delta_w).log_()
+        torch.div(h, h.transpose(1, 2), out=delta_h).log_()
 
-        position_mat = torch.cat((delta_x, delta_y, delta_w, delta_h), -1)  # (128, 128, 4)
+        position_mat.mul_(100.)
 
-        feat_range = torch.arange(dim_g / 8).cuda()  # [0,1,2,3,...,7]
-        dim_mat = feat_range / (dim_g/8)
-        dim_mat = 1. / (torch.pow(wave_len, dim_mat))  # [1.0000, 0.4217, 0.1778, 0.0750, 0.0316, 0.0133, 0.0056, 0.0024]
+        mul_mat = self._workspace('mul_mat', (B, N, N, 4, self.dim_mat.size(-1)), bbox_coor)
+        torch.mul(position_mat.unsqueeze(-1), self.dim_mat, out=mul_mat)  # (batch,128,128,4,1) * (1,1,1,1,8) ==> (batch,128,128,4,8)
+        mul_mat = mul_mat.view(B, N, N, -1)  # (batch, 128, 128, 32)
 
-        dim_mat = dim_mat.view(1, 1, 1, -1)  # (1, 1, 1, 8)
-        position_mat = position_mat.view(size[0], size[1], 4, -1)  # (128, 128, 4) ==> (128, 128, 4, 1)
-        position_mat = 100. * position_mat
-
-        mul_mat = position_mat * dim_mat  # (128,128,4,1) * (1,1,1,8) ==> (128,128,4,8)
-        mul_mat = mul_mat.view(size[0], size[1], -1)  # (128, 128, 32)
-        sin_mat = torch.sin(mul_mat)  # (128, 128, 32)
-        cos_mat = torch.cos(mul_mat)  # (128, 128, 32)
-        embedding = torch.cat((sin_mat, cos_mat), -1)  # (128, 128, 64)
+        embedding = self._workspace('embedding', (B, N, N, 2 * mul_mat.size(-1)), bbox_coor)  # (batch, 128, 128, 64)
+        sin_mat, cos_mat = embedding.chunk(2, dim=3)
+        torch.sin(mul_mat, out=sin_mat)  # (batch, 128, 128, 32)
+        torch.cos(mul_mat, out=cos_mat)  # (batch, 128, 128, 32)
 
         return embedding
 
 
-class RelationUnit(nn.Module):
-    def __init__(self, appearance_feature_dim=2048, key_feature_dim=128, geo_feature_dim=128):
-        super(RelationUnit, self).__init__()
-
-        self.dim_g = geo_feature_dim
-        self.dim_k = key_feature_dim
-        self.WG = nn.Linear(geo_feature_dim, 1, bias=True)  # (128, 128, 64) ==> (128, 128, 1)
-        self.WK = nn.Linear(appearance_feature_dim, key_feature_dim, bias=True)  # (128, 2048) ==> (128, 64)
-        self.WQ = nn.Linear(appearance_feature_dim, key_feature_dim, bias=True)
-        self.WV = nn.Linear(appearance_feature_dim, key_feature_dim, bias=True)
-        self.relu = nn.ReLU(inplace=True)
-        self.layer_norm = nn.LayerNorm(key_feature_dim, eps=1e-6)  # layer norm after self-attention
-        self.W1 = nn.Linear(key_feature_dim, key_feature_dim)  # FC layer
-        self.W2 = nn.Linear(key_feature_dim, key_feature_dim)  # FC layer
-
-
-    def forward(self, app_feature, position_embedding):
+    def _workspace(self, name, size, like):
         """
-        :param app_feature: appearance feature of 128 proposals, 2D tensor (128*batch, 2048)
-        :param position_embedding: positional embedding of 128 proposals, 3D tensor (128, 128, 64)
-        :return:
+        get a tensor to fill, the tensor of the last call is reused when gradients are disabled
+        (there is no backward pass holding on to it) and its size, device and dtype are unchanged
+        :param name: name of the workspace
+        :param size: tuple, size of the tensor
+        :param like: tensor giving the device and dtype
+        :return: uninitialised tensor of the given size
         """
-        N, _ = app_feature.size()
-
-        # similarity measurement
-        w_q = self.WQ(app_feature)  # (128, 2048) ==> (128, 64)
-        w_k = self.WK(app_feature)  # (128, 2048) ==> (128, 64)
-        w_k = w_k.transpose(0, 1)
-        scaled_dot = torch.mm(w_q, w_k)  # (128, 128), each element is a appearance score between obj_n and obj_m
-        scaled_dot = scaled_dot / np.sqrt(self.dim_k)  # (128, 128)
+        if torch.is_grad_enabled():
+            return like.new_empty(size)
+
+        buf = self._workspaces.get(name)
+        if buf is None or buf.size() != size or buf.device != like.device or buf.dtype != like.dtype:
+            buf = like.new_empty(size)
+            self._workspaces[name] = buf
+        return buf
+
+
+def fuse_relation_units(state_dict, prefix='', n_relations=16):
+    """
+    convert (in place) the weights of the 16 RelationUnit (relation.0.WQ.weight, ...) of an old checkpoint
+    to the stacked weights of RelationModule
+    :param state_dict: state dict of the model
+    :param prefix: prefix of the relation module, e.g. 'relation_module.'
+    :param n_relations: number of relation units
+    :return: state_dict
+    """
+    def pop_units(name):
+        return [state_dict.pop('{}relation.{}.{}'.format(prefix, n, name)) for n in range(n_relations)]
+
+    # WG, WK, WQ, WV: the output rows of each unit are concatenated
+    for layer in ['WG', 'WK', 'WQ', 'WV']:
+        for param in ['weight', 'bias']:
+            state_dict[prefix + layer + '.' + param] = torch.cat(pop_units(layer + '.' + param), 0)
+
+    # layer_norm, W1, W2: the parameters of each unit are stacked
+    for layer in ['layer_norm', 'W1', 'W2']:
+        for param in ['weight', 'bias']:
+            state_dict[prefix + layer + '.' + param] = torch.stack(pop_units(layer + '.' + param), 0)
+
+    return state_dict
+
+
+class StackedLinear(nn.Module):
+    """
+    one independent nn.Linear for each head, applied to (..., num_heads, in_features) in a single batched matmul
+    """
+
+    def __init__(self, num_heads, in_features, out_features):
+        super(StackedLinear, self).__init__()
+        self.weight = nn.Parameter(torch.Tensor(num_heads, out_features, in_features))
+        self.bias = nn.Parameter(torch.Tensor(num_heads, out_features))
+        self.reset_parameters()
+
+
+    def reset_parameters(self):
+        # same initialisation as nn.Linear, for each head
+        for n in range(self.weight.size(0)):
+            nn.init.kaiming_uniform_(self.weight[n], a=math.sqrt(5))
+        bound = 1 / math.sqrt(self.weight.size(2))
+        nn.init.uniform_(self.bias, -bound, bound)
+
+
+    def forward(self, input):
+        """
+        :param input: (..., num_heads, in_features)
+        :return: (..., num_heads, out_features)
+        """
+        return torch.einsum('...hi,hoi->...ho', input, self.weight) + self.bias
 
-        # positional embedding
-        w_g = self.relu(self.WG(position_embedding))  # (128, 128, 64) ==> (128, 128, 1)
-        w_g = w_g.view(N, N)  # (128, 128), each element is a position score between obj_n and obj_m
 
-        # self-attention
-        w_a = scaled_dot.view(N, N)
-        w_mn = w_a + w_g  # merge appearance feature and geo feature
-        w_mn = torch.nn.Softmax(dim=1)(w_mn)  # (128, 128), each element is a relation score between obj_n and obj_m
-        w_v = self.WV(app_feature)  # (128, 2048) ==> (128, 64)
-        attention = torch.mm(w_mn, w_v)
+class StackedLayerNorm(nn.Module):
+    """
+    one independent nn.LayerNorm for each head, applied to (..., num_heads, normalized_shape)
+    """
 
-        # layer norm and FC layers
-        norm_attention = self.layer_norm(attention)
-        output = self.W2(nn.functional.relu(self.W1(norm_attention)))  # (128, 64) ==> (128, 64)
-
-        return output
+    def __init__(self, num_heads, normalized_shape, eps=1e-5):
+        super(StackedLayerNorm, self).__init__()
+        self.normalized_shape = (normalized_shape,)
+        self.eps = eps
+        self.weight = nn.Parameter(torch.ones(num_heads, normalized_shape))
+        self.bias = nn.Parameter(torch.zeros(num_heads, normalized_shape))
 
 
+    def forward(self, input):
+        """
+        :param input: (..., num_heads, normalized_shape)
+        :return: (..., num_heads, normalized_shape)
+        """
+        return F.layer_norm(input, self.normalized_shape, eps=self.eps) * self.weight + self.bias
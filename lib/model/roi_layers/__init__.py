@@ -1,9 +1,13 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 import torch
 from .nms import nms
+from .nms import batched_nms
+from .nms import nms_torch
+from .nms import select_backend
+from .nms import backend_counts
 from .roi_align import ROIAlign
 from .roi_align import roi_align
 from .roi_pool import ROIPool
 from .roi_pool import roi_pool
 
-__all__ = ["nms", "roi_align", "ROIAlign", "roi_pool", "ROIPool"]
+__all__ = ["nms", "batched_nms", "nms_torch", "select_backend", "backend_counts", "roi_align", "ROIAlign", "roi_pool", "ROIPool"]
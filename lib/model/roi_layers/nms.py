@@ -1,7 +1,148 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 # from ._utils import _C
-from model import _C
+import collections
+import torch
 
-nms = _C.nms
-# nms.__doc__ = """
-# This function performs Non-maximum suppresion"""
+try:
+    from model import _C
+except ImportError:
+    _C = None    # not built, nms falls back to the pure torch implementation
+
+
+# number of nms calls run by each backend, e.g. Counter({'cpu': 120, 'torch': 3})
+backend_counts = collections.Counter()
+
+# backends which failed at runtime, e.g. 'cuda' when _C was built without CUDA
+_unavailable = set()
+
+# the pure torch nms compares each block of boxes with the kept boxes, and resolves the block with Cluster-NMS,
+# larger blocks mean fewer steps (and syncs) on the GPU but more wasted IoUs on the CPU
+TORCH_BLOCK_SIZE = {'cpu': 256, 'cuda': 1024}
+
+
+def select_backend(boxes):
+    """
+    the fastest correct backend for the boxes:
+        'cuda': the bitmask kernel of _C for CUDA tensors
+        'cpu': the blocked multi-threaded kernel of _C for CPU tensors
+        'torch': the pure torch implementation, when _C is not built (or not built with CUDA)
+    the number of boxes does not change the choice, the _C kernels are faster from 2 boxes on
+    (python benchmarks/nms_bench.py --num_boxes 2 10 100 1000: 0.03 / 0.03 / 0.07 / 0.5 ms against
+    0.3 / 0.3 / 0.7 / 5.8 ms for nms_torch on one CPU thread), the torch one launches more small ops per call
+    :param boxes: 2D tensor (N, 4)
+    """
+    backend = 'cuda' if boxes.is_cuda else 'cpu'
+    if _C is None or backend in _unavailable:
+        return 'torch'
+    return backend
+
+
+def nms(boxes, scores, nms_thresh, max_keep=-1, backend=None):
+    """
+    Performs non-maximum suppression, a box is suppressed by a higher scoring box with IoU >= nms_thresh.
+    :param boxes: 2D tensor (N, 4), each row is [x1, y1, x2, y2]
+    :param scores: 1D tensor (N)
+    :param nms_thresh: IoU threshold
+    :param max_keep: only keep the max_keep highest scoring boxes, -1 for no limit
+    :param backend: 'cuda', 'cpu' or 'torch', default is select_backend(boxes)
+    :return: 1D long tensor, indices of the kept boxes in increasing order
+    """
+    if backend is None:
+        backend = select_backend(boxes)
+
+    if backend == 'torch':
+        keep = nms_torch(boxes, scores, nms_thresh, max_keep)
+    else:
+        try:
+            keep = _C.nms(boxes, scores, nms_thresh, max_keep).to(boxes.device)
+        except RuntimeError as e:
+            if 'Not compiled with GPU support' not in str(e):
+                raise
+            _unavailable.add(backend)
+            return nms(boxes, scores, nms_thresh, max_keep, 'torch')
+
+    backend_counts[backend] += 1
+    return keep
+
+
+def _box_iou(boxes1, areas1, boxes2, areas2):
+    """ IoU (N, M) of two sets of boxes, with the (x2 - x1 + 1) convention of the _C kernels """
+    w = (torch.min(boxes1[:, None, 2], boxes2[None, :, 2]) - torch.max(boxes1[:, None, 0], boxes2[None, :, 0]) + 1)
+    h = (torch.min(boxes1[:, None, 3], boxes2[None, :, 3]) - torch.max(boxes1[:, None, 1], boxes2[None, :, 1]) + 1)
+    inter = w.clamp(min=0) * h.clamp(min=0)
+    return inter / (areas1[:, None] + areas2[None, :] - inter)
+
+
+def nms_torch(boxes, scores, nms_thresh, max_keep=-1, block_size=None):
+    """
+    Pure torch nms with the same result as the _C kernels, for deployments without the compiled extension.
+    The boxes are visited by decreasing score in blocks of block_size: the boxes of a block suppressed by the kept
+    boxes are dropped, then the greedy nms inside the block is solved with Cluster-NMS (iterate the suppression by
+    the boxes which are still alive until nothing changes), which gives the same result as the sequential greedy nms.
+    With N <= block_size this is a single Cluster-NMS over the N x N IoU matrix.
+    :return: 1D long tensor, indices of the kept boxes in increasing order
+    """
+    if boxes.numel() == 0:
+        return boxes.new_zeros((0,), dtype=torch.long)
+    block_size = block_size or TORCH_BLOCK_SIZE['cuda' if boxes.is_cuda else 'cpu']
+
+    order = torch.sort(scores, 0, descending=True)[1]
+    boxes = boxes[order]
+    areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    num_boxes = boxes.size(0)
+
+    keep = order.new_zeros((0,))    # positions in the sorted boxes
+    for start in range(0, num_boxes, block_size):
+        inds = torch.arange(start, min(start + block_size, num_boxes), device=boxes.device)
+
+        # suppressed by the kept boxes of the previous blocks
+        if keep.numel() > 0:
+            suppressed = (_box_iou(boxes[inds], areas[inds], boxes[keep], areas[keep]) >= nms_thresh).any(1)
+            inds = inds[~suppressed]
+        if inds.numel() == 0:
+            continue
+
+        # Cluster-NMS inside the block, box j can only be suppressed by a box i < j which is still alive
+        iou = _box_iou(boxes[inds], areas[inds], boxes[inds], areas[inds])
+        overlap = (iou >= nms_thresh).triu(1)
+        alive = torch.ones(inds.numel(), dtype=torch.bool, device=boxes.device)
+        for _ in range(inds.numel()):
+            next_alive = ~(overlap & alive[:, None]).any(0)
+            if torch.equal(next_alive, alive):
+                break
+            alive = next_alive
+
+        keep = torch.cat([keep, inds[alive]])
+        if max_keep > 0 and keep.numel() >= max_keep:
+            keep = keep[:max_keep]
+            break
+
+    return torch.sort(order[keep])[0]
+
+
+def batched_nms(boxes, scores, idxs, nms_thresh, max_keep=-1, backend=None):
+    """
+    Performs non-maximum suppression for several classes (or images) at once,
+    boxes of different idxs never suppress each other.
+    :param boxes: 2D tensor (N, 4), each row is [x1, y1, x2, y2]
+    :param scores: 1D tensor (N)
+    :param idxs: 1D int tensor (N), class (or image) index of each box
+    :param nms_thresh: IoU threshold
+    :param max_keep: only the max_keep highest scoring kept boxes of each idx are needed, -1 for all of them.
+                     The CPU kernel stops early, the GPU kernel keeps them all, so callers still have to cut.
+    :param backend: 'cuda', 'cpu' or 'torch', default is select_backend(boxes)
+    :return: 1D long tensor, indices of the kept boxes in increasing order
+    """
+    if boxes.numel() == 0:
+        return boxes.new_zeros((0,), dtype=torch.long)
+    if not boxes.is_cuda:
+        # the CPU kernel is quadratic in the number of boxes, one call per idx is cheaper than a call for all of them
+        keep = []
+        for idx in torch.unique(idxs).tolist():
+            inds = torch.nonzero(idxs == idx).view(-1)
+            keep.append(inds[nms(boxes[inds], scores[inds], nms_thresh, max_keep, backend).long()])
+        return torch.sort(torch.cat(keep))[0]
+    # shift the boxes of each idx to a disjoint region, the +1 keeps them apart under the (x2 - x1 + 1) area convention
+    offsets = idxs.to(boxes) * (boxes.max() + 1)
+    keep = nms(boxes + offsets[:, None], scores, nms_thresh, backend=backend)
+    return keep.view(-1).long()
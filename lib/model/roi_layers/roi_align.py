@@ -5,7 +5,11 @@ from torch.autograd import Function
 from torch.autograd.function import once_differentiable
 from torch.nn.modules.utils import _pair
 
-from model import _C
+try:
+    from model import _C
+except ImportError:
+    _C = None    # not built, roi_align falls back to torchvision.ops.roi_align, the same algorithm
+    from torchvision.ops import roi_align as _roi_align_torchvision
 
 import pdb
 
@@ -43,7 +47,10 @@ class _ROIAlign(Function):
         return grad_input, None, None, None, None
 
 
-roi_align = _ROIAlign.apply
+def roi_align(input, roi, output_size, spatial_scale, sampling_ratio):
+    if _C is None:
+        return _roi_align_torchvision(input, roi, _pair(output_size), spatial_scale, sampling_ratio)
+    return _ROIAlign.apply(input, roi, output_size, spatial_scale, sampling_ratio)
 
 
 class ROIAlign(nn.Module):
@@ -54,8 +61,10 @@ class ROIAlign(nn.Module):
         self.sampling_ratio = sampling_ratio
 
     def forward(self, input, rois):
+        if input.dtype == torch.half:
+            input = input.float()    # the kernels have no fp16 version, fp16 features (autocast) are pooled in fp32
         return roi_align(
-            input, rois, self.output_size, self.spatial_scale, self.sampling_ratio
+            input, rois.to(input.dtype), self.output_size, self.spatial_scale, self.sampling_ratio
         )
 
     def __repr__(self):
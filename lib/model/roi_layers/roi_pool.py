@@ -5,7 +5,11 @@ from torch.autograd import Function
 from torch.autograd.function import once_differentiable
 from torch.nn.modules.utils import _pair
 
-from model import _C
+try:
+    from model import _C
+except ImportError:
+    _C = None    # not built, roi_pool falls back to torchvision.ops.roi_pool, the same algorithm
+    from torchvision.ops import roi_pool as _roi_pool_torchvision
 
 
 class _ROIPool(Function):
@@ -43,7 +47,10 @@ class _ROIPool(Function):
         return grad_input, None, None, None
 
 
-roi_pool = _ROIPool.apply
+def roi_pool(input, roi, output_size, spatial_scale):
+    if _C is None:
+        return _roi_pool_torchvision(input, roi, _pair(output_size), spatial_scale)
+    return _ROIPool.apply(input, roi, output_size, spatial_scale)
 
 
 class ROIPool(nn.Module):
@@ -53,7 +60,9 @@ class ROIPool(nn.Module):
         self.spatial_scale = spatial_scale
 
     def forward(self, input, rois):
-        return roi_pool(input, rois, self.output_size, self.spatial_scale)
+        if input.dtype == torch.half:
+            input = input.float()    # the kernels have no fp16 version, fp16 features (autocast) are pooled in fp32
+        return roi_pool(input, rois.to(input.dtype), self.output_size, self.spatial_scale)
 
     def __repr__(self):
         tmpstr = self.__class__.__name__ + "("
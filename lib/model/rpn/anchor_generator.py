@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+# --------------------------------------------------------
+# Anchor grid cache shared by the proposal and anchor target layers
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+import collections
+import torch
+import numpy as np
+from .generate_anchors import generate_anchors
+
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class AnchorGenerator(object):
+    """
+    Shifted anchors of a whole feature map, built once per (H, W, stride, device, dtype) and kept in an LRU cache,
+    together with the anchors which may be inside the image.
+    The returned tensors are shared between calls and must not be modified in place.
+    """
+
+    def __init__(self, scales, ratios, maxsize=32):
+        """
+        :param scales: [8, 16, 32]
+        :param ratios: [0.5, 1, 2]
+        :param maxsize: number of anchor grids kept in the cache
+        """
+        # default 9 anchors, 2D (9, 4) tensor, for each point in feature map
+        self.base_anchors = torch.from_numpy(generate_anchors(scales=np.array(scales), ratios=np.array(ratios))).float()
+        self.num_anchors = self.base_anchors.size(0)    # 9
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+
+
+    def __call__(self, feat_height, feat_width, feat_stride, device, dtype=torch.float32):
+        """
+        :param feat_height: H
+        :param feat_width: W
+        :param feat_stride: 16
+        :return: 2D tensor (H*W*9, 4), each row is an anchor [x1, y1, x2, y2], ordered by (h, w, anchor)
+        """
+        key = (int(feat_height), int(feat_width), feat_stride, torch.device(device), dtype)
+        return self._lookup(key, lambda: self._build(feat_height, feat_width, feat_stride, device).to(dtype))
+
+
+    def candidates(self, feat_height, feat_width, feat_stride, device, allowed_border=0):
+        """
+        indices of the anchors which may be inside the image of a feature map, whatever the rounding of the
+        backbone is, the image is at most (H + 1) * stride high and (W + 1) * stride wide
+        :return: 1D long tensor, a superset of the anchors inside the image
+        """
+        key = ('candidates', int(feat_height), int(feat_width), feat_stride, torch.device(device), allowed_border)
+
+        def build():
+            anchors = self(feat_height, feat_width, feat_stride, device)
+            keep = ((anchors[:, 0] >= -allowed_border) &
+                    (anchors[:, 1] >= -allowed_border) &
+                    (anchors[:, 2] < (feat_width + 1) * feat_stride + allowed_border) &
+                    (anchors[:, 3] < (feat_height + 1) * feat_stride + allowed_border))
+            return torch.nonzero(keep).view(-1)
+
+        return self._lookup(key, build)
+
+
+    def _lookup(self, key, build):
+        value = self._cache.get(key)
+        if value is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = build()
+        self._cache[key] = value
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return value
+
+
+    def _build(self, feat_height, feat_width, feat_stride, device):
+        # compute the shift value for H*W cells
+        shift_x = torch.arange(0, feat_width, dtype=torch.float32, device=device) * feat_stride
+        shift_y = torch.arange(0, feat_height, dtype=torch.float32, device=device) * feat_stride
+        shift_x = shift_x.view(1, -1).expand(feat_height, feat_width).reshape(-1)
+        shift_y = shift_y.view(-1, 1).expand(feat_height, feat_width).reshape(-1)
+        shifts = torch.stack((shift_x, shift_y, shift_x, shift_y), 1)    # (H*W, 4)
+
+        # copy and shift the 9 anchors for H*W cells
+        base_anchors = self.base_anchors.to(device)
+        return (base_anchors.view(1, self.num_anchors, 4) + shifts.view(-1, 1, 4)).view(-1, 4)
+
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._cache))
+
+
+    def cache_clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+_generators = {}
+
+
+def get_anchor_generator(scales, ratios):
+    """
+    the AnchorGenerator of the given anchor scales and ratios, shared by all layers of the process
+    :param scales: [8, 16, 32]
+    :param ratios: [0.5, 1, 2]
+    """
+    key = (tuple(scales), tuple(ratios))
+    if key not in _generators:
+        _generators[key] = AnchorGenerator(scales, ratios)
+    return _generators[key]
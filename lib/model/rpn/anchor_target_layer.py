@@ -15,7 +15,7 @@ import numpy as np
 import numpy.random as npr
 
 from model.utils.config import cfg
-from .generate_anchors import generate_anchors
+from .anchor_generator import get_anchor_generator
 from .bbox_transform import clip_boxes, bbox_overlaps_batch, bbox_transform_batch
 
 import pdb
@@ -43,9 +43,8 @@ class _AnchorTargetLayer(nn.Module):
 
         self._feat_stride = feat_stride
         self._scales = scales
-        anchor_scales = scales
-        self._anchors = torch.from_numpy(generate_anchors(scales=np.array(anchor_scales), ratios=np.array(ratios))).float()
-        self._num_anchors = self._anchors.size(0)
+        self._anchor_generator = get_anchor_generator(scales, ratios)
+        self._num_anchors = self._anchor_generator.num_anchors
 
         # allow boxes to sit over the edge by a small amount
         self._allowed_border = 0  # default is 0
@@ -74,104 +73,79 @@ class _AnchorTargetLayer(nn.Module):
         batch_size = gt_boxes.size(0)
 
         feat_height, feat_width = rpn_cls_score.size(2), rpn_cls_score.size(3)
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(rpn_cls_score).float()
+        all_anchors = self._anchor_generator(feat_height, feat_width, self._feat_stride, gt_boxes.device,
+                                             gt_boxes.dtype)    # move to specific gpu.
 
         A = self._num_anchors
-        K = shifts.size(0)
-
-        self._anchors = self._anchors.type_as(gt_boxes) # move to specific gpu.
-        all_anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)
-        all_anchors = all_anchors.view(K * A, 4)
+        K = feat_height * feat_width
 
         total_anchors = int(K * A)
 
-        keep = ((all_anchors[:, 0] >= -self._allowed_border) &
-                (all_anchors[:, 1] >= -self._allowed_border) &
-                (all_anchors[:, 2] < long(im_info[0][1]) + self._allowed_border) &
-                (all_anchors[:, 3] < long(im_info[0][0]) + self._allowed_border))
-
-        inds_inside = torch.nonzero(keep).view(-1)
-
-        # keep only inside anchors
+        # keep only the anchors inside the image, the cached candidates (which only depend on the feature map size)
+        # have static shapes so that the labelling never waits for the device, the others are dont care
+        inds_inside = self._anchor_generator.candidates(feat_height, feat_width, self._feat_stride, gt_boxes.device,
+                                                        self._allowed_border)
         anchors = all_anchors[inds_inside, :]
+        inside = ((anchors[:, 0] >= -self._allowed_border) &
+                  (anchors[:, 1] >= -self._allowed_border) &
+                  (anchors[:, 2] < im_info[0][1].long().to(anchors) + self._allowed_border) &
+                  (anchors[:, 3] < im_info[0][0].long().to(anchors) + self._allowed_border))
+        inside = inside.view(1, -1).expand(batch_size, -1)    # (batch, num_candidates)
 
         # label: 1 is positive, 0 is negative, -1 is dont care
-        labels = gt_boxes.new(batch_size, inds_inside.size(0)).fill_(-1)
-        bbox_inside_weights = gt_boxes.new(batch_size, inds_inside.size(0)).zero_()
-        bbox_outside_weights = gt_boxes.new(batch_size, inds_inside.size(0)).zero_()
+        labels = gt_boxes.new_full((batch_size, inds_inside.size(0)), -1)
 
-        overlaps = bbox_overlaps_batch(anchors, gt_boxes)
+        # the outside anchors get an overlap of -1, which neither matches nor is the best anchor of any gt box
+        overlaps = bbox_overlaps_batch(anchors, gt_boxes)    # (batch, num_candidates, num_boxes)
+        overlaps.masked_fill_(~inside.unsqueeze(2), -1)
 
         max_overlaps, argmax_overlaps = torch.max(overlaps, 2)
         gt_max_overlaps, _ = torch.max(overlaps, 1)
 
         if not cfg.TRAIN.RPN_CLOBBER_POSITIVES:
-            labels[max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP] = 0
+            labels.masked_fill_(max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP, 0)
 
-        gt_max_overlaps[gt_max_overlaps==0] = 1e-5
+        # fg label: for each gt, the anchors with the highest overlap
+        gt_max_overlaps.masked_fill_(gt_max_overlaps==0, 1e-5)
         keep = torch.sum(overlaps.eq(gt_max_overlaps.view(batch_size,1,-1).expand_as(overlaps)), 2)
-
-        if torch.sum(keep) > 0:
-            labels[keep>0] = 1
+        labels.masked_fill_(keep>0, 1)
 
         # fg label: above threshold IOU
-        labels[max_overlaps >= cfg.TRAIN.RPN_POSITIVE_OVERLAP] = 1
+        labels.masked_fill_(max_overlaps >= cfg.TRAIN.RPN_POSITIVE_OVERLAP, 1)
 
         if cfg.TRAIN.RPN_CLOBBER_POSITIVES:
-            labels[max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP] = 0
-
-        num_fg = int(cfg.TRAIN.RPN_FG_FRACTION * cfg.TRAIN.RPN_BATCHSIZE)
-
-        sum_fg = torch.sum((labels == 1).int(), 1)
-        sum_bg = torch.sum((labels == 0).int(), 1)
-
-        for i in range(batch_size):
-            # subsample positive labels if we have too many
-            if sum_fg[i] > num_fg:
-                fg_inds = torch.nonzero(labels[i] == 1).view(-1)
-                # torch.randperm seems has a bug on multi-gpu setting that cause the segfault.
-                # See https://github.com/pytorch/pytorch/issues/1868 for more details.
-                # use numpy instead.
-                #rand_num = torch.randperm(fg_inds.size(0)).type_as(gt_boxes).long()
-                rand_num = torch.from_numpy(np.random.permutation(fg_inds.size(0))).type_as(gt_boxes).long()
-                disable_inds = fg_inds[rand_num[:fg_inds.size(0)-num_fg]]
-                labels[i][disable_inds] = -1
+            labels.masked_fill_(max_overlaps < cfg.TRAIN.RPN_NEGATIVE_OVERLAP, 0)
 
-#           num_bg = cfg.TRAIN.RPN_BATCHSIZE - sum_fg[i]
-            num_bg = cfg.TRAIN.RPN_BATCHSIZE - torch.sum((labels == 1).int(), 1)[i]
+        labels.masked_fill_(~inside, -1)
 
-            # subsample negative labels if we have too many
-            if sum_bg[i] > num_bg:
-                bg_inds = torch.nonzero(labels[i] == 0).view(-1)
-                #rand_num = torch.randperm(bg_inds.size(0)).type_as(gt_boxes).long()
-
-                rand_num = torch.from_numpy(np.random.permutation(bg_inds.size(0))).type_as(gt_boxes).long()
-                disable_inds = bg_inds[rand_num[:bg_inds.size(0)-num_bg]]
-                labels[i][disable_inds] = -1
-
-        offset = torch.arange(0, batch_size)*gt_boxes.size(1)
+        # subsample positive labels if we have too many, then fill the rest of RPN_BATCHSIZE with negative labels
+        num_fg = int(cfg.TRAIN.RPN_FG_FRACTION * cfg.TRAIN.RPN_BATCHSIZE)
+        self._subsample(labels, 1, num_fg, num_fg)
+        num_bg = cfg.TRAIN.RPN_BATCHSIZE - torch.sum((labels == 1).int(), 1)    # (batch)
+        self._subsample(labels, 0, num_bg, cfg.TRAIN.RPN_BATCHSIZE)
 
-        argmax_overlaps = argmax_overlaps + offset.view(batch_size, 1).type_as(argmax_overlaps)
-        bbox_targets = _compute_targets_batch(anchors, gt_boxes.view(-1,5)[argmax_overlaps.view(-1), :].view(batch_size, -1, 5))
+        gt_assignment = argmax_overlaps.unsqueeze(2).expand(-1, -1, gt_boxes.size(2))
+        bbox_targets = _compute_targets_batch(anchors, torch.gather(gt_boxes, 1, gt_assignment))
+        bbox_targets.masked_fill_(~inside.unsqueeze(2), 0)
 
         # use a single value instead of 4 values for easy index.
-        bbox_inside_weights[labels==1] = cfg.TRAIN.RPN_BBOX_INSIDE_WEIGHTS[0]
+        bbox_inside_weights = (labels == 1).type_as(gt_boxes) * cfg.TRAIN.RPN_BBOX_INSIDE_WEIGHTS[0]
 
+        # normalise by the sampled anchors of each image
         if cfg.TRAIN.RPN_POSITIVE_WEIGHT < 0:
-            num_examples = torch.sum(labels[i] >= 0)
-            positive_weights = 1.0 / num_examples.item()
-            negative_weights = 1.0 / num_examples.item()
+            num_examples = torch.sum((labels >= 0).type_as(gt_boxes), 1, keepdim=True).clamp(min=1)
+            positive_weights = 1.0 / num_examples
+            negative_weights = 1.0 / num_examples
         else:
             assert ((cfg.TRAIN.RPN_POSITIVE_WEIGHT > 0) &
                     (cfg.TRAIN.RPN_POSITIVE_WEIGHT < 1))
+            positive_weights = cfg.TRAIN.RPN_POSITIVE_WEIGHT / \
+                torch.sum((labels == 1).type_as(gt_boxes), 1, keepdim=True).clamp(min=1)
+            negative_weights = (1.0 - cfg.TRAIN.RPN_POSITIVE_WEIGHT) / \
+                torch.sum((labels == 0).type_as(gt_boxes), 1, keepdim=True).clamp(min=1)
 
-        bbox_outside_weights[labels == 1] = positive_weights
-        bbox_outside_weights[labels == 0] = negative_weights
+        bbox_outside_weights = (labels == 1).type_as(gt_boxes) * positive_weights + \
+                               (labels == 0).type_as(gt_boxes) * negative_weights
 
         labels = _unmap(labels, total_anchors, inds_inside, batch_size, fill=-1)
         bbox_targets = _unmap(bbox_targets, total_anchors, inds_inside, batch_size, fill=0)
@@ -202,6 +176,26 @@ class _AnchorTargetLayer(nn.Module):
 
         return outputs
 
+    def _subsample(self, labels, label, num_keep, max_keep):
+        """
+        randomly disable (set to -1) the anchors of a label beyond num_keep in each image, in place
+        the anchors of the label are ranked by a random key, the random key of the others is above all of them
+        (torch.randperm has a bug on multi-gpu setting, https://github.com/pytorch/pytorch/issues/1868)
+        :param labels: 2D tensor (batch, num_candidates), 1 is positive, 0 is negative, -1 is dont care
+        :param label: 1 or 0
+        :param num_keep: int or 1D tensor (batch), number of anchors of the label kept in each image
+        :param max_keep: int, upper bound of num_keep
+        """
+        is_label = labels == label
+        rand_key = torch.rand(labels.size(), device=labels.device) + (~is_label).float() * 2
+        order = torch.topk(rand_key, min(max_keep, labels.size(1)), 1, largest=False)[1]    # (batch, max_keep)
+
+        if torch.is_tensor(num_keep):
+            num_keep = num_keep.view(-1, 1)
+        rank = torch.arange(order.size(1), device=labels.device).view(1, -1)
+        kept = torch.zeros_like(is_label).scatter_(1, order, (rank < num_keep).expand_as(order))
+        labels.masked_fill_(is_label & ~kept, -1)
+
     def backward(self, top, propagate_down, bottom):
         """This layer does not propagate gradients."""
         pass
@@ -215,10 +209,10 @@ def _unmap(data, count, inds, batch_size, fill=0):
     size count) """
 
     if data.dim() == 2:
-        ret = torch.Tensor(batch_size, count).fill_(fill).type_as(data)
+        ret = data.new_full((batch_size, count), fill)
         ret[:, inds] = data
     else:
-        ret = torch.Tensor(batch_size, count, data.size(2)).fill_(fill).type_as(data)
+        ret = data.new_full((batch_size, count, data.size(2)), fill)
         ret[:, inds,:] = data
     return ret
 
@@ -15,10 +15,10 @@ import torch
 import torch.nn as nn
 import numpy as np
 from model.utils.config import cfg
-from .generate_anchors import generate_anchors
+from .anchor_generator import get_anchor_generator
 from .bbox_transform import bbox_transform_inv, clip_boxes, clip_boxes_batch
 # from model.nms.nms_wrapper import nms
-from model.roi_layers import nms
+from model.roi_layers import batched_nms
 
 DEBUG = False
 
@@ -39,9 +39,9 @@ class _ProposalLayer(nn.Module):
 
         self._feat_stride = feat_stride
 
-        # generate default 9 anchors, 2D (9, 4)tensor, for each point in feature map
-        self._anchors = torch.from_numpy(generate_anchors(scales=np.array(scales), ratios=np.array(ratios))).float()
-        self._num_anchors = self._anchors.size(0)    # 9
+        # default 9 anchors for each point in feature map, the shifted anchors are cached per feature map shape
+        self._anchor_generator = get_anchor_generator(scales, ratios)
+        self._num_anchors = self._anchor_generator.num_anchors    # 9
 
 
     def forward(self, input):
@@ -69,22 +69,11 @@ class _ProposalLayer(nn.Module):
         min_size      = cfg[cfg_key].RPN_MIN_SIZE    # 16
         batch_size = bbox_deltas.size(0)    # batch
 
-        # compute the shift value for H*W cells
-        feat_height, feat_width = scores.size(2), scores.size(3)    # H, W
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(scores).float()    # (H*W, 4)
-
-        # copy and shift the 9 anchors for H*W cells
+        # the shifted 9 anchors for H*W cells, (H*W*9, 4), from the anchor cache
         # copy the H*W*9 anchors for batch images
-        A = self._num_anchors    # 9
-        K = shifts.size(0)    # H * W
-        self._anchors = self._anchors.type_as(scores)
-        anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)    # (H*W, 9, 4) anchors for 1 image
-        anchors = anchors.view(1, K*A, 4).expand(batch_size, K*A, 4)    # (batch, H*W*9, 4) anchors for batch images
+        feat_height, feat_width = scores.size(2), scores.size(3)    # H, W
+        anchors = self._anchor_generator(feat_height, feat_width, self._feat_stride, scores.device, scores.dtype)
+        anchors = anchors.view(1, -1, 4).expand(batch_size, -1, 4)    # (batch, H*W*9, 4) anchors for batch images
 
         # make bbox_deltas the same order with the anchors:
         bbox_deltas = bbox_deltas.permute(0, 2, 3, 1).contiguous()    # (batch, 36, H, W) --> (batch, H, W, 36)
@@ -99,45 +88,43 @@ class _ProposalLayer(nn.Module):
 
         # 2. clip predicted boxes to the image, make sure [x1, y1, x2, y2] are within the image [h, w]
         proposals = clip_boxes(proposals, im_info, batch_size)    # (batch, H*W*9, 4)
-        scores_keep = scores
-        proposals_keep = proposals
 
         # 3. remove predicted bboxes whose height or width < threshold
         # (NOTE: convert min_size to input image scale stored in im_info[2])
-        # 4. sort all (proposal, score) pairs by score from highest to lowest
-        _, order = torch.sort(scores_keep, 1, True)    # high score to low score
-
-        # initialise the proposals by zero tensor
-        output = scores.new(batch_size, post_nms_topN, 5).zero_()
-
-        # for each image
-        for i in range(batch_size):
-            proposals_single = proposals_keep[i]
-            scores_single = scores_keep[i]
-            order_single = order[i]
-
-            # 5. take top pre_nms_topN proposals before NMS (e.g. 6000)
-            if pre_nms_topN > 0 and pre_nms_topN < scores_keep.numel():
-                order_single = order_single[:pre_nms_topN]
-            proposals_single = proposals_single[order_single, :]
-            scores_single = scores_single[order_single].view(-1,1)
-
-            # 6. apply NMS (e.g. threshold = 0.7)
-            keep_idx_i = nms(proposals_single, scores_single.squeeze(1), nms_thresh)
-            keep_idx_i = keep_idx_i.long().view(-1)
-
-            # 7. take after_nms_topN proposals after NMS (e.g. 300 for test, 2000 for train)
-            if post_nms_topN > 0:
-                keep_idx_i = keep_idx_i[:post_nms_topN]
-
-            # 8. return the top proposals (-> RoIs top)
-            proposals_single = proposals_single[keep_idx_i, :]
-            scores_single = scores_single[keep_idx_i, :]
-
-            # 9. padding 0 at the end.
-            num_proposal = proposals_single.size(0)
-            output[i,:,0] = i
-            output[i,:num_proposal,1:] = proposals_single
+        keep = self._filter_boxes(proposals, min_size * im_info[:, 2])    # (batch, H*W*9)
+        scores = scores.masked_fill(~keep, float('-inf'))
+
+        # 4. take top pre_nms_topN (proposal, score) pairs of each image from highest to lowest score (e.g. 6000)
+        num_anchors = scores.size(1)
+        if pre_nms_topN <= 0 or pre_nms_topN > num_anchors:
+            pre_nms_topN = num_anchors
+        scores, order = torch.topk(scores, pre_nms_topN, 1)    # (batch, pre_nms_topN)
+        proposals = torch.gather(proposals, 1, order.unsqueeze(2).expand(-1, -1, 4))    # (batch, pre_nms_topN, 4)
+        image_inds = torch.arange(batch_size, device=scores.device).view(-1, 1).expand_as(order)
+
+        # 5. apply NMS to all images at once (e.g. threshold = 0.7), boxes of different images never suppress each other
+        valid = torch.isfinite(scores).view(-1)
+        proposals, scores, image_inds = proposals.reshape(-1, 4)[valid], scores.reshape(-1)[valid], \
+            image_inds.reshape(-1)[valid]
+        # the CPU kernel stops each image once post_nms_topN proposals are kept
+        keep_idx = batched_nms(proposals, scores.float(), image_inds, nms_thresh, post_nms_topN)
+
+        # 6. group the kept proposals by image, each image keeps its score order
+        keep_idx = keep_idx[torch.sort(image_inds[keep_idx] * keep_idx.numel() +
+                                       torch.arange(keep_idx.numel(), device=keep_idx.device))[1]]
+        image_inds = image_inds[keep_idx]
+        counts = torch.bincount(image_inds, minlength=batch_size)
+        starts = torch.cumsum(counts, 0) - counts
+        ranks = torch.arange(keep_idx.numel(), device=keep_idx.device) - starts[image_inds]
+
+        # 7. take after_nms_topN proposals after NMS (e.g. 300 for test, 2000 for train)
+        top = ranks < post_nms_topN
+        keep_idx, image_inds, ranks = keep_idx[top], image_inds[top], ranks[top]
+
+        # 8. return the top proposals (-> RoIs top), padding 0 at the end
+        output = proposals.new_zeros(batch_size, post_nms_topN, 5)
+        output[:, :, 0] = torch.arange(batch_size, device=output.device).view(-1, 1).to(output)
+        output[image_inds, ranks, 1:] = proposals[keep_idx]
 
         return output    # (batch, 2000, 5) 2000 training proposals, each row is [batch_ind, x1, y1, x2, y2]
 
@@ -94,21 +94,11 @@ class _ProposalTargetLayer(nn.Module):
             bbox_target (ndarray): b x N x 4K blob of regression targets
             bbox_inside_weights (ndarray): b x N x 4K blob of loss weights
         """
-        batch_size = labels_batch.size(0)
-        rois_per_image = labels_batch.size(1)
-        clss = labels_batch
-        bbox_targets = bbox_target_data.new(batch_size, rois_per_image, 4).zero_()
-        bbox_inside_weights = bbox_target_data.new(bbox_targets.size()).zero_()
-
-        for b in range(batch_size):
-            # assert clss[b].sum() > 0
-            if clss[b].sum() == 0:
-                continue
-            inds = torch.nonzero(clss[b] > 0).view(-1)
-            for i in range(inds.numel()):
-                ind = inds[i]
-                bbox_targets[b, ind, :] = bbox_target_data[b, ind, :]
-                bbox_inside_weights[b, ind, :] = self.BBOX_INSIDE_WEIGHTS
+        # only the fg rois (class > 0) have regression targets
+        fg_mask = (labels_batch > 0).unsqueeze(2).expand_as(bbox_target_data)    # (batch, 128, 4)
+        bbox_targets = torch.where(fg_mask, bbox_target_data, torch.zeros_like(bbox_target_data))
+        bbox_inside_weights = torch.where(fg_mask, self.BBOX_INSIDE_WEIGHTS.view(1, 1, 4).expand_as(bbox_target_data),
+                                          torch.zeros_like(bbox_target_data))
 
         return bbox_targets, bbox_inside_weights
 
@@ -161,99 +151,61 @@ class _ProposalTargetLayer(nn.Module):
 
         batch_size = overlaps.size(0)
         num_proposal = overlaps.size(1)
-        num_boxes_per_img = overlaps.size(2)
-
-        offset = torch.arange(0, batch_size) * gt_boxes.size(1)    # [0, 20, 40, 60] if batch=4
-
-        # offset: (batch, 2000+20), the index of the max overlap ratio, new_ind = ind + offset
-        offset = offset.view(-1, 1).type_as(gt_assignment) + gt_assignment
-
-        # assign class labels for 2020 proposal bboxes based on the cls index
-        labels = gt_boxes[:, :, 4].contiguous().view(-1)[(offset.view(-1),)].view(batch_size, -1)    # (batch, 2000+20)
-
-        # assign contact labels for 2020 proposal bboxes based on the cls index
-        list_box = []
-        for i in range(batch_size):
-            # solve the bug when batch > 1
-            link_label_i = box_info[i].expand(i+1, box_info.size(1), box_info.size(2)).reshape(-1, box_info.size(2))
-            list_box.append(link_label_i[(offset[i, :].view(-1),)])
-
-            # list_box.append(box_info[i][(offset[i, :].view(-1),)])
-        boxes_info = torch.stack(list_box)    # 3D tensor (batch, 2020, 5)
-
-        """best solution to solve the bug when batch > 1"""
-        # boxes_info = box_info.contiguous().view(-1, 5)[offset.view(-1)].view(batch_size, -1, 5)
-
-        # initialise the best 128 proposals
-        labels_batch = labels.new(batch_size, rois_per_image).zero_()    # (batch, 128)
-        info_batch = boxes_info.new(batch_size, rois_per_image, 5).zero_()    # (batch, 128, 5)
-        rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()    # (batch, 128, 5)
-        gt_rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()    # (batch, 128, 5)
-
-        # randomly select 128 proposals whose IOU>=Threshold for each image
-        for i in range(batch_size):
-            # find the index of fg proposals according to the IOU threshold
-            fg_inds = torch.nonzero(max_overlaps[i] >= cfg.TRAIN.FG_THRESH).view(-1)
-            fg_num_rois = fg_inds.numel()
-
-            # find the index of bg proposals according to the IOU threshold: [BG_THRESH_LO, BG_THRESH_HI)
-            bg_inds = torch.nonzero((max_overlaps[i] < cfg.TRAIN.BG_THRESH_HI) &
-                                    (max_overlaps[i] >= cfg.TRAIN.BG_THRESH_LO)).view(-1)
-            bg_num_rois = bg_inds.numel()
-
-            if fg_num_rois > 0 and bg_num_rois > 0:
-                fg_rois_per_this_image = min(fg_rois_per_image, fg_num_rois)
-
-                # torch.randperm seems has a bug on multi-gpu setting that cause the segfault.
-                # See https://github.com/pytorch/pytorch/issues/1868 for more details.
-                # use numpy instead.
-                # rand_num = torch.randperm(fg_num_rois).long().cuda()
-
-                # randomly select <= 32 fg proposals for training, rather than selecting the high IOU proposals
-                rand_num = torch.from_numpy(np.random.permutation(fg_num_rois)).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num[:fg_rois_per_this_image]]
-
-                # randomly select bg proposals for training
-                bg_rois_per_this_image = rois_per_image - fg_rois_per_this_image
-                rand_num = np.floor(np.random.rand(bg_rois_per_this_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                bg_inds = bg_inds[rand_num]
-
-            elif fg_num_rois > 0 and bg_num_rois == 0:
-                # randomly select 128 fg proposals for training
-                rand_num = np.floor(np.random.rand(rois_per_image) * fg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num]
-                fg_rois_per_this_image = rois_per_image
-                bg_rois_per_this_image = 0
-
-            elif bg_num_rois > 0 and fg_num_rois == 0:
-                # randomly select 128 bg proposals for training
-                rand_num = np.floor(np.random.rand(rois_per_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                bg_inds = bg_inds[rand_num]
-                bg_rois_per_this_image = rois_per_image
-                fg_rois_per_this_image = 0
-
-            else:
-                raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
-
-            # The indices of selected 128 proposals from 2020 proposals
-            keep_inds = torch.cat([fg_inds, bg_inds], 0)    # 1D tensor (128)
-
-            # Select 128 labels from 2020 labels (but bg proposals are still labelled as non-zero)
-            labels_batch[i].copy_(labels[i][keep_inds])    # class labels
-            info_batch[i].copy_(boxes_info[i][keep_inds, :])    # contact labels
-
-            # must set the labels of background proposals to 0
-            if fg_rois_per_this_image < rois_per_image:
-                labels_batch[i][fg_rois_per_this_image:] = 0
-                info_batch[i][fg_rois_per_this_image:, :] = 0
-
-            rois_batch[i] = all_rois[i][keep_inds]
-            rois_batch[i, :, 0] = i    # 3D tensor (batch, 128, 5), each row: [batch_ind, x1, y1, x2, y2]
-
-            gt_rois_batch[i] = gt_boxes[i][gt_assignment[i][keep_inds]]
+
+        # assign class labels and contact labels for 2020 proposal bboxes based on the gt index
+        # note that, currently each proposal is assigned with the gt box, need to set bg proposals to 0 later
+        labels = torch.gather(gt_boxes[:, :, 4], 1, gt_assignment)    # (batch, 2000+20)
+        boxes_info = torch.gather(box_info, 1, gt_assignment.unsqueeze(2).expand(-1, -1, box_info.size(2)))    # (batch, 2020, 5)
+
+        # find fg proposals according to the IOU threshold, and bg proposals in [BG_THRESH_LO, BG_THRESH_HI)
+        fg_mask = max_overlaps >= cfg.TRAIN.FG_THRESH    # (batch, 2020)
+        bg_mask = (max_overlaps < cfg.TRAIN.BG_THRESH_HI) & (max_overlaps >= cfg.TRAIN.BG_THRESH_LO)
+        fg_num_rois = fg_mask.sum(1)    # (batch)
+        bg_num_rois = bg_mask.sum(1)
+        if ((fg_num_rois == 0) & (bg_num_rois == 0)).any():
+            raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
+
+        # random permutation of the fg (bg) proposals of each image, they come first when sorting by a random key
+        # (torch.randperm has a bug on multi-gpu setting, https://github.com/pytorch/pytorch/issues/1868)
+        rand_key = torch.rand(batch_size, num_proposal, device=overlaps.device)
+        fg_perm = torch.sort(rand_key + (~fg_mask).type_as(rand_key) * 2, 1)[1]    # (batch, 2020)
+        bg_perm = torch.sort(rand_key + (~bg_mask).type_as(rand_key) * 2, 1)[1]
+
+        # each image takes fg_rois_per_this_image fg proposals and fills the rest of its 128 proposals with bg ones:
+        #   fg and bg: <= 32 fg proposals without replacement, 128 - fg bg proposals with replacement
+        #   only fg: 128 fg proposals with replacement
+        #   only bg: 128 bg proposals with replacement
+        fg_rois_per_this_image = torch.where(bg_num_rois > 0, fg_num_rois.clamp(max=fg_rois_per_image),
+                                             fg_num_rois.new_full((batch_size,), rois_per_image))
+        fg_rois_per_this_image = torch.where(fg_num_rois > 0, fg_rois_per_this_image,
+                                             torch.zeros_like(fg_rois_per_this_image))    # (batch)
+
+        slots = torch.arange(rois_per_image, device=overlaps.device).view(1, -1).expand(batch_size, -1)    # (batch, 128)
+        is_fg = slots < fg_rois_per_this_image.view(-1, 1)
+        rand_num = torch.rand(batch_size, rois_per_image, device=overlaps.device)
+        def sample_with_replacement(num_rois):
+            # uniform slots in [0, num_rois), float32 rounding may give num_rois itself
+            num_rois = num_rois.view(-1, 1)
+            return torch.min((rand_num * num_rois.type_as(rand_num)).long(), (num_rois - 1).clamp(min=0))
+
+        fg_slots = torch.where((bg_num_rois > 0).view(-1, 1), slots, sample_with_replacement(fg_num_rois))
+        bg_slots = sample_with_replacement(bg_num_rois)
+        fg_inds = torch.gather(fg_perm, 1, fg_slots.clamp(max=num_proposal - 1))
+        bg_inds = torch.gather(bg_perm, 1, bg_slots.clamp(max=num_proposal - 1))
+
+        # The indices of selected 128 proposals from 2020 proposals, fg first
+        keep_inds = torch.where(is_fg, fg_inds, bg_inds)    # (batch, 128)
+
+        # Select 128 labels from 2020 labels, the labels of background proposals must be set to 0
+        labels_batch = torch.gather(labels, 1, keep_inds) * is_fg.type_as(labels)    # class labels (batch, 128)
+        info_batch = torch.gather(boxes_info, 1, keep_inds.unsqueeze(2).expand(-1, -1, boxes_info.size(2))) * \
+            is_fg.unsqueeze(2).type_as(boxes_info)    # contact labels (batch, 128, 5)
+
+        rois_batch = torch.gather(all_rois, 1, keep_inds.unsqueeze(2).expand(-1, -1, 5))
+        rois_batch[:, :, 0] = torch.arange(batch_size, device=overlaps.device).view(-1, 1).type_as(rois_batch)    # (batch, 128, 5), each row: [batch_ind, x1, y1, x2, y2]
+
+        gt_rois_batch = torch.gather(gt_boxes, 1, torch.gather(gt_assignment, 1, keep_inds).unsqueeze(2).expand(
+            -1, -1, gt_boxes.size(2)))
 
         bbox_target_data = self._compute_targets_pytorch(rois_batch[:, :, 1:5], gt_rois_batch[:, :, :4])
         bbox_targets, bbox_inside_weights = self._get_bbox_regression_labels_pytorch(bbox_target_data, labels_batch, num_classes)
@@ -43,7 +43,8 @@ class _RPN(nn.Module):
     @staticmethod
     def reshape(x, d):
         input_shape = x.size()
-        x = x.view(
+        # reshape rather than view, the scores are channels last when the backbone is (see fused_backbone.py)
+        x = x.reshape(
             input_shape[0],
             int(d),
             int(float(input_shape[1] * input_shape[2]) / float(d)),
@@ -76,7 +77,8 @@ class _RPN(nn.Module):
 
         # 3. get the 300 proposals for each test image (2000 for training), finetune the proposals by bbox delta
         cfg_key = 'TRAIN' if self.training else 'TEST'
-        rois = self.RPN_proposal((rpn_cls_prob.data, rpn_bbox_pred.data, im_info, cfg_key))
+        # the proposals are decoded in fp32, the deltas are fp16 under autocast (mixed-precision training)
+        rois = self.RPN_proposal((rpn_cls_prob.data.float(), rpn_bbox_pred.data.float(), im_info, cfg_key))
 
         self.rpn_loss_cls = 0
         self.rpn_loss_box = 0
@@ -10,6 +10,8 @@
 import numpy as np
 # from scipy.misc import imread, imresize
 import cv2
+import torch
+import torch.nn.functional as F
 
 try:
     xrange  # Python 2
@@ -17,15 +19,24 @@ except NameError:
     xrange = range  # Python 3
 
 
-def im_list_to_blob(ims):
+# pixel normalisation of the pytorch pre-trained models, in [0, 1]
+PIXEL_NORM_MEANS = [0.485, 0.456, 0.406]
+PIXEL_NORM_STDS = [0.229, 0.224, 0.225]
+
+# padding of the raw uint8 images (cfg.UINT8_BLOB), the mean pixel, normalised to less than 0.01 from 0
+PIXEL_PAD_UINT8 = [int(round(255 * m)) for m in PIXEL_NORM_MEANS]
+
+
+def im_list_to_blob(ims, dtype=np.float32):
     """
     Given images, use the max_h, max_w to build a blob (canvas) to hold all images
     @param ims: images are already processed (means subtracted, BGR order, ...).
+    @param dtype: np.float32, or np.uint8 for the raw images of cfg.UINT8_BLOB
     @return: 4D array, (num_images, h_max, w_max, 3)
     """
     max_shape = np.array([im.shape for im in ims]).max(axis=0)
     num_images = len(ims)
-    blob = np.zeros((num_images, max_shape[0], max_shape[1], 3), dtype=np.float32)
+    blob = np.zeros((num_images, max_shape[0], max_shape[1], 3), dtype=dtype)
     for i in xrange(num_images):
         im = ims[i]
         blob[i, 0:im.shape[0], 0:im.shape[1], :] = im
@@ -33,6 +44,51 @@ def im_list_to_blob(ims):
     return blob
 
 
+def normalize_im_for_blob(im):
+    """
+    pixel normalisation for pytorch pre-trained model
+    https://pytorch.org/docs/stable/torchvision/models.html
+    :param im: BGR image (nd array), uint8 or float in [0, 255]
+    :return: float32 image, a new array unless im is already float32
+    """
+    im = im.astype(np.float32, copy=False)
+    im /= 255.    # shrink pixel to [0,1]
+    im -= PIXEL_NORM_MEANS    # Minus mean
+    im /= PIXEL_NORM_STDS    # divide by stddev
+
+    return im
+
+
+def blob_from_uint8(data, size=None):
+    """
+    the device side of cfg.UINT8_BLOB: normalise, resize and permute a batch of raw images in one pass,
+    the same as normalize_im_for_blob() then cv2.resize() then permute, on the device of data
+    :param data: uint8 BGR images, 4D tensor (batch, h, w, 3)
+    :param size: (height, width) of the network input, None to keep (h, w)
+    :return: float32 blob, 4D tensor (batch, 3, height, width)
+    """
+    im = data.permute(0, 3, 1, 2).float()
+    if size is not None:
+        size = (int(size[0]), int(size[1]))
+        if size != tuple(im.shape[2:]):
+            # the bilinear resize with half pixel centers is the cv2.INTER_LINEAR, and commutes with the normalisation
+            im = F.interpolate(im, size=size, mode='bilinear', align_corners=False)
+    means = torch.tensor(PIXEL_NORM_MEANS, dtype=torch.float32, device=im.device).view(1, 3, 1, 1) * 255.
+    stds = torch.tensor(PIXEL_NORM_STDS, dtype=torch.float32, device=im.device).view(1, 3, 1, 1) * 255.
+    return ((im - means) / stds).contiguous()
+
+
+def blob_size(im_shape, target_size):
+    """
+    :param im_shape: (h, w, ...) of the original image
+    :param target_size: 600
+    :return: the (h, w) of the image resized by prep_im_for_blob(), and the scale factor
+    """
+    im_scale = float(target_size) / float(np.min(im_shape[0:2]))
+    # the rounding of cv2.resize
+    return (int(round(im_shape[0] * im_scale)), int(round(im_shape[1] * im_scale))), im_scale
+
+
 def prep_im_for_blob(im, pixel_means, target_size, max_size):
     """
     Mean subtract and scale an image for use in a blob.
@@ -43,13 +99,7 @@ def prep_im_for_blob(im, pixel_means, target_size, max_size):
     """
 
     # 1. for pytorch pre-trained model, we need to do the pixel normalisation
-    # https://pytorch.org/docs/stable/torchvision/models.html
-    im = im.astype(np.float32, copy=False)
-    im /= 255.    # shrink pixel to [0,1]
-    pixel_means = [0.485, 0.456, 0.406]
-    pixel_stdens = [0.229, 0.224, 0.225]
-    im -= pixel_means    # Minus mean
-    im /= pixel_stdens    # divide by stddev
+    im = normalize_im_for_blob(im)
 
     # # 2. for caffe pre-trained model, we don't need to do the pixel normalisation
     # im = im.astype(np.float32, copy=False)
@@ -93,6 +93,14 @@ __C.TRAIN.BG_THRESH_LO = 0.1
 # Use horizontally-flipped images during training?
 __C.TRAIN.USE_FLIPPED = True
 
+# Directory of a packed image store (see pack_images.py) with the training images
+# already resized to TRAIN.SCALES[0], '' to decode and resize the JPEG images every epoch
+__C.TRAIN.IMAGE_STORE = ''
+
+# Keep the training roidb as columns of the annotation store (LazyRoidb) and build the entry of an image when the
+# data loader reads it, instead of a list of dicts; only for the image sets with an annotation store (pascal_voc)
+__C.TRAIN.LAZY_ROIDB = True
+
 # Train bounding-box regressors
 __C.TRAIN.BBOX_REG = True
 
@@ -262,6 +270,10 @@ __C.DEDUP_BOXES = 1. / 16.
 # they were trained with
 __C.PIXEL_MEANS = np.array([[[102.9801, 115.9465, 122.7717]]])
 
+# Ship the images from the data loader as raw uint8 BGR (h, w, 3), 4 times smaller than the float blob,
+# and normalise them (and resize the test images) on the device with blob.blob_from_uint8()
+__C.UINT8_BLOB = False
+
 # For reproducibility
 __C.RNG_SEED = 3
 
@@ -1,3 +1,4 @@
+import contextlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -173,23 +174,20 @@ def calculate_center(bb):
 
 
 def filter_object(obj_dets, hand_dets):
-    filtered_object = []
-    object_cc_list = []
-    for j in range(obj_dets.shape[0]):
-        object_cc_list.append(calculate_center(obj_dets[j, :4]))
-    object_cc_list = np.array(object_cc_list)
-    img_obj_id = []
-    for i in range(hand_dets.shape[0]):
-        if hand_dets[i, 5] <= 0:
-            img_obj_id.append(-1)
-            continue
-        hand_cc = np.array(calculate_center(hand_dets[i, :4]))
-        point_cc = np.array([(hand_cc[0] + hand_dets[i, 6] * 10000 * hand_dets[i, 7]),
-                             (hand_cc[1] + hand_dets[i, 6] * 10000 * hand_dets[i, 8])])
-        dist = np.sum((object_cc_list - point_cc) ** 2, axis=1)
-        dist_min = np.argmin(dist)
-        img_obj_id.append(dist_min)
-    return img_obj_id
+    """
+    match each in-contact hand to the object whose center is the nearest to (hand center + offset vector)
+    :param obj_dets: 2D array (num_obj, 10)
+    :param hand_dets: 2D array (num_hand, 10)
+    :return: list of matched object index for each hand, -1 for the hands not in contact
+    """
+    object_cc = (obj_dets[:, 0:2] + obj_dets[:, 2:4]) / 2    # (num_obj, 2)
+    hand_cc = (hand_dets[:, 0:2] + hand_dets[:, 2:4]) / 2    # (num_hand, 2)
+    point_cc = hand_cc + hand_dets[:, 6:7] * 10000 * hand_dets[:, 7:9]    # extended points (hand center + offset)
+
+    dist = np.sum((point_cc[:, None, :] - object_cc[None, :, :]) ** 2, axis=2)    # (num_hand, num_obj)
+    img_obj_id = np.argmin(dist, axis=1)
+    img_obj_id[hand_dets[:, 5] <= 0] = -1
+    return img_obj_id.tolist()
 
 
 def adjust_learning_rate(optimizer, decay=0.1):
@@ -198,12 +196,37 @@ def adjust_learning_rate(optimizer, decay=0.1):
         param_group['lr'] = decay * param_group['lr']
 
 
+def amp_autocast(enabled):
+    """
+    autocast context of the mixed-precision training
+    :param enabled: whether run the forward in fp16 (--amp), otherwise the context does nothing
+    :return: torch.autocast('cuda') (torch >= 1.10), torch.cuda.amp.autocast() (torch 1.6 - 1.9),
+             or a null context when disabled or torch has no AMP
+    """
+    if not enabled or not hasattr(torch.cuda, 'amp'):
+        return contextlib.nullcontext()
+    if hasattr(torch, 'autocast'):
+        return torch.autocast('cuda')
+    return torch.cuda.amp.autocast()
+
+
+def amp_grad_scaler(enabled):
+    """
+    :param enabled: whether scale the loss (--amp), a disabled scaler passes the loss and the steps through
+    :return: GradScaler, torch.amp.GradScaler('cuda') (torch >= 2.3) or torch.cuda.amp.GradScaler (torch 1.6 - 2.2)
+    """
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler('cuda', enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
 def save_checkpoint(state, filename):
     torch.save(state, filename)
 
 
 def _smooth_l1_loss(bbox_pred, bbox_targets, bbox_inside_weights, bbox_outside_weights, sigma=1.0, dim=[1]):
     sigma_2 = sigma ** 2
+    bbox_pred = bbox_pred.float()    # fp32 under autocast (mixed-precision training), the squares overflow in fp16
     box_diff = bbox_pred - bbox_targets
     in_box_diff = bbox_inside_weights * box_diff
     abs_in_box_diff = torch.abs(in_box_diff)
@@ -0,0 +1,121 @@
+"""Aspect-ratio bucketed training batches, padded together into one buffer by the collate function."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import torch
+from torch.utils.data.sampler import Sampler
+
+from model.utils.blob import PIXEL_PAD_UINT8
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler for roibatchLoader(..., pad_in_collate=True): the images are grouped into num_buckets buckets of
+    similar aspect ratio, and every batch is drawn from a single bucket, so that padding the images of a batch to
+    the largest one wastes little. The buckets and the batches are reshuffled at every epoch.
+    """
+
+    def __init__(self, ratio_list, batch_size, num_buckets=8, drop_last=False):
+        """
+        :param ratio_list: 1D array [ratio1, ratio2,...], width / height of all images from small to large,
+                           the sampled indices are positions in it (as roibatchLoader expects)
+        :param batch_size: an int, (1 / 2 / 4 / 8 ...)
+        :param num_buckets: number of buckets, evenly spaced in log(ratio) between the smallest and largest ratio;
+                            more buckets waste less padding but leave more incomplete batches
+        :param drop_last: whether drop the incomplete last batch of each bucket
+        """
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+
+        log_ratio = np.log(np.asarray(ratio_list, dtype=np.float64))
+        edges = np.linspace(log_ratio.min(), log_ratio.max(), num_buckets + 1)[1:-1]
+        bucket_ids = np.digitize(log_ratio, edges)
+        self.buckets = [torch.from_numpy(np.where(bucket_ids == b)[0]) for b in range(num_buckets)]
+        self.buckets = [bucket for bucket in self.buckets if bucket.numel() > 0]
+
+
+    def __iter__(self):
+        batches = []
+        for bucket in self.buckets:
+            perm = bucket[torch.randperm(bucket.numel())]
+            for start in range(0, perm.numel(), self.batch_size):
+                batch = perm[start:start + self.batch_size]
+                if batch.numel() == self.batch_size or not self.drop_last:
+                    batches.append(batch.tolist())
+
+        for i in torch.randperm(len(batches)).tolist():
+            yield batches[i]
+
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(bucket.numel() // self.batch_size for bucket in self.buckets)
+        return sum((bucket.numel() + self.batch_size - 1) // self.batch_size for bucket in self.buckets)
+
+
+class PadCollate(object):
+    """
+    collate_fn for roibatchLoader(..., pad_in_collate=True): the images of a batch are copied into one
+    zero-padded buffer of the largest height and width, in a single pass
+    the uint8 images of cfg.UINT8_BLOB (h, w, 3) are padded with the mean pixel, like roibatchLoader does
+    """
+
+    def __init__(self, pin_memory=False):
+        """
+        :param pin_memory: allocate the buffer in pinned memory, only when collating in the main process
+                           (num_workers=0), the DataLoader pins the batches of the workers itself
+        """
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+
+    def __call__(self, batch):
+        """
+        :param batch: list of (data (3, h, w), im_info (3), gt_boxes (20, 5), num_boxes, box_info (20, 5))
+        :return: data: 4D tensor (batch, 3, h_max, w_max), or uint8 (batch, h_max, w_max, 3)
+                 im_info: 2D tensor (batch, 3), each row is [h_max, w_max, scale_factor]
+                 gt_boxes: 3D tensor (batch, 20, 5)
+                 num_boxes: 1D tensor (batch)
+                 box_info: 3D tensor (batch, 20, 5)
+                 im_sizes: 2D long tensor (batch, 2), each row is the [h, w] of the image before padding
+        """
+        if batch[0][0].dtype == torch.uint8:
+            im_sizes = torch.LongTensor([[item[0].size(0), item[0].size(1)] for item in batch])
+            height, width = im_sizes.max(0)[0].tolist()
+            data = torch.empty(len(batch), height, width, 3, dtype=torch.uint8, pin_memory=self.pin_memory)
+            pad = torch.ByteTensor(PIXEL_PAD_UINT8)
+            for i, item in enumerate(batch):
+                h, w = item[0].size(0), item[0].size(1)
+                data[i, :h, :w] = item[0]
+                data[i, h:, :] = pad
+                data[i, :h, w:] = pad
+        else:
+            im_sizes = torch.LongTensor([[item[0].size(1), item[0].size(2)] for item in batch])
+            height, width = im_sizes.max(0)[0].tolist()
+            data = torch.empty(len(batch), 3, height, width, pin_memory=self.pin_memory)
+            for i, item in enumerate(batch):
+                h, w = item[0].size(1), item[0].size(2)
+                data[i, :, :h, :w] = item[0]
+                data[i, :, h:, :] = 0
+                data[i, :, :h, w:] = 0
+
+        # the images are padded at the bottom and the right, the padded size is the image size for the RPN
+        im_info = torch.stack([item[1] for item in batch])
+        im_info[:, 0] = height
+        im_info[:, 1] = width
+        gt_boxes = torch.stack([item[2] for item in batch])
+        num_boxes = torch.LongTensor([item[3] for item in batch])
+        box_info = torch.stack([item[4] for item in batch])
+        return data, im_info, gt_boxes, num_boxes, box_info, im_sizes
+
+
+def padding_waste(im_sizes, im_info):
+    """
+    fraction of the pixels of a batch which are padding
+    :param im_sizes: 2D tensor (batch, 2), each row is the [h, w] of an image before padding
+    :param im_info: 2D tensor (batch, 3) of PadCollate, each row is [h_max, w_max, scale_factor]
+    :return: a float in [0, 1)
+    """
+    image_pixels = float((im_sizes[:, 0] * im_sizes[:, 1]).sum())
+    return 1. - image_pixels / float(im_sizes.size(0) * im_info[0, 0] * im_info[0, 1])
@@ -0,0 +1,144 @@
+"""Memory-mapped store of training images which are already resized, so that epochs skip JPEG decoding and resizing."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle
+import time
+import numpy as np
+import cv2
+from multiprocessing import Pool
+
+
+# layout of a store directory:
+#     index.pkl: {'target_size': 600, 'paths': [image paths], 'entries': 2D array (num_images, 4), 'scales': 1D array}
+#                each row of entries is [shard, offset, height, width] of a resized image
+#     shard_00000.bin, shard_00001.bin, ...: the resized BGR images, uint8 (height, width, 3) one after another
+INDEX_FILE = 'index.pkl'
+SHARD_FILE = 'shard_{:05d}.bin'
+
+
+def resize_for_store(image_path, target_size):
+    """
+    load an image and resize its shortest side to target_size, as prep_im_for_blob() does
+    :param image_path: path of the image
+    :param target_size: 600
+    :return: resized BGR image, uint8 array (h, w, 3), and the scale factor
+    """
+    im = cv2.imread(image_path)
+    if im is None:
+        raise IOError('cannot read image {}'.format(image_path))
+    im_scale = float(target_size) / float(np.min(im.shape[0:2]))
+    im = cv2.resize(im, None, None, fx=im_scale, fy=im_scale, interpolation=cv2.INTER_LINEAR)
+    return im, im_scale
+
+
+def _resize_worker(args):
+    return resize_for_store(*args)
+
+
+def pack_image_store(image_paths, store_dir, target_size, num_workers=8, shard_size=4 << 30):
+    """
+    decode and resize all images once and write them into the memory-mapped shards of a new store
+    :param image_paths: list of image paths
+    :param store_dir: output directory
+    :param target_size: size of the shortest side of the stored images, TRAIN.SCALES[0]
+    :param num_workers: number of processes decoding the images
+    :param shard_size: a new shard is started when the current one is larger than shard_size bytes
+    :return: ImageStore
+    """
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    start = time.time()
+    entries = np.zeros((len(image_paths), 4), dtype=np.int64)
+    scales = np.zeros(len(image_paths), dtype=np.float64)
+    shard, offset = 0, 0
+    fid = open(os.path.join(store_dir, SHARD_FILE.format(shard)), 'wb')
+    pool = Pool(num_workers) if num_workers > 0 else None
+    try:
+        jobs = [(path, target_size) for path in image_paths]
+        results = pool.imap(_resize_worker, jobs, chunksize=16) if pool is not None else map(_resize_worker, jobs)
+        for i, (im, im_scale) in enumerate(results):
+            if offset > 0 and offset + im.nbytes > shard_size:
+                fid.close()
+                shard, offset = shard + 1, 0
+                fid = open(os.path.join(store_dir, SHARD_FILE.format(shard)), 'wb')
+            fid.write(np.ascontiguousarray(im).tobytes())
+            entries[i] = [shard, offset, im.shape[0], im.shape[1]]
+            scales[i] = im_scale
+            offset += im.nbytes
+            if (i + 1) % 1000 == 0:
+                print('packed {:d}/{:d} images, {:.1f}s'.format(i + 1, len(image_paths), time.time() - start))
+    finally:
+        fid.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # the index is written last, a store without it is incomplete
+    with open(os.path.join(store_dir, INDEX_FILE), 'wb') as f:
+        pickle.dump({'target_size': target_size, 'paths': list(image_paths), 'entries': entries, 'scales': scales},
+                    f, pickle.HIGHEST_PROTOCOL)
+    print('packed {:d} images into {:d} shards in {:.1f}s'.format(len(image_paths), shard + 1, time.time() - start))
+
+    return ImageStore(store_dir)
+
+
+class ImageStore(object):
+    """
+    read-only access to a store written by pack_image_store(),
+    the shards are memory-mapped on first use so that each DataLoader worker maps its own copy
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, INDEX_FILE), 'rb') as f:
+            index = pickle.load(f)
+        self.store_dir = store_dir
+        self.target_size = index['target_size']
+        self.entries = index['entries']
+        self.scales = index['scales']
+        self.lookup = {path: i for i, path in enumerate(index['paths'])}
+        self._shards = {}
+
+
+    def __len__(self):
+        return len(self.lookup)
+
+
+    def __contains__(self, image_path):
+        return image_path in self.lookup
+
+
+    def get(self, image_path, flipped=False):
+        """
+        :param image_path: path of the original image
+        :param flipped: whether the image is horizontally flipped
+        :return: resized BGR image, read-only uint8 view (h, w, 3) of the shard, and the scale factor
+        """
+        i = self.lookup[image_path]
+        shard, offset, height, width = self.entries[i]
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(os.path.join(self.store_dir, SHARD_FILE.format(shard)),
+                                            dtype=np.uint8, mode='r')
+        im = self._shards[shard][offset:offset + height * width * 3].reshape(height, width, 3)
+        if flipped:
+            im = im[:, ::-1, :]
+        return im, self.scales[i]
+
+
+_stores = {}
+
+
+def get_image_store(store_dir):
+    """
+    the ImageStore of a directory, opened once per process
+    :param store_dir: directory of the store, '' for none
+    :return: ImageStore or None
+    """
+    if not store_dir:
+        return None
+    if store_dir not in _stores:
+        _stores[store_dir] = ImageStore(store_dir)
+    return _stores[store_dir]
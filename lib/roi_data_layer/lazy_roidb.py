@@ -0,0 +1,130 @@
+"""A roidb which keeps the annotations as columns and builds the entry of an image when it is read."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from datasets.annotation_store import roidb_entry
+from datasets.imdb import flip_roidb_entry
+
+
+class LazyRoidb(object):
+    """
+    read-only list of the roidb entries of one or more image sets, backed by their annotation stores
+    the images are rows of small arrays (source image set, image of the set, flipped, width, height, need_crop), so
+    flipping, filtering and combining image sets only concatenate or select rows, and the DataLoader workers share
+    the arrays instead of a list of dicts
+    roidb[i] is the same dict as the eager roidb of combined_roidb() holds
+    """
+
+    def __init__(self, sources, source, image, flipped, img_id, width, height):
+        """
+        :param sources: list of (columns, offsets, image_paths, num_classes, hand_class) of the image sets,
+                        columns is AnnotationStore.roidb_columns()
+        :param source: 1D array, image set of each entry
+        :param image: 1D array, index of each entry in its image set
+        :param flipped: 1D bool array
+        :param img_id: 1D array
+        :param width, height: 1D arrays, image size of each entry
+        """
+        self.sources = sources
+        self.source = np.asarray(source, dtype=np.int32)
+        self.image = np.asarray(image, dtype=np.int64)
+        self.flipped = np.asarray(flipped, dtype=bool)
+        self.img_id = np.asarray(img_id, dtype=np.int64)
+        self.width = np.asarray(width, dtype=np.int32)
+        self.height = np.asarray(height, dtype=np.int32)
+        self.need_crop = np.zeros(len(self.image), dtype=np.int32)    # set by rank_roidb_ratio()
+
+
+    @classmethod
+    def from_imdb(cls, imdb):
+        """
+        :param imdb: a pascal_voc() instance, with its annotation store
+        :return: LazyRoidb of the images of imdb, not flipped
+        """
+        store = imdb.annotation_store()
+        num_images = imdb.num_images
+        image_paths = np.array([imdb.image_path_at(i) for i in range(num_images)], dtype=np.str_)
+        sizes = imdb.image_sizes()
+        source = (store.roidb_columns(imdb._class_to_ind), np.asarray(store.offsets), image_paths, imdb.num_classes,
+                  imdb.hand_class())
+        return cls([source], np.zeros(num_images), np.arange(num_images), np.zeros(num_images),
+                   [imdb.image_id_at(i) for i in range(num_images)], sizes[:, 0], sizes[:, 1])
+
+
+    def __len__(self):
+        return len(self.image)
+
+
+    def __getitem__(self, i):
+        """
+        :param i: index of an entry
+        :return: the roidb entry of the image, e.g. the dict at the top of roidb.py
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('roidb index out of range')
+        columns, offsets, image_paths, num_classes, hand_class = self.sources[self.source[i]]
+        k = self.image[i]
+        entry = roidb_entry(columns, offsets[k], offsets[k + 1], num_classes)
+
+        width = int(self.width[i])
+        if self.flipped[i]:
+            entry = flip_roidb_entry(entry, width, hand_class)
+
+        gt_overlaps = entry['gt_overlaps'].toarray()
+        entry.update({'img_id': int(self.img_id[i]),
+                      'image': str(image_paths[k]),
+                      'width': width,
+                      'height': int(self.height[i]),
+                      'max_classes': gt_overlaps.argmax(axis=1),
+                      'max_overlaps': gt_overlaps.max(axis=1),
+                      'need_crop': int(self.need_crop[i])})
+        return entry
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def num_boxes(self):
+        """ :return: 1D array, number of gt boxes of each entry """
+        counts = [np.diff(offsets) for _, offsets, _, _, _ in self.sources]
+        first = np.cumsum([0] + [len(c) for c in counts])    # first row of each image set in the concatenation
+        return np.concatenate(counts)[first[self.source] + self.image]
+
+
+    def _rows(self):
+        return [self.source, self.image, self.flipped, self.img_id, self.width, self.height, self.need_crop]
+
+
+    def _set_rows(self, rows):
+        self.source, self.image, self.flipped, self.img_id, self.width, self.height, self.need_crop = rows
+
+
+    def append_flipped(self):
+        """ append the horizontally flipped copy of every entry, the same as imdb.append_flipped_images() """
+        rows = self._rows()
+        rows[2] = np.ones(len(self), dtype=bool)
+        rows[3] = self.img_id + len(self)    # the image_id_at() of the doubled image index
+        self._set_rows([np.concatenate([a, b]) for a, b in zip(self._rows(), rows)])
+
+
+    def select(self, keep):
+        """
+        keep only some entries, in place
+        :param keep: 1D bool array or indices
+        """
+        self._set_rows([rows[keep] for rows in self._rows()])
+
+
+    def extend(self, other):
+        """ append the entries of another LazyRoidb, like list.extend() """
+        rows = other._rows()
+        rows[0] = other.source + len(self.sources)
+        self.sources = self.sources + other.sources
+        self._set_rows([np.concatenate([a, b]) for a, b in zip(self._rows(), rows)])
@@ -15,16 +15,19 @@ import numpy as np
 import numpy.random as npr
 # from scipy.misc import imread
 from model.utils.config import cfg
-from model.utils.blob import prep_im_for_blob, im_list_to_blob
+from model.utils.blob import prep_im_for_blob, im_list_to_blob, normalize_im_for_blob, blob_size
+from roi_data_layer.image_store import get_image_store
 
 
-def get_minibatch(roidb, num_classes):
+def get_minibatch(roidb, num_classes, resize=True):
     """
     Given a roidb, read the image and subtract pixel mean and resize to 600 (for both training and test)
+    with cfg.UINT8_BLOB, the image is left in uint8, and only resized if resize
     :param roidb: annotation list [{}] for one image, the {} contains all labels
     :param num_classes: 3
+    :param resize: False to leave the resize of the uint8 image to blob_from_uint8(), im_info is the resized size
     :return blobs, a dict contains infos of an image,
-            {'data': 4D array (1, 3, h, w),
+            {'data': 4D array (1, h, w, 3), float32 or uint8,
              'gt_boxes': 2D array [[x1, y1, x2, y2, cls], [], ...],
              'im_info':2D array [[h, w, scale_factor]],
              'img_id':xx,
@@ -37,7 +40,7 @@ def get_minibatch(roidb, num_classes):
 
     # load the image from local path, subtract pixel mean and resize the image
     # im_blob: an image 4D array(1, 3, h, w),  im_scales: a float number
-    im_blob, im_scales = _get_image_blob(roidb, random_scale_inds)
+    im_blob, im_scales, im_sizes = _get_image_blob(roidb, random_scale_inds, resize)
     blobs = {'data': im_blob}
 
     # only support batch_size = 1 ???????????????????????????????????????
@@ -56,7 +59,7 @@ def get_minibatch(roidb, num_classes):
     gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
     gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
     blobs['gt_boxes'] = gt_boxes
-    blobs['im_info'] = np.array([[im_blob.shape[1], im_blob.shape[2], im_scales[0]]], dtype=np.float32)
+    blobs['im_info'] = np.array([[im_sizes[0][0], im_sizes[0][1], im_scales[0]]], dtype=np.float32)
 
     # handinfo: 2D array [[contactstate, handside, magnitude, unitdx, unitdy], [], ...]
     handinfo = np.empty((len(gt_inds), 5), dtype=np.float32)
@@ -72,31 +75,52 @@ def get_minibatch(roidb, num_classes):
     return blobs
 
 
-def _get_image_blob(roidb, scale_inds):
+def _get_image_blob(roidb, scale_inds, resize=True):
     """
     load the image from local path, subtract pixel mean and resize the image
     :param roidb: annotation list [{}] for one image, the {} contains all labels
     :param scale_inds: [0]
-    :return blob: an image 4D array (1, 3, h, w)
+    :param resize: with cfg.UINT8_BLOB, whether resize the image
+    :return blob: an image 4D array (1, h, w, 3)
             im_scales: a float number
+            im_sizes: list of the (h, w) of the resized images
     """
     num_images = len(roidb)    # 1
     processed_ims = []
     im_scales = []
+    im_sizes = []
+    image_store = get_image_store(cfg.TRAIN.IMAGE_STORE)
 
     for i in range(num_images):
+        target_size = cfg.TRAIN.SCALES[scale_inds[i]]    # 600
+
+        # already resized image from the packed store, the flipped image is a view of the same pixels
+        if image_store is not None and image_store.target_size == target_size and roidb[i]['image'] in image_store:
+            im, im_scale = image_store.get(roidb[i]['image'], roidb[i]['flipped'])
+            im_scales.append(im_scale)
+            im_sizes.append(im.shape[0:2])
+            processed_ims.append(im if cfg.UINT8_BLOB else normalize_im_for_blob(im))
+            continue
+
         im = cv2.imread(roidb[i]['image'])
 
         if roidb[i]['flipped']:
             im = im[:, ::-1, :]
 
-        # subtract pixel mean and rescale the image by factor = 600/shortest side
-        target_size = cfg.TRAIN.SCALES[scale_inds[i]]    # 600
-        im, im_scale = prep_im_for_blob(im, cfg.PIXEL_MEANS, target_size, cfg.TRAIN.MAX_SIZE)
+        if cfg.UINT8_BLOB:
+            # the normalisation is done on the device, the uint8 resize is 4 times cheaper than the float one
+            size, im_scale = blob_size(im.shape, target_size)
+            if resize:
+                im = cv2.resize(im, (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+        else:
+            # subtract pixel mean and rescale the image by factor = 600/shortest side
+            im, im_scale = prep_im_for_blob(im, cfg.PIXEL_MEANS, target_size, cfg.TRAIN.MAX_SIZE)
+            size = im.shape[0:2]
         im_scales.append(im_scale)
+        im_sizes.append(size)
         processed_ims.append(im)
 
     # Create a blob to hold the input images
-    blob = im_list_to_blob(processed_ims)
+    blob = im_list_to_blob(processed_ims, np.uint8 if cfg.UINT8_BLOB else np.float32)
 
-    return blob, im_scales
+    return blob, im_scales, im_sizes
@@ -9,6 +9,7 @@ import torch.utils.data as data
 import torch
 
 from model.utils.config import cfg
+from model.utils.blob import PIXEL_PAD_UINT8
 from roi_data_layer.minibatch import get_minibatch
 from model.rpn.bbox_transform import bbox_transform_inv, clip_boxes
 import numpy as np
@@ -16,13 +17,16 @@ import numpy as np
 
 class roibatchLoader(data.Dataset):
     """Inherit torch.utils.data.Dataset class"""
-    def __init__(self, roidb, ratio_list, ratio_index, batch_size, num_classes, training=True, normalize=None):
+    def __init__(self, roidb, ratio_list, ratio_index, batch_size, num_classes, training=True, normalize=None,
+                 pad_in_collate=False):
         """
         :param roidb: labels list [{}, {}, ...], each element is a dict that contains all labels for one image
         :param ratio_list: 1D array [ratio1, ratio2,...], ratio order of all images from small to large
         :param ratio_index: 1D array [28854, 28853, 13412 ... 59868] shows the original index order before sorting
         :param batch_size: an int, (1 / 2 / 4 / 8 ...)
         :param num_classes: 3 ('__background__', 'targetobject', 'hand')
+        :param pad_in_collate: whether leave the padding to bucket_sampler.PadCollate, the images are then only
+                               cropped to their own (clamped) ratio and batched by bucket_sampler.BucketBatchSampler
         """
         self._roidb = roidb
         self._num_classes = num_classes
@@ -36,6 +40,7 @@ class roibatchLoader(data.Dataset):
         self.ratio_index = ratio_index
         self.batch_size = batch_size
         self.data_size = len(self.ratio_list)
+        self.pad_in_collate = pad_in_collate
 
         # given the ratio_list, we want to make the ratio same for each batch.
         self.ratio_list_batch = torch.Tensor(self.data_size).zero_()
@@ -58,12 +63,19 @@ class roibatchLoader(data.Dataset):
             self.ratio_list_batch[left_idx:(right_idx + 1)] = target_ratio
 
 
+    def _new_padding(self, height, width):
+        """ padded image (height, width, 3), zeros for the float blob, the mean pixel for the uint8 one """
+        if cfg.UINT8_BLOB:
+            return torch.ByteTensor(PIXEL_PAD_UINT8).repeat(height, width, 1)
+        return torch.FloatTensor(height, width, 3).zero_()
+
+
     def __getitem__(self, index):
         """
         Given an index of one image, take out corresponding dataset & labels
         subtract mean, rescale, crop, padding the image
         :param index: a number (23321 / 2134 / 455 / 1...)
-        :return data: image pixels, 4D tensor (1, 3, h, w)
+        :return data: image pixels, 3D tensor (3, h, w), or the uint8 (h, w, 3) with cfg.UINT8_BLOB
                 im_info: 2D tensor [[h, w, scale_factor]]
                 gt_boxes: 2D tensor [[x1, y1, x2, y2, cls], [], ...]
                 num_boxes:
@@ -89,9 +101,10 @@ class roibatchLoader(data.Dataset):
         #     'im_info':2D array [[h, w, scale_factor]],
         #     'img_id':xx,
         #     'box_info': 2D array [[contactstate, handside, magnitude, unitdx, unitdy], [], ...]]
-        blobs = get_minibatch(minibatch_db, self._num_classes)
+        # the uint8 test images are resized on the device
+        blobs = get_minibatch(minibatch_db, self._num_classes, resize=self.training)
 
-        data = torch.from_numpy(blobs['data'])    # 4D array (1, 3, h, w)
+        data = torch.from_numpy(blobs['data'])    # 4D array (1, h, w, 3)
         im_info = torch.from_numpy(blobs['im_info'])    # 2D array [[h, w, scale_factor]]
         data_height, data_width = data.size(1), data.size(2)
 
@@ -112,8 +125,11 @@ class roibatchLoader(data.Dataset):
             # get the index range
 
             # if the image need to crop, crop to the target size.
-            ratio = self.ratio_list_batch[index]
-            if self._roidb[index_ratio]['need_crop']:
+            if self.pad_in_collate:
+                ratio = float(self.ratio_list[index])
+            else:
+                ratio = self.ratio_list_batch[index]
+            if minibatch_db[0]['need_crop']:
                 if ratio < 1:
                     # if width < height, we need to crop the height
                     min_y = int(torch.min(gt_boxes[:, 1]))
@@ -184,21 +200,26 @@ class roibatchLoader(data.Dataset):
                     gt_boxes[:, 2].clamp_(0, trim_size - 1)
 
             # based on the width/height ratio, padding the image.
+            # the batch is padded at once by PadCollate
+            if self.pad_in_collate:
+                padding_data = data[0]
+                im_info[0, 0] = data.size(1)
+                im_info[0, 1] = data.size(2)
+
             # if width < height
-            if ratio < 1:
+            elif ratio < 1:
                 trim_size = int(np.floor(data_width / ratio))
-                padding_data = torch.FloatTensor(int(np.ceil(data_width / ratio)), data_width, 3).zero_()
+                padding_data = self._new_padding(int(np.ceil(data_width / ratio)), data_width)
                 padding_data[:data_height, :, :] = data[0]
                 im_info[0, 0] = padding_data.size(0)    # update im_info
 
             # if width > height
             elif ratio > 1:
-                padding_data = torch.FloatTensor(data_height, int(np.ceil(data_height * ratio)), 3).zero_()
+                padding_data = self._new_padding(data_height, int(np.ceil(data_height * ratio)))
                 padding_data[:, :data_width, :] = data[0]
                 im_info[0, 1] = padding_data.size(1)
             else:
                 trim_size = min(data_height, data_width)
-                padding_data = torch.FloatTensor(trim_size, trim_size, 3).zero_()
                 padding_data = data[0][:trim_size, :trim_size, :]
                 # gt_boxes.clamp_(0, trim_size)
                 gt_boxes[:, :4].clamp_(0, trim_size)
@@ -221,13 +242,19 @@ class roibatchLoader(data.Dataset):
             else:
                 num_boxes = 0
 
-            # permute trim_data to adapt to downstream processing
-            padding_data = padding_data.permute(2, 0, 1).contiguous()
+            # permute trim_data to adapt to downstream processing, the uint8 blob is permuted by blob_from_uint8()
+            if cfg.UINT8_BLOB:
+                padding_data = padding_data.contiguous()
+            else:
+                padding_data = padding_data.permute(2, 0, 1).contiguous()
             im_info = im_info.view(3)
             return padding_data, im_info, gt_boxes_padding, num_boxes, box_info_padding
 
         else:
-            data = data.permute(0, 3, 1, 2).contiguous().view(3, data_height, data_width)
+            if cfg.UINT8_BLOB:
+                data = data[0]
+            else:
+                data = data.permute(0, 3, 1, 2).contiguous().view(3, data_height, data_width)
             im_info = im_info.view(3)
             gt_boxes = torch.FloatTensor([1, 1, 1, 1, 1])
             box_info = torch.FloatTensor([1, 1, 1, 1, 1])
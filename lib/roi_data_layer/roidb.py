@@ -7,7 +7,7 @@ import datasets
 import numpy as np
 from model.utils.config import cfg
 from datasets.factory import get_imdb
-import PIL
+from roi_data_layer.lazy_roidb import LazyRoidb
 
 
 """one example of roidb (labels):"""
@@ -37,15 +37,14 @@ def prepare_roidb(imdb):
 
     roidb = imdb.roidb    # labels list [{}, {}, ...], each element is a dict that contains all labels for one image
     if not (imdb.name.startswith('coco')):
-        sizes = [PIL.Image.open(imdb.image_path_at(i)).size
-                 for i in range(imdb.num_images)]
+        sizes = imdb.image_sizes()    # [[width, height], ...], cached
 
     for i in range(len(imdb.image_index)):
         roidb[i]['img_id'] = imdb.image_id_at(i)
         roidb[i]['image'] = imdb.image_path_at(i)
         if not (imdb.name.startswith('coco')):
-            roidb[i]['width'] = sizes[i][0]
-            roidb[i]['height'] = sizes[i][1]
+            roidb[i]['width'] = int(sizes[i][0])
+            roidb[i]['height'] = int(sizes[i][1])
         # need gt_overlaps as a dense array for argmax
         gt_overlaps = roidb[i]['gt_overlaps'].toarray()
         # max overlap with gt over classes (columns)
@@ -75,26 +74,22 @@ def rank_roidb_ratio(roidb):
     ratio_large = 2  # largest ratio to preserve.
     ratio_small = 0.5  # smallest ratio to preserve.
 
-    ratio_list = []
-
-    # for each image, judge if it need crop
-    for i in range(len(roidb)):
-        width = roidb[i]['width']
-        height = roidb[i]['height']
-        ratio = width / float(height)
-
-        if ratio > ratio_large:
-            roidb[i]['need_crop'] = 1
-            ratio = ratio_large
-        elif ratio < ratio_small:
-            roidb[i]['need_crop'] = 1
-            ratio = ratio_small
-        else:
-            roidb[i]['need_crop'] = 0
-
-        ratio_list.append(ratio)
+    if isinstance(roidb, LazyRoidb):
+        width, height = roidb.width, roidb.height
+    else:
+        width = np.array([entry['width'] for entry in roidb], dtype=np.float64)
+        height = np.array([entry['height'] for entry in roidb], dtype=np.float64)
+    ratio_list = width / height.astype(np.float64)
+
+    # for each image, judge if it need crop, and clamp the ratio
+    need_crop = ((ratio_list > ratio_large) | (ratio_list < ratio_small)).astype(np.int32)
+    ratio_list = np.clip(ratio_list, ratio_small, ratio_large)
+    if isinstance(roidb, LazyRoidb):
+        roidb.need_crop = need_crop
+    else:
+        for entry, crop in zip(roidb, need_crop.tolist()):
+            entry['need_crop'] = crop
 
-    ratio_list = np.array(ratio_list)
     ratio_index = np.argsort(ratio_list)
     return ratio_list[ratio_index], ratio_index
 
@@ -105,12 +100,10 @@ def filter_roidb(roidb):
     """
 
     print('before filtering, there are %d images...' % (len(roidb)))
-    i = 0
-    while i < len(roidb):
-        if len(roidb[i]['boxes']) == 0:
-            del roidb[i]
-            i -= 1
-        i += 1
+    if isinstance(roidb, LazyRoidb):
+        roidb.select(roidb.num_boxes() > 0)
+    else:
+        roidb[:] = [entry for entry in roidb if len(entry['boxes']) > 0]
 
     print('after filtering, there are %d images...' % (len(roidb)))
     return roidb
@@ -129,8 +122,17 @@ def combined_roidb(imdb_names, training=True, leftright=False):
     def get_training_roidb(imdb, leftright=False):
         """
         :param imdb: a pascal_voc() instance
-        :return: labels list [{}, {}, ...], each element is a dict that contains all labels for one image
+        :return: labels list [{}, {}, ...], each element is a dict that contains all labels for one image,
+                 or a LazyRoidb with the same entries
         """
+        if cfg.TRAIN.LAZY_ROIDB and hasattr(imdb, 'annotation_store') and cfg.TRAIN.PROPOSAL_METHOD == 'gt':
+            print('Preparing lazy training data...')
+            roidb = LazyRoidb.from_imdb(imdb)
+            if cfg.TRAIN.USE_FLIPPED:
+                roidb.append_flipped()
+            print('done')
+            return roidb
+
         if cfg.TRAIN.USE_FLIPPED:
             if leftright:
                 print('Appending horizontally-flipped training examples...')
@@ -163,6 +165,8 @@ def combined_roidb(imdb_names, training=True, leftright=False):
 
 
     roidbs = [get_roidb(s) for s in imdb_names.split('+')]
+    if not all(isinstance(r, LazyRoidb) for r in roidbs):
+        roidbs = [list(r) for r in roidbs]    # an image set without annotation store, combine the lists
     roidb = roidbs[0]
 
     if len(roidbs) > 1:
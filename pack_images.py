@@ -0,0 +1,72 @@
+# --------------------------------------------------------
+# Pack the training images into a memory-mapped image store
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+Decode and resize the training images once, then train with
+    python trainval_net.py ... --image_store data/image_store/voc_2007_trainval_600
+"""
+
+import _init_paths
+import os
+import argparse
+import time
+
+from model.utils.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from roi_data_layer.image_store import pack_image_store
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Pack the training images into a memory-mapped image store')
+    parser.add_argument('--imdb', dest='imdb_name',
+                        help='dataset to pack',
+                        default='voc_2007_trainval', type=str)
+    parser.add_argument('--cfg', dest='cfg_file',
+                        help='optional config file',
+                        default=None, type=str)
+    parser.add_argument('--set', dest='set_cfgs',
+                        help='set config keys', default=None,
+                        nargs=argparse.REMAINDER)
+    parser.add_argument('--output', dest='output',
+                        help='directory of the image store, default is data/image_store/<imdb>_<scale>',
+                        default=None, type=str)
+    parser.add_argument('--nw', dest='num_workers',
+                        help='number of processes decoding the images',
+                        default=8, type=int)
+    parser.add_argument('--shard_gb', dest='shard_gb',
+                        help='maximum size of each shard in GB',
+                        default=4, type=float)
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print('Called with args:')
+    print(args)
+
+    if args.cfg_file is not None:
+        cfg_from_file(args.cfg_file)
+    if args.set_cfgs is not None:
+        cfg_from_list(args.set_cfgs)
+
+    target_size = cfg.TRAIN.SCALES[0]
+    output = args.output
+    if output is None:
+        output = os.path.join(cfg.DATA_DIR, 'image_store', '{}_{}'.format(args.imdb_name, target_size))
+
+    start = time.time()
+    image_paths = []
+    for imdb_name in args.imdb_name.split('+'):
+        imdb = get_imdb(imdb_name)
+        image_paths.extend(imdb.image_path_at(i) for i in range(imdb.num_images))
+    print('{:d} images to pack into {}'.format(len(image_paths), output))
+
+    pack_image_store(image_paths, output, target_size, args.num_workers, int(args.shard_gb * (1 << 30)))
+    print('done in {:.1f}s, train with --image_store {}'.format(time.time() - start, output))
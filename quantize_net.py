@@ -0,0 +1,181 @@
+# --------------------------------------------------------
+# Calibrate and evaluate the quantised CPU inference of a checkpoint
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+Calibrate the int8 backbone on the test split, then report the hand AP of the quantised network
+    python quantize_net.py --net res101 --checksession 1 --checkepoch 8 --checkpoint 89999 --mode static --compare
+The calibration is saved next to the checkpoint, then used by HandObjectDetector(..., quantize='static')
+"""
+
+import _init_paths
+import os
+import sys
+import argparse
+import time
+import numpy as np
+import torch
+
+from roi_data_layer.roidb import combined_roidb
+from roi_data_layer.roibatchLoader import roibatchLoader
+from model.utils.config import cfg, cfg_from_file, cfg_from_list
+from model.inference import HandObjectDetector
+from model.inference.quantization import QUANTIZE_MODES, prepare_static, save_calibration, convert_static, \
+    quantize_network
+
+
+def parse_args():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description='Calibrate and evaluate the quantised CPU inference')
+    parser.add_argument('--dataset', dest='dataset',
+                        help='test dataset',
+                        default='pascal_voc', type=str)
+    parser.add_argument('--net', dest='net',
+                        help='vgg16, res50, res101, res152',
+                        default='res101', type=str)
+    parser.add_argument('--set', dest='set_cfgs',
+                        help='set config keys', default=None,
+                        nargs=argparse.REMAINDER)
+    parser.add_argument('--load_dir', dest='load_dir',
+                        help='directory to load models',
+                        default="models", type=str)
+    parser.add_argument('--model_name',
+                        help='directory to save models', default='handobj_100K',
+                        required=False, type=str)
+    parser.add_argument('--ls', dest='large_scale',
+                        help='whether use large imag scale',
+                        action='store_true')
+    parser.add_argument('--cag', dest='class_agnostic',
+                        help='whether perform class_agnostic bbox regression',
+                        action='store_true')
+    parser.add_argument('--checksession', dest='checksession',
+                        help='checksession to load model',
+                        default=1, type=int)
+    parser.add_argument('--checkepoch', dest='checkepoch',
+                        help='checkepoch to load network',
+                        default=8, type=int)
+    parser.add_argument('--checkpoint', dest='checkpoint',
+                        help='checkpoint to load network',
+                        default=89999, type=int)
+    parser.add_argument('--mode', dest='mode',
+                        help='quantisation mode: ' + ', '.join(QUANTIZE_MODES),
+                        default='static', choices=QUANTIZE_MODES)
+    parser.add_argument('--num_calib', dest='num_calib',
+                        help='number of test images to calibrate the static quantisation on',
+                        default=200, type=int)
+    parser.add_argument('--compare', dest='compare',
+                        help='also evaluate the float network',
+                        action='store_true')
+    parser.add_argument('--no_eval', dest='no_eval',
+                        help='only calibrate',
+                        action='store_true')
+    parser.add_argument('--threads', dest='threads',
+                        help='number of CPU threads, default is torch.get_num_threads()',
+                        default=0, type=int)
+    parser.add_argument('--thresh_hand',
+                        type=float, default=0.1,
+                        required=False)
+    parser.add_argument('--thresh_obj', default=0.1,
+                        type=float,
+                        required=False)
+
+    args = parser.parse_args()
+    return args
+
+
+def test_loader(roidb, ratio_list, ratio_index, num_classes):
+    dataset = roibatchLoader(roidb, ratio_list, ratio_index, 1, num_classes, training=False, normalize=False)
+    return torch.utils.data.DataLoader(dataset, batch_size=1, shuffle=False, num_workers=0)
+
+
+def detect_all(detector, imdb, dataloader, max_per_image=100):
+    """
+    detections of all test images, assembled by HandObjectDetector.image_boxes like test_net.py
+    :return: all_boxes, 2D list, 3 rows, num_images columns, each element is a 2D array (num_bbox, 11),
+             and the mean detection time
+    """
+    all_boxes = [[[] for _ in range(imdb.num_images)] for _ in range(imdb.num_classes)]
+    detect_time = 0.
+    for i, data in enumerate(dataloader):
+        tic = time.time()
+        detections = detector.detect_blob(data[0], data[1])[0]
+        detect_time += time.time() - tic
+
+        for j, cls_boxes in enumerate(detector.image_boxes(detections, max_per_image)):
+            all_boxes[j][i] = cls_boxes
+
+        sys.stdout.write('im_detect: {:d}/{:d} {:.3f}s   \r'.format(i + 1, imdb.num_images, detect_time / (i + 1)))
+        sys.stdout.flush()
+
+    return all_boxes, detect_time / max(imdb.num_images, 1)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print('Called with args:')
+    print(args)
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    np.random.seed(cfg.RNG_SEED)
+    if args.dataset == "pascal_voc":
+        args.imdbval_name = "voc_2007_test"
+        args.set_cfgs = ['ANCHOR_SCALES', '[8, 16, 32, 64]', 'ANCHOR_RATIOS', '[0.5,1,2]']
+    cfg_from_file("cfgs/{}_ls.yml".format(args.net) if args.large_scale else "cfgs/{}.yml".format(args.net))
+    if args.set_cfgs is not None:
+        cfg_from_list(args.set_cfgs)
+
+    cfg.TRAIN.USE_FLIPPED = False
+    imdb, roidb, ratio_list, ratio_index = combined_roidb(args.imdbval_name, False)
+    imdb.competition_mode(on=True)
+
+    input_dir = args.load_dir + "/" + args.net + "_" + args.model_name + "/" + args.dataset
+    if not os.path.exists(input_dir):
+        raise Exception('There is no input directory for loading network from ' + input_dir)
+    load_name = os.path.join(input_dir,
+                             'faster_rcnn_{}_{}_{}.pth'.format(args.checksession, args.checkepoch, args.checkpoint))
+
+    # 1. calibrate the activation ranges of the backbone on the first test images
+    if args.mode == 'static':
+        detector = HandObjectDetector(load_name, args.net, imdb.classes, args.class_agnostic, cuda=False,
+                                      thresh_hand=args.thresh_hand, thresh_obj=args.thresh_obj)
+        prepare_static(detector.fasterRCNN)
+        start = time.time()
+        num_calib = 0
+        for data in test_loader(roidb, ratio_list, ratio_index, imdb.num_classes):
+            if num_calib == args.num_calib:
+                break
+            detector.predict(data[0], data[1])
+            num_calib += 1
+        print('calibrated on {:d} images in {:.1f}s'.format(num_calib, time.time() - start))
+        save_calibration(detector.fasterRCNN, load_name, num_calib)
+        convert_static(detector.fasterRCNN)
+        quantize_network(detector.fasterRCNN, 'dynamic')
+    else:
+        detector = HandObjectDetector(load_name, args.net, imdb.classes, args.class_agnostic, cuda=False,
+                                      thresh_hand=args.thresh_hand, thresh_obj=args.thresh_obj, quantize=args.mode)
+    if args.no_eval:
+        sys.exit(0)
+
+    # 2. hand AP under every constraint of voc_eval_hand
+    detectors = [(args.mode, detector)]
+    if args.compare:
+        detectors.insert(0, ('float', HandObjectDetector(load_name, args.net, imdb.classes, args.class_agnostic,
+                                                         cuda=False, thresh_hand=args.thresh_hand,
+                                                         thresh_obj=args.thresh_obj)))
+    results = []
+    for name, det in detectors:
+        all_boxes, detect_time = detect_all(det, imdb, test_loader(roidb, ratio_list, ratio_index, imdb.num_classes))
+        results.append((name, detect_time, imdb.evaluate_hand(all_boxes)))
+
+    constraints = list(results[0][2].keys())
+    print('\n{:>10s} {:>10s} '.format('network', 's/image') +
+          ' '.join('{:>10s}'.format(c or 'hand') for c in constraints))
+    for name, detect_time, aps in results:
+        print('{:>10s} {:>10.3f} '.format(name, detect_time) + ' '.join('{:>10.4f}'.format(aps[c]) for c in constraints))
+    if args.compare:
+        print('{:>10s} {:>10s} '.format('delta', '') +
+              ' '.join('{:>+10.4f}'.format(results[1][2][c] - results[0][2][c]) for c in constraints))
@@ -21,13 +21,9 @@ import pickle
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
-from model.rpn.bbox_transform import clip_boxes
-# from model.nms.nms_wrapper import nms
-from model.roi_layers import nms
-from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import save_net, load_net, vis_detections, vis_detections_filtered_objects_PIL
-from model.faster_rcnn.vgg16 import vgg16
-from model.faster_rcnn.resnet import resnet
+from model.utils.blob import blob_from_uint8
+from model.inference import HandObjectDetector
 
 try:
     xrange  # Python 2
@@ -95,6 +91,9 @@ def parse_args():
     parser.add_argument('--thresh_obj', default=0.1,
                         type=float,
                         required=False)
+    parser.add_argument('--uint8', dest='uint8_blob',
+                        help='load the images as uint8, normalise and resize them on the device (cfg.UINT8_BLOB)',
+                        action='store_true')
 
     args = parser.parse_args()
     return args
@@ -124,6 +123,8 @@ if __name__ == '__main__':
         cfg_from_file(args.cfg_file)
     if args.set_cfgs is not None:
         cfg_from_list(args.set_cfgs)
+    if args.uint8_blob:
+        cfg.UINT8_BLOB = True
 
     print('Using config:')
     pprint.pprint(cfg)
@@ -142,55 +143,11 @@ if __name__ == '__main__':
                              'faster_rcnn_{}_{}_{}.pth'.format(args.checksession, args.checkepoch, args.checkpoint))
     print(f'\n ---------> which model = {load_name}\n')
 
-    # initialize the network here.
-    if args.net == 'vgg16':
-        fasterRCNN = vgg16(imdb.classes, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res101':
-        fasterRCNN = resnet(imdb.classes, 101, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res50':
-        fasterRCNN = resnet(imdb.classes, 50, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res152':
-        fasterRCNN = resnet(imdb.classes, 152, pretrained=False, class_agnostic=args.class_agnostic)
-    else:
-        print("network is not defined")
-        pdb.set_trace()
-
-    fasterRCNN.create_architecture()
-
-    print("load checkpoint %s" % (load_name))
-    checkpoint = torch.load(load_name)
-    fasterRCNN.load_state_dict(checkpoint['model'])
-    if 'pooling_mode' in checkpoint.keys():
-        cfg.POOLING_MODE = checkpoint['pooling_mode']
-
-    print('load model successfully!')
-    # initilize the tensor holder here.
-    im_data = torch.FloatTensor(1)
-    im_info = torch.FloatTensor(1)
-    num_boxes = torch.LongTensor(1)
-    gt_boxes = torch.FloatTensor(1)
-    box_info = torch.FloatTensor(1)
-
     pascal_classes = np.asarray(['__background__', 'targetobject', 'hand'])
 
-    # ship to cuda
-    if args.cuda:
-        im_data = im_data.cuda()
-        im_info = im_info.cuda()
-        num_boxes = num_boxes.cuda()
-        gt_boxes = gt_boxes.cuda()
-
-    # make variable
-    im_data = Variable(im_data)
-    im_info = Variable(im_info)
-    num_boxes = Variable(num_boxes)
-    gt_boxes = Variable(gt_boxes)
-
-    if args.cuda:
-        cfg.CUDA = True
-
-    if args.cuda:
-        fasterRCNN.cuda()
+    # initialize the network and the tensor holders here.
+    detector = HandObjectDetector(load_name, args.net, imdb.classes, args.class_agnostic, cuda=args.cuda,
+                                  thresh_hand=args.thresh_hand, thresh_obj=args.thresh_obj)
 
     start = time.time()
     max_per_image = 100
@@ -217,107 +174,24 @@ if __name__ == '__main__':
     _t = {'im_detect': time.time(), 'misc': time.time()}
     det_file = os.path.join(output_dir, 'detections.pkl')
 
-    fasterRCNN.eval()
-    empty_array = np.transpose(np.array([[], [], [], [], []]), (1, 0))
     for i in range(num_images):
 
         data = next(data_iter)
-        with torch.no_grad():
-            im_data.resize_(data[0].size()).copy_(data[0])
-            im_info.resize_(data[1].size()).copy_(data[1])
-            gt_boxes.resize_(data[2].size()).copy_(data[2])
-            num_boxes.resize_(data[3].size()).copy_(data[3])
-            box_info.resize_(data[4].size()).copy_(data[4])
 
         det_tic = time.time()
-        rois, cls_prob, bbox_pred, \
-        rpn_loss_cls, rpn_loss_box, \
-        RCNN_loss_cls, RCNN_loss_bbox, \
-        rois_label, loss_list = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, box_info)
-
-        scores = cls_prob.data
-        boxes = rois.data[:, :, 1:5]
-        hand_contacts = loss_list[0][0]
-        hand_vector = loss_list[1][0].detach()
-        lr_vector = loss_list[2][0].detach()
-
-        ##### hand contact ########
-        maxs, indices = torch.max(hand_contacts, 2)
-        indices = indices.squeeze(0).unsqueeze(-1).float()
-        nc_prob = F.softmax(hand_contacts[:, :, 0].squeeze(0).unsqueeze(-1).float().detach())
-        # print(hand_contacts.shape)
-        ###########################
-        lr = F.sigmoid(lr_vector) > 0.5
-        lr = lr.squeeze(0).float()
-
-        if cfg.TEST.BBOX_REG:
-            # Apply bounding-box regression deltas
-            box_deltas = bbox_pred.data
-            if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
-                # Optionally normalize targets by a precomputed mean and stdev
-                if args.class_agnostic:
-                    box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                                 + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                    box_deltas = box_deltas.view(1, -1, 4)
-                else:
-                    box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda() \
-                                 + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                    box_deltas = box_deltas.view(1, -1, 4 * len(imdb.classes))
-
-            pred_boxes = bbox_transform_inv(boxes, box_deltas, 1)
-            pred_boxes = clip_boxes(pred_boxes, im_info.data, 1)
-        else:
-            # Simply repeat the boxes, once for each class
-            pred_boxes = np.tile(boxes, (1, scores.shape[1]))
-
-        pred_boxes /= data[1][0][2].item()
-
-        scores = scores.squeeze()
-        pred_boxes = pred_boxes.squeeze()
+        im_data = data[0]
+        if cfg.UINT8_BLOB:
+            # the raw image, normalised and resized to im_info on the device of the network
+            im_data = blob_from_uint8(data[0].to(detector.im_data.device, non_blocking=True), data[1][0, :2])
+        detections = detector.detect_blob(im_data, data[1])[0]
         det_toc = time.time()
         detect_time = det_toc - det_tic
         misc_tic = time.time()
         if args.vis:
             im = cv2.imread(imdb.image_path_at(i))
-            im2show = np.copy(im)
-        for j in xrange(1, imdb.num_classes):
-
-            # inds = torch.nonzero(cls_scores[:,j]>thresh).view(-1)
-            if pascal_classes[j] == 'hand':
-                inds = torch.nonzero(scores[:, j] > args.thresh_hand).view(-1)
-            elif pascal_classes[j] == 'targetobject':
-                inds = torch.nonzero(scores[:, j] > args.thresh_obj).view(-1)
-            else:
-                inds = torch.nonzero(scores[:, j] > args.thresh_obj).view(-1)
-
-            # if there is det
-            if inds.numel() > 0:
-                cls_scores = scores[:, j][inds]
-                _, order = torch.sort(cls_scores, 0, True)
-                if args.class_agnostic:
-                    cls_boxes = pred_boxes[inds, :]
-                else:
-                    cls_boxes = pred_boxes[inds][:, j * 4:(j + 1) * 4]
-                cls_dets = torch.cat((cls_boxes, cls_scores.unsqueeze(1), indices[inds, :],
-                                      hand_vector.squeeze(0)[inds, :], lr[inds, :], nc_prob[inds, :]), 1)
-                cls_dets = cls_dets[order]
-                keep = nms(cls_boxes[order, :], cls_scores[order], cfg.TEST.NMS)
-                cls_dets = cls_dets[keep.view(-1).long()]
-                if args.vis:
-                    im2show = vis_detections_filtered_objects_PIL(im2show, imdb.classes[j], cls_dets.cpu().numpy(), 0.1)
-                all_boxes[j][i] = cls_dets.cpu().numpy()
-            else:
-                all_boxes[j][i] = empty_array
-
-        # Limit to max_per_image detections *over all classes*
-        if max_per_image > 0:
-            image_scores = np.hstack([all_boxes[j][i][:, 4]
-                                      for j in xrange(1, imdb.num_classes)])
-            if len(image_scores) > max_per_image:
-                image_thresh = np.sort(image_scores)[-max_per_image]
-                for j in xrange(1, imdb.num_classes):
-                    keep = np.where(all_boxes[j][i][:, 4] >= image_thresh)[0]
-                    all_boxes[j][i] = all_boxes[j][i][keep, :]
+            im2show = vis_detections_filtered_objects_PIL(np.copy(im), detections.obj_dets, detections.hand_dets, args.thresh_hand, args.thresh_obj)
+        for j, cls_boxes in enumerate(detector.image_boxes(detections, max_per_image)):
+            all_boxes[j][i] = cls_boxes
 
         misc_toc = time.time()
         nms_time = misc_toc - misc_tic
@@ -21,13 +21,8 @@ import pickle
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
-from model.rpn.bbox_transform import clip_boxes
-# from model.nms.nms_wrapper import nms
-from model.roi_layers import nms
-from model.rpn.bbox_transform import bbox_transform_inv
 from model.utils.net_utils import save_net, load_net, vis_detections, vis_detections_filtered_objects_PIL
-from model.faster_rcnn.vgg16 import vgg16
-from model.faster_rcnn.resnet import resnet
+from model.inference import HandObjectDetector
 
 
 def parse_args():
@@ -122,10 +117,6 @@ if __name__ == '__main__':
     print('Using config:')
     pprint.pprint(cfg)
 
-    # automatically choose GPU or not
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    cfg.USE_GPU_NMS = True if torch.cuda.is_available() else False
-
     # Load training data from local xml files
     cfg.TRAIN.USE_FLIPPED = False
     imdb, roidb, ratio_list, ratio_index = combined_roidb(args.imdbval_name, False)
@@ -139,43 +130,16 @@ if __name__ == '__main__':
     load_name = os.path.join(input_dir, 'faster_rcnn_{}_{}_{}.pth'.format(args.checksession, args.checkepoch, args.checkpoint))
     print(f'\n ---------> model path: {load_name}\n')
 
-    # initialize the network here.
-    if args.net == 'vgg16':
-        fasterRCNN = vgg16(imdb.classes, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res101':
-        fasterRCNN = resnet(imdb.classes, 101, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res50':
-        fasterRCNN = resnet(imdb.classes, 50, pretrained=False, class_agnostic=args.class_agnostic)
-    elif args.net == 'res152':
-        fasterRCNN = resnet(imdb.classes, 152, pretrained=False, class_agnostic=args.class_agnostic)
-    else:
-        print("network is not defined")
-        pdb.set_trace()
-
-    fasterRCNN.create_architecture()
-
-    # load model weights
-    print("load checkpoint %s" % (load_name))
-    checkpoint = torch.load(load_name)
-    fasterRCNN.load_state_dict(checkpoint['model'])
-    if 'pooling_mode' in checkpoint.keys():
-        cfg.POOLING_MODE = checkpoint['pooling_mode']
-    print('load model successfully!')
-
-    # initialize the tensor holder here.
-    im_data = torch.FloatTensor(1).to(device)
-    im_info = torch.FloatTensor(1).to(device)
-    num_boxes = torch.LongTensor(1).to(device)
-    gt_boxes = torch.FloatTensor(1).to(device)
-    box_info = torch.FloatTensor(1).to(device)
-
     pascal_classes = np.asarray(['__background__', 'targetobject', 'hand'])
 
+    # initialize the network and the tensor holders here, GPU or CPU is chosen automatically
+    detector = HandObjectDetector(load_name, args.net, imdb.classes, args.class_agnostic,
+                                  thresh_hand=args.thresh_hand, thresh_obj=args.thresh_obj)
+
 
     """
     start test
     """
-    fasterRCNN.to(device)
     start = time.time()
     max_per_image = 100
     vis = args.vis
@@ -197,114 +161,25 @@ if __name__ == '__main__':
     _t = {'im_detect': time.time(), 'misc': time.time()}
     det_file = os.path.join(output_dir, 'detections.pkl')
 
-    fasterRCNN.eval()
     empty_array = np.transpose(np.array([[], [], [], [], []]), (1, 0))  # 2D array, (1, 5)
 
     for i in range(num_images):
         data = next(data_iter)
-        with torch.no_grad():
-            im_data.resize_(data[0].size()).copy_(data[0])    # 4D tensor (1, 3, h, w)
-            im_info.resize_(data[1].size()).copy_(data[1])    # 2D tensor [[h, w, scale_factor]]
-            gt_boxes.resize_(data[2].size()).copy_(data[2])    # 2D tensor [[x1, y1, x2, y2, cls], [], ...]
-            num_boxes.resize_(data[3].size()).copy_(data[3])    # 1D tensor [num_boxes]
-            box_info.resize_(data[4].size()).copy_(data[4])    # link gt label, 2D tensor [[contactstate, handside, magnitude, unitdx, unitdy], [], ...]]
-
-        # 1. get predictions for one image from Faster R-CNN
+
+        # 1. get the detections for one image: predictions, score threshold and NMS for each class
         det_tic = time.time()
-        rois, cls_prob, bbox_pred, \
-        rpn_loss_cls, rpn_loss_box, \
-        RCNN_loss_cls, RCNN_loss_bbox, \
-        rois_label, loss_list = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, box_info)
-
-        class_scores = cls_prob.data    # class predictions, 3D tensor (batch, 128, num_classes), each row is processed by softmax: [0.1, 0.1, 0.8]
-        boxes = rois.data[:, :, 1:5]    # roi coordinates, 3D tensor (batch, 128, 4), each row: [x1, y1, x2, y2]
-        hand_contacts = loss_list[0][0]    # contactstate class predictions, 3D tensor (batch, 128, 5), cls cls_scores are before softmax
-        hand_vector = loss_list[1][0].detach()    # link predictions, 3D tensor (batch, 128, 3), each row is [magnitude, dx, dy]
-        lr_vector = loss_list[2][0].detach()    # handside predictions, 2D tensor (batch, 128), cls cls_scores are before softmax
-
-        # 2. postprocess contact predictions
-        maxs, indices = torch.max(hand_contacts, 2)    # max: 2D tensor (batch, 128), index: 2D tensor (batch, 128)
-        indices = indices.squeeze(0).unsqueeze(-1).float()    # (1, 128) ==> (128, 1)
-
-        """might be problematic, each row of nc_prob is [1], I guess the author meant sigmoid """
-        nc_prob = F.softmax(hand_contacts[:, :, 0].squeeze(0).unsqueeze(-1).float().detach(), dim=1)    # no contact, 2D tensor (128, 1)
-
-        # 3. postprocess hand side predictions
-        lr = torch.sigmoid(lr_vector) > 0.5    # mask matrix
-        lr = lr.squeeze(0).float()    # 1D tensor, (128)
-
-        # 4. postprocess bbox predictions (get absolute bbox coordinates)
-        if cfg.TEST.BBOX_REG:
-            box_deltas = bbox_pred.data    # bbox delta prediction, 3D tensor (batch, 128, 4*num_total_classes)
-
-            # normalize bbox coordinates by a pre-computed mean and stdev
-            if cfg.TRAIN.BBOX_NORMALIZE_TARGETS_PRECOMPUTED:
-                if args.class_agnostic:
-                    box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).to(device) \
-                                 + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).to(device)
-                    box_deltas = box_deltas.view(1, -1, 4)
-                else:
-                    box_deltas = box_deltas.view(-1, 4) * torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).to(device) \
-                                 + torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).to(device)
-                    box_deltas = box_deltas.view(1, -1, 4 * len(imdb.classes))    # 3D tensor (1, 128, 4*num_total_classes)
-
-            pred_boxes = bbox_transform_inv(boxes, box_deltas, 1)    # final bbox prediction, 3D tensor (1, 128, 4*num_total_classes)
-            pred_boxes = clip_boxes(pred_boxes, im_info.data, 1)
-
-        # Simply repeat the boxes, once for each class
-        else:
-            pred_boxes = np.tile(boxes, (1, class_scores.shape[1]))
-
-        pred_boxes /= data[1][0][2].item()    # back to original image scale
-
-        # 5. apply NMS
-        class_scores = class_scores.squeeze()    # (1, 128, num_classes) ==> (128, num_classes)
-        pred_boxes = pred_boxes.squeeze()    # (1, 128, 4*num_total_classes) ==> (128, 4*num_classes)
+        obj_dets, hand_dets = detector.detect_blob(data[0], data[1])[0]    # 2D array (keep_num, 10) or None
         det_toc = time.time()
         detect_time = det_toc - det_tic
         misc_tic = time.time()
-        if args.vis:
-            im = cv2.imread(imdb.image_path_at(i))
-            im2show = np.copy(im)
 
-        # nms for each class
+        # 2. save the one class detections (keep_num, 11) into 2D list
         for j in range(1, imdb.num_classes):
-
-            # pick out the index whose class predictions > 0.5
-            if pascal_classes[j] == 'hand':
-                inds = torch.nonzero(class_scores[:, j] > args.thresh_hand).view(-1)    # 1D tensor (num)
-            elif pascal_classes[j] == 'targetobject':
-                inds = torch.nonzero(class_scores[:, j] > args.thresh_obj).view(-1)
-            else:
-                inds = torch.nonzero(class_scores[:, j] > args.thresh_obj).view(-1)
-
-            if inds.numel() > 0:
-                cls_scores = class_scores[:, j][inds]    # class_score whose prob > threshold, 1D tensor (num)
-                _, order = torch.sort(cls_scores, 0, True)    # sort from high to low, order: 1D tensor (num)
-                if args.class_agnostic:
-                    cls_boxes = pred_boxes[inds, :]
-                else:
-                    cls_boxes = pred_boxes[inds][:, j*4 : (j+1)*4]    # pick out bbox whose cls prob > threshold, 2D tensor (num, 4)
-
-                # all detections for one class, 2D tensor (num, 11)
-                cls_dets = torch.cat((cls_boxes,    # bbox, 2D tensor (num, 4)
-                                      cls_scores.unsqueeze(1),    # class, 2D tensor (num, 1)
-                                      indices[inds, :],    # contact state, 2D tensor (num, 1)
-                                      hand_vector.squeeze(0)[inds, :],    # link, 2D tensor (num, 3)
-                                      lr[inds, :],    # hand side, 2D tensor (num, 1)
-                                      nc_prob[inds, :]),    # no contact, 2D tensor (num, 1)
-                                     1)
-                cls_dets = cls_dets[order]
-
-                # apply NMS
-                keep = nms(cls_boxes[order, :], cls_scores[order], cfg.TEST.NMS)
-                cls_dets = cls_dets[keep.view(-1).long()]    # 2D tensor (keep_num, 11)
-
-                if args.vis:
-                    im2show = vis_detections_filtered_objects_PIL(im2show, imdb.classes[j], cls_dets.cpu().numpy(), 0.1)
-
-                # save the one class detections (keep_num, 11) into 2D list
-                all_boxes[j][i] = cls_dets.cpu().numpy()
+            cls_dets = hand_dets if pascal_classes[j] == 'hand' else obj_dets
+            if cls_dets is not None:
+                # no contact prob, each row is [1], the softmax is applied over a single logit
+                nc_prob = np.ones((cls_dets.shape[0], 1), dtype=cls_dets.dtype)
+                all_boxes[j][i] = np.hstack((cls_dets, nc_prob))
             else:
                 all_boxes[j][i] = empty_array
 
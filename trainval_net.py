@@ -18,8 +18,10 @@ from torch.utils.data.sampler import Sampler
 
 from roi_data_layer.roidb import combined_roidb
 from roi_data_layer.roibatchLoader import roibatchLoader
+from roi_data_layer.bucket_sampler import BucketBatchSampler, PadCollate, padding_waste
 from model.utils.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
-from model.utils.net_utils import adjust_learning_rate, save_checkpoint, clip_gradient
+from model.utils.net_utils import adjust_learning_rate, save_checkpoint, clip_gradient, amp_autocast, amp_grad_scaler
+from model.utils.blob import blob_from_uint8
 from model.faster_rcnn.vgg16 import vgg16
 from model.faster_rcnn.resnet import resnet
 
@@ -69,6 +71,19 @@ def parse_args():
     parser.add_argument('--cag', dest='class_agnostic',
                         help='whether perform class_agnostic bbox regression',
                         action='store_true')
+    parser.add_argument('--amp', dest='amp',
+                        help='mixed-precision training (autocast + GradScaler), needs --cuda',
+                        action='store_true')
+    parser.add_argument('--buckets', dest='buckets',
+                        help='number of aspect ratio buckets of the batches, padded together by the collate, '
+                             '0 keeps the fixed ratio groups',
+                        default=0, type=int)
+    parser.add_argument('--uint8', dest='uint8_blob',
+                        help='load the images as uint8 and normalise them on the device (cfg.UINT8_BLOB)',
+                        action='store_true')
+    parser.add_argument('--image_store', dest='image_store',
+                        help='directory of the packed training images (see pack_images.py)',
+                        default='', type=str)
 
     # config optimization
     parser.add_argument('--o', dest='optimizer',
@@ -164,6 +179,10 @@ if __name__ == '__main__':
         cfg_from_file(args.cfg_file)
     if args.set_cfgs is not None:
         cfg_from_list(args.set_cfgs)
+    if args.image_store:
+        cfg.TRAIN.IMAGE_STORE = args.image_store
+    if args.uint8_blob:
+        cfg.UINT8_BLOB = True
 
     print('Using config:')
     pprint.pprint(cfg)
@@ -187,13 +206,19 @@ if __name__ == '__main__':
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    sampler_batch = sampler(train_size, args.batch_size)
-
     dataset = roibatchLoader(roidb, ratio_list, ratio_index, args.batch_size, \
-                             imdb.num_classes, training=True)
-
-    dataloader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size,
-                                             sampler=sampler_batch, num_workers=args.num_workers, pin_memory=True)
+                             imdb.num_classes, training=True, pad_in_collate=args.buckets > 0)
+
+    if args.buckets > 0:
+        # batches of a single aspect ratio bucket, reshuffled every epoch, padded into one buffer by the collate
+        batch_sampler = BucketBatchSampler(ratio_list, args.batch_size, args.buckets)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler,
+                                                 collate_fn=PadCollate(pin_memory=args.num_workers == 0),
+                                                 num_workers=args.num_workers, pin_memory=True)
+    else:
+        sampler_batch = sampler(train_size, args.batch_size)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size,
+                                                 sampler=sampler_batch, num_workers=args.num_workers, pin_memory=True)
 
     # initilize the tensor holder here.
     im_data = torch.FloatTensor(1)
@@ -256,6 +281,12 @@ if __name__ == '__main__':
     elif args.optimizer == "sgd":
         optimizer = torch.optim.SGD(params, momentum=cfg.TRAIN.MOMENTUM)
 
+    # mixed precision: the forward runs under autocast, the loss is scaled so that the fp16 gradients do not underflow
+    if args.amp and not args.cuda:
+        print("WARNING: --amp needs --cuda, training in fp32")
+        args.amp = False
+    scaler = amp_grad_scaler(args.amp)
+
     if args.resume:
         load_name = os.path.join(output_dir,
                                  'faster_rcnn_{}_{}_{}.pth'.format(args.checksession, args.checkepoch, args.checkpoint))
@@ -264,8 +295,18 @@ if __name__ == '__main__':
         args.session = checkpoint['session']
         args.start_epoch = checkpoint['epoch']
         fasterRCNN.load_state_dict(checkpoint['model'])
-        optimizer.load_state_dict(checkpoint['optimizer'])
+        saved_groups = checkpoint['optimizer']['param_groups']
+        if len(saved_groups) == len(optimizer.param_groups):
+            optimizer.load_state_dict(checkpoint['optimizer'])
+        else:
+            # saved before the relation units were stacked (one param group per tensor), the momentum buffers do not
+            # match the parameters any more, only the decayed learning rate is kept
+            print("WARNING: the optimizer state of the checkpoint has {:d} param groups, the model {:d}, "
+                  "starting from a fresh optimizer state".format(len(saved_groups), len(optimizer.param_groups)))
+            adjust_learning_rate(optimizer, saved_groups[0]['lr'] / optimizer.param_groups[0]['lr'])
         lr = optimizer.param_groups[0]['lr']
+        if args.amp and checkpoint.get('scaler'):
+            scaler.load_state_dict(checkpoint['scaler'])
         if 'pooling_mode' in checkpoint.keys():
             cfg.POOLING_MODE = checkpoint['pooling_mode']
         print("loaded checkpoint %s" % (load_name))
@@ -283,6 +324,7 @@ if __name__ == '__main__':
         # setting to train mode
         fasterRCNN.train()
         loss_temp = 0
+        waste_temp = 0
         start = time.time()
 
         if epoch % (args.lr_decay_step + 1) == 0:
@@ -290,22 +332,29 @@ if __name__ == '__main__':
             lr *= args.lr_decay_gamma
 
         data_iter = iter(dataloader)
-        iters_per_epoch = int(train_size / args.batch_size)
+        iters_per_epoch = len(dataloader) if args.buckets > 0 else int(train_size / args.batch_size)
         for step in range(iters_per_epoch):
             data = next(data_iter)
+            if args.buckets > 0:
+                waste_temp += padding_waste(data[5], data[1])
             with torch.no_grad():
-                im_data.resize_(data[0].size()).copy_(data[0])
+                if cfg.UINT8_BLOB:
+                    im_data = blob_from_uint8(data[0].to(im_info.device, non_blocking=True))
+                else:
+                    im_data.resize_(data[0].size()).copy_(data[0])
                 im_info.resize_(data[1].size()).copy_(data[1])
                 gt_boxes.resize_(data[2].size()).copy_(data[2])
                 num_boxes.resize_(data[3].size()).copy_(data[3])
                 box_info.resize_(data[4].size()).copy_(data[4])
 
             fasterRCNN.zero_grad()
-            rois, cls_prob, bbox_pred, \
-            rpn_loss_cls, rpn_loss_box, \
-            RCNN_loss_cls, RCNN_loss_bbox, \
-            rois_label, loss_list = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, box_info)
+            with amp_autocast(args.amp):
+                rois, cls_prob, bbox_pred, \
+                rpn_loss_cls, rpn_loss_box, \
+                RCNN_loss_cls, RCNN_loss_bbox, \
+                rois_label, loss_list = fasterRCNN(im_data, im_info, gt_boxes, num_boxes, box_info)
 
+            # the losses are fp32 (autocast runs the losses in fp32, the others are fp32 islands)
             loss = rpn_loss_cls.mean() + rpn_loss_box.mean() \
                    + RCNN_loss_cls.mean() + RCNN_loss_bbox.mean()
 
@@ -316,17 +365,20 @@ if __name__ == '__main__':
 
             loss_temp += loss.item()
 
-            # backward
+            # backward, the scaler is a no-op without --amp
             optimizer.zero_grad()
-            loss.backward()
+            scaler.scale(loss).backward()
             if args.net == "vgg16":
+                scaler.unscale_(optimizer)    # clip the true gradients
                 clip_gradient(fasterRCNN, 10.)
-            optimizer.step()
+            scaler.step(optimizer)    # skipped when the scaled gradients overflow
+            scaler.update()
 
             if step % args.disp_interval == 0:
                 end = time.time()
                 if step > 0:
                     loss_temp /= (args.disp_interval + 1)
+                    waste_temp /= (args.disp_interval + 1)
 
                 if args.mGPUs:
                     loss_rpn_cls = rpn_loss_cls.mean().item()
@@ -351,6 +403,10 @@ if __name__ == '__main__':
 
                 print("[session %d][epoch %2d][iter %4d/%4d] loss: %.4f, lr: %.2e" \
                       % (args.session, epoch, step, iters_per_epoch, loss_temp, lr))
+                if args.amp:
+                    print("\t\t\tloss scale: %.1f" % (scaler.get_scale()))
+                if args.buckets > 0:
+                    print("\t\t\tpadding waste: %.3f" % (waste_temp))
                 print("\t\t\tfg/bg=(%d/%d), time cost: %f" % (fg_cnt, bg_cnt, end - start))
                 print("\t\t\trpn_cls: %.4f, rpn_box: %.4f, rcnn_cls: %.4f, rcnn_box %.4f" \
                       % (loss_rpn_cls, loss_rpn_box, loss_rcnn_cls, loss_rcnn_box))
@@ -368,10 +424,14 @@ if __name__ == '__main__':
                         'loss_hand_dydx': loss_hand_dydx,
                         'loss_hand_lr': loss_hand_lr
                     }
+                    if args.buckets > 0:
+                        logger.add_scalar("logs_s_{}/padding_waste".format(args.session), waste_temp,
+                                          (epoch - 1) * iters_per_epoch + step)
                     logger.add_scalars("logs_s_{}/losses".format(args.session), info,
                                        (epoch - 1) * iters_per_epoch + step)
 
                 loss_temp = 0
+                waste_temp = 0
                 start = time.time()
 
         save_name = os.path.join(output_dir, 'faster_rcnn_{}_{}_{}.pth'.format(args.session, epoch, step))
@@ -380,6 +440,7 @@ if __name__ == '__main__':
             'epoch': epoch + 1,
             'model': fasterRCNN.module.state_dict() if args.mGPUs else fasterRCNN.state_dict(),
             'optimizer': optimizer.state_dict(),
+            'scaler': scaler.state_dict(),
             'pooling_mode': cfg.POOLING_MODE,
             'class_agnostic': args.class_agnostic,
         }, save_name)